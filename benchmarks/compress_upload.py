@@ -0,0 +1,132 @@
+'''
+Compares the end to end time of uploading a crawl style CSV with and without
+--compress.
+
+By default the local backend is used with the upload throttled to --bandwidth MB/s,
+to stand in for a slow uplink. Pass --backend cli or python with a real bucket and
+dataset (and --bandwidth 0) to time real uploads.
+
+    python benchmarks/compress_upload.py --rows 1000000 --bandwidth 5
+'''
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bq_upload.bootstrap as bootstrap
+
+
+class ThrottledBackend:
+    '''
+    Wraps a backend so uploads take as long as they would at a given bandwidth.
+    '''
+    def __init__(self, backend, bandwidth):
+        self.backend = backend
+        self.bandwidth = bandwidth
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def upload_file(self, local_path, bucket, object_name, move=False):
+        if self.bandwidth:
+            time.sleep(os.path.getsize(local_path) / (self.bandwidth * 1024 * 1024))
+        return self.backend.upload_file(local_path, bucket, object_name, move)
+
+    def upload_stream(self, stream, bucket, object_name, size=None):
+        return self.backend.upload_stream(ThrottledStream(stream, self.bandwidth), bucket, object_name, size)
+
+
+class ThrottledStream:
+    '''
+    Wraps a file-like object so reading it takes as long as uploading it would at a
+    given bandwidth.
+    '''
+    def __init__(self, stream, bandwidth):
+        self.stream = stream
+        self.bandwidth = bandwidth
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if self.bandwidth:
+            time.sleep(len(data) / (self.bandwidth * 1024 * 1024))
+        return data
+
+
+def write_crawl_csv(path, rows):
+    '''
+    This function writes a CSV that looks like the output of a site crawl.
+    '''
+    statuses = ["200", "200", "200", "200", "301", "404"]
+    words = ["shoes", "running", "mens", "womens", "sale", "blue", "trail", "size", "guide"]
+    with open(path, 'w') as f:
+        f.write("url,status_code,title,word_count,crawled_at\n")
+        for i in range(rows):
+            slug = "-".join(random.sample(words, 3))
+            f.write("https://www.example.com/category/{0}/{1},{2},{3} | Example Store,{4},"
+                    "2023-05-{5:02d} 10:{6:02d}:00\n".format(
+                        slug, i, random.choice(statuses), slug.replace("-", " ").title(),
+                        random.randint(50, 3000), i % 28 + 1, i % 60))
+
+
+def run_upload(path, args, compress):
+    '''
+    This function runs the upload of one file.
+
+    Returns: The number of seconds it took.
+    '''
+    argv = ["bq-upload", path, args.bucket, args.dataset, args.table,
+            "-b", args.backend, "-nc", "True"]
+    if args.backend == "local":
+        argv += ["-lb", args.local_backend_path]
+    if compress:
+        argv += ["-z", "True"]
+
+    sys.argv = argv
+    start_time = time.time()
+    bootstrap.main()
+    return time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times uploads with and without --compress.")
+    parser.add_argument("--rows", default=500000, type=int,
+                        help="The number of rows in the generated CSV. Default: 500000.")
+    parser.add_argument("--bandwidth", default=10.0, type=float,
+                        help="The simulated upload speed in MB/s, 0 to not throttle. Default: 10.")
+    parser.add_argument("--backend", default="local", choices=["cli", "python", "local"])
+    parser.add_argument("--bucket", default="bq-upload-benchmark")
+    parser.add_argument("--dataset", default="benchmark")
+    parser.add_argument("--table", default="compress_upload")
+    parser.add_argument("--repeat", default=3, type=int,
+                        help="The number of times to run each mode. Default: 3.")
+    args = parser.parse_args()
+
+    real_get_backend = bootstrap.get_backend
+    bootstrap.get_backend = lambda backend_args: ThrottledBackend(real_get_backend(backend_args), args.bandwidth)
+
+    with tempfile.TemporaryDirectory() as folder:
+        args.local_backend_path = os.path.join(folder, "backend")
+        path = os.path.join(folder, "crawl.csv")
+        write_crawl_csv(path, args.rows)
+        size = os.path.getsize(path) / 1024 / 1024
+
+        timings = {"uncompressed": [], "compressed": []}
+        for _ in range(args.repeat):
+            timings["uncompressed"].append(run_upload(path, args, compress=False))
+            timings["compressed"].append(run_upload(path, args, compress=True))
+
+    print("")
+    print("{0} rows, {1:.1f}MB, {2} MB/s uplink, best of {3}:".format(
+        args.rows, size, args.bandwidth or "unthrottled", args.repeat))
+    for mode, times in timings.items():
+        print("  {0:<13} {1:.2f}s".format(mode, min(times)))
+    print("  speed up      {0:.2f}x".format(min(timings["uncompressed"]) / min(timings["compressed"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+'''
+Stand-ins for the gcloud, gsutil and bq command line tools, for benchmarking the
+cli backend without a Google Cloud account. They take the same arguments bq-upload
+passes to the real tools, print output in the same shape and keep buckets and
+datasets on disk through the local backend.
+
+They are configured with environment variables:
+
+    FAKE_SDK_ROOT          The folder buckets and datasets are kept in.
+    FAKE_SDK_LATENCY       Seconds every command waits before doing anything, to
+                           stand in for the start up and round trip of the real
+                           tools. Default: 0.
+    FAKE_SDK_BANDWIDTH     The upload speed of gsutil cp and mv in MB/s, 0 to not
+                           throttle. Default: 0.
+    FAKE_SDK_LOAD_SECONDS  How long every bq load job runs for. Default: 0.
+    FAKE_SDK_FAIL          Comma separated commands which fail, e.g. "bq load,gsutil cp".
+    FAKE_SDK_FAILURE_RATE  The chance each of those commands fails. Default: 1.
+
+Every command run is appended to calls.log in FAKE_SDK_ROOT.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from bq_upload.backends import BackendError, LocalBackend
+
+
+PROJECT = "fake-project"
+
+
+class ThrottledReader:
+    '''
+    Wraps a file object so reading it takes as long as uploading it would at a
+    given bandwidth.
+    '''
+    def __init__(self, stream, bandwidth):
+        self.stream = stream
+        self.bandwidth = bandwidth
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if self.bandwidth:
+            time.sleep(len(data) / (self.bandwidth * 1024 * 1024))
+        return data
+
+
+def should_fail(command):
+    '''
+    This function decides whether a command fails this time.
+
+    Returns: A boolean.
+    '''
+    failing = [c.strip() for c in os.environ.get("FAKE_SDK_FAIL", "").split(",") if c.strip()]
+    if command not in failing:
+        return False
+    return random.random() < float(os.environ.get("FAKE_SDK_FAILURE_RATE", "1"))
+
+
+def split_uri(uri):
+    '''
+    Returns: A tuple of the bucket and object name of a gs:// URI.
+    '''
+    bucket, _, object_name = uri[len("gs://"):].rstrip("/").partition("/")
+    return bucket, object_name
+
+
+def gcloud(backend, args):
+    if args[:2] == ["config", "list"]:
+        print("[core]\naccount = benchmark@example.com\nproject = {}".format(PROJECT))
+    elif args[:2] == ["projects", "describe"]:
+        print("projectId: {}".format(args[2]))
+    elif args[:2] == ["projects", "list"]:
+        print("PROJECT_ID\n{}".format(PROJECT))
+    return 0
+
+
+def gsutil(backend, args):
+    args = [a for a in args if a not in ("-m", "-q")]
+    command, args = args[0], args[1:]
+
+    if command in ("ls", "list"):
+        buckets = backend.list_buckets()
+        if buckets:
+            print(buckets)
+    elif command == "mb":
+        backend.create_bucket(None, split_uri(args[-1])[0])
+    elif command in ("cp", "mv"):
+        bucket, object_name = split_uri(args[1])
+        bandwidth = float(os.environ.get("FAKE_SDK_BANDWIDTH", "0"))
+        try:
+            if args[0] == "-":
+                backend.upload_stream(ThrottledReader(sys.stdin.buffer, bandwidth), bucket, object_name)
+            else:
+                with open(args[0], 'rb') as f:
+                    backend.upload_stream(ThrottledReader(f, bandwidth), bucket, object_name)
+                if command == "mv":
+                    os.remove(args[0])
+        except BackendError as e:
+            sys.stderr.write("{}\n".format(e))
+            return 1
+        sys.stderr.write("Operation completed over 1 objects.\n")
+    elif command == "cat":
+        start, end = (int(n) for n in args[1].split("-"))
+        bucket, object_name = split_uri(args[2])
+        sys.stdout.buffer.write(backend.read_range(bucket, object_name, start, end + 1))
+    elif command == "stat":
+        generation = backend.get_object_generation(*split_uri(args[0]))
+        if generation is None:
+            sys.stderr.write("No URLs matched: {}\n".format(args[0]))
+            return 1
+        sys.stdout.write("{0}:\n    Generation:             {1}\n".format(args[0], generation))
+    elif command == "compose":
+        bucket, object_name = split_uri(args[-1])
+        try:
+            backend.compose(bucket, [split_uri(uri)[1] for uri in args[:-1]], object_name)
+        except BackendError as e:
+            sys.stderr.write("{}\n".format(e))
+            return 1
+    elif command == "rm":
+        for uri in args:
+            bucket, object_name = split_uri(uri)
+            backend.delete_objects(bucket, [object_name])
+    return 0
+
+
+def bq(backend, args):
+    global_flags = {}
+    while args[0].startswith("--"):
+        name, _, value = args.pop(0)[2:].partition("=")
+        global_flags[name] = value or True
+    command, args = args[0], args[1:]
+
+    if command == "ls":
+        if not backend.dataset_exists(args[0]):
+            print("BigQuery error in ls operation: Not found: Dataset {0}:{1}".format(PROJECT, args[0]))
+    elif command == "mk":
+        print(backend.create_dataset(args[0]))
+    elif command == "load":
+        options = {}
+        positional = []
+        for arg in args:
+            if arg.startswith("--"):
+                name, _, value = arg[2:].partition("=")
+                options[name] = value or True
+            else:
+                positional.append(arg)
+        if "schema" in options:
+            # --schema takes the next argument.
+            options["schema"] = positional.pop(0)
+        table, source_uris = positional[0], positional[1].split(",")
+        if "nosync" in global_flags:
+            backend.submit_load(global_flags['job_id'], source_uris, table, options)
+            print("Successfully started load {0}:{1}".format(PROJECT, global_flags['job_id']))
+            return 0
+        succeeded, output = backend.load(source_uris, table, options)
+        print(output)
+        return 0 if succeeded else 1
+    elif command == "show" and args[0] == "-j":
+        try:
+            done, succeeded, output = backend.get_load_status(args[1])
+        except BackendError as e:
+            print(e)
+            return 1
+        job = {"jobReference": {"projectId": PROJECT, "jobId": args[1]},
+               "status": {"state": "DONE" if done else "RUNNING"}}
+        if done and succeeded:
+            job['statistics'] = {"load": {"outputRows": "0"}}
+        elif done:
+            job['status']['errorResult'] = {"reason": "invalid",
+                                            "message": output.split(" operation: ", 1)[-1]}
+        print(json.dumps(job))
+    return 0
+
+
+TOOLS = {"gcloud": gcloud, "gsutil": gsutil, "bq": bq}
+
+
+def main(tool, args):
+    root = os.environ.get("FAKE_SDK_ROOT", os.path.expanduser("~/.bq_upload/fake_sdk"))
+    backend = LocalBackend(root)
+    backend.load_seconds = float(os.environ.get("FAKE_SDK_LOAD_SECONDS", "0"))
+    with open(os.path.join(root, "calls.log"), 'a') as f:
+        f.write(" ".join([tool] + args) + "\n")
+
+    time.sleep(float(os.environ.get("FAKE_SDK_LATENCY", "0")))
+
+    command = " ".join([tool] + [a for a in args if not a.startswith("-")][:1])
+    if should_fail(command):
+        if tool == "bq":
+            print("BigQuery error in {} operation: Error processing job: backendError".format(command.split()[-1]))
+        else:
+            sys.stderr.write("ServiceException: 503 Backend Error from the fake SDK.\n")
+        sys.exit(1)
+
+    sys.exit(TOOLS[tool](backend, args))
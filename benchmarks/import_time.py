@@ -0,0 +1,120 @@
+'''
+Checks how long the tool takes to start. The import of bq_upload.bootstrap is timed
+with python -X importtime, and bq-upload --help end to end, each in a new process.
+It exits with an error if either takes longer than its budget, or if a heavy package
+like pandas is imported before a file needs it.
+
+    python benchmarks/import_time.py --import_budget 150 --help_budget 300
+'''
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Packages only the code paths which need them should import.
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "fastavro", "tarfile", "zipfile", "multiprocessing"]
+
+
+def run_python(code, *options):
+    '''
+    This function runs some Python in a new process, with the repository on the path.
+
+    Returns: A tuple of the process' stdout and stderr and the number of seconds it took.
+    '''
+    code = "import sys; sys.path.insert(0, {0!r}); {1}".format(ROOT, code)
+    start_time = time.time()
+    process = subprocess.run([sys.executable] + list(options) + ["-c", code],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    seconds = time.time() - start_time
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+    return process.stdout, process.stderr, seconds
+
+
+def parse_importtime(output):
+    '''
+    This function reads the output of python -X importtime.
+
+    Returns: A dictionary of module name to its cumulative import time in ms.
+    '''
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative) / 1000
+    return modules
+
+
+def time_import():
+    '''
+    This function times the import of bq_upload.bootstrap in a new process.
+
+    Returns: A tuple of the import time in ms, the cumulative time of every module
+    it imported and the heavy modules which were imported.
+    '''
+    code = ("import bq_upload.bootstrap; "
+            "print(' '.join(m for m in {0!r} if m in sys.modules))".format(HEAVY_MODULES))
+    stdout, stderr, _ = run_python(code, "-X", "importtime")
+    modules = parse_importtime(stderr)
+    return modules["bq_upload.bootstrap"], modules, stdout.split()
+
+
+def time_help():
+    '''
+    This function times bq-upload --help in a new process.
+
+    Returns: A tuple of the number of ms it took and the heavy modules it imported.
+    '''
+    code = ("import bq_upload.bootstrap as bootstrap; sys.argv = ['bq-upload', '--help']\n"
+            "try:\n    bootstrap.main()\nexcept SystemExit:\n    pass\n"
+            "print(' '.join(m for m in {0!r} if m in sys.modules), file=sys.stderr)".format(HEAVY_MODULES))
+    _, stderr, seconds = run_python(code)
+    return seconds * 1000, stderr.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the tool starts quickly.")
+    parser.add_argument("--import_budget", default=150.0, type=float,
+                        help="The most ms the import of bq_upload.bootstrap may take. Default: 150.")
+    parser.add_argument("--help_budget", default=300.0, type=float,
+                        help="The most ms bq-upload --help may take, including starting Python. Default: 300.")
+    parser.add_argument("--repeat", default=5, type=int,
+                        help="The number of times to run each. Default: 5.")
+    parser.add_argument("--top", default=10, type=int,
+                        help="The number of slowest modules to list. Default: 10.")
+    args = parser.parse_args()
+
+    imports = [time_import() for _ in range(args.repeat)]
+    helps = [time_help() for _ in range(args.repeat)]
+    import_ms, modules, imported = min(imports, key=lambda run: run[0])
+    help_ms = min(ms for ms, _ in helps)
+    imported = sorted(set(imported).union(*[heavy for _, _, heavy in imports], *[heavy for _, heavy in helps]))
+
+    print("")
+    print("Best of {0}:".format(args.repeat))
+    print("  import bq_upload.bootstrap {0:>8.1f}ms (budget {1:.0f}ms)".format(import_ms, args.import_budget))
+    print("  bq-upload --help           {0:>8.1f}ms (budget {1:.0f}ms)".format(help_ms, args.help_budget))
+    print("  slowest modules imported:")
+    for name, ms in sorted(modules.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print("    {0:<30} {1:>8.1f}ms".format(name, ms))
+
+    failures = []
+    if import_ms > args.import_budget:
+        failures.append("The import took {0:.1f}ms, over the budget of {1:.0f}ms.".format(import_ms, args.import_budget))
+    if help_ms > args.help_budget:
+        failures.append("--help took {0:.1f}ms, over the budget of {1:.0f}ms.".format(help_ms, args.help_budget))
+    if imported:
+        failures.append("These were imported on startup: {}.".format(", ".join(imported)))
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+'''
+Compares the peak memory use of processing a crawl style CSV in pandas with and
+without --optimise_memory. Each run is a separate process, so its peak resident
+set size (RSS) can be measured on its own. The processed files are checked to be
+identical.
+
+The local backend is used. Peak RSS is read with os.wait4, which isn't available
+on Windows.
+
+    python benchmarks/memory_usage.py --rows 2000000
+'''
+
+import os
+import sys
+import time
+import filecmp
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compress_upload import write_crawl_csv
+
+
+def run_upload(path, args, optimise, local_backend_path):
+    '''
+    This function runs the processing and upload of one file in a new process.
+
+    Returns: A tuple of the peak RSS of the process in MB and the number of seconds it took.
+    '''
+    argv = ["bq-upload", path, args.bucket, args.dataset, args.table,
+            "-b", "local", "-lb", local_backend_path, "-nc", "True", "-pp", "True"]
+    if optimise:
+        argv += ["-om", "True"]
+    code = ("import sys; sys.path.insert(0, {0!r}); sys.argv = {1!r}; "
+            "import bq_upload.bootstrap as bootstrap; bootstrap.main()"
+            .format(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), argv))
+
+    start_time = time.time()
+    process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.time() - start_time
+    if status != 0:
+        raise RuntimeError("The upload failed with status {}.".format(status))
+
+    # ru_maxrss is in bytes on macOS and KB everywhere else.
+    return rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures peak memory with and without --optimise_memory.")
+    parser.add_argument("--rows", default=1000000, type=int,
+                        help="The number of rows in the generated CSV. Default: 1000000.")
+    parser.add_argument("--bucket", default="bq-upload-benchmark")
+    parser.add_argument("--dataset", default="benchmark")
+    parser.add_argument("--table", default="memory_usage")
+    parser.add_argument("--repeat", default=1, type=int,
+                        help="The number of times to run each mode. Default: 1.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "crawl.csv")
+        write_crawl_csv(path, args.rows)
+        size = os.path.getsize(path) / 1024 / 1024
+
+        measurements = {"default": [], "optimise_memory": []}
+        for _ in range(args.repeat):
+            for mode in measurements:
+                measurements[mode].append(run_upload(path, args, mode == "optimise_memory",
+                                                     os.path.join(folder, mode)))
+
+        outputs = [os.path.join(folder, mode, "storage", args.bucket, "crawl.csv") for mode in measurements]
+        identical = filecmp.cmp(outputs[0], outputs[1], shallow=False)
+
+    peaks = {mode: min(peak for peak, _ in runs) for mode, runs in measurements.items()}
+    print("")
+    print("{0} rows, {1:.1f}MB, best of {2}:".format(args.rows, size, args.repeat))
+    print("  {0:<16} {1:>12} {2:>10}".format("mode", "peak RSS", "time"))
+    for mode, runs in measurements.items():
+        print("  {0:<16} {1:>10.1f}MB {2:>9.2f}s".format(mode, peaks[mode], min(seconds for _, seconds in runs)))
+    print("  reduction        {0:.0%}".format(1 - peaks["optimise_memory"] / peaks["default"]))
+    print("  output identical: {}".format(identical))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+'''
+Compares the time to process a crawl style CSV, guessing its dates, in a single
+process and split across --processing_workers processes. The processed files are
+checked to be identical.
+
+The local backend is used and the upload isn't throttled, so the time is mostly
+processing.
+
+    python benchmarks/parallel_processing.py --rows 2000000 --workers 8
+'''
+
+import os
+import sys
+import time
+import filecmp
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bq_upload.bootstrap as bootstrap
+from compress_upload import write_crawl_csv
+
+
+def run_upload(path, args, workers, local_backend_path):
+    '''
+    This function runs the processing and upload of one file.
+
+    Returns: The number of seconds it took.
+    '''
+    sys.argv = ["bq-upload", path, args.bucket, args.dataset, args.table,
+                "-b", "local", "-lb", local_backend_path, "-nc", "True", "-gd", "True",
+                "-pw", str(workers)]
+    start_time = time.time()
+    bootstrap.main()
+    return time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times processing with and without --processing_workers.")
+    parser.add_argument("--rows", default=1000000, type=int,
+                        help="The number of rows in the generated CSV. Default: 1000000.")
+    parser.add_argument("--workers", default=os.cpu_count(), type=int,
+                        help="The number of processes to compare against one. Default: the number of cores.")
+    parser.add_argument("--bucket", default="bq-upload-benchmark")
+    parser.add_argument("--dataset", default="benchmark")
+    parser.add_argument("--table", default="parallel_processing")
+    parser.add_argument("--repeat", default=3, type=int,
+                        help="The number of times to run each mode. Default: 3.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "crawl.csv")
+        write_crawl_csv(path, args.rows)
+        size = os.path.getsize(path) / 1024 / 1024
+
+        timings = {"1 process": [], "{} processes".format(args.workers): []}
+        for _ in range(args.repeat):
+            for mode, workers in zip(timings, (1, args.workers)):
+                timings[mode].append(run_upload(path, args, workers, os.path.join(folder, mode)))
+
+        outputs = [os.path.join(folder, mode, "storage", args.bucket, "crawl.csv") for mode in timings]
+        identical = filecmp.cmp(outputs[0], outputs[1], shallow=False)
+
+    print("")
+    print("{0} rows, {1:.1f}MB, best of {2}:".format(args.rows, size, args.repeat))
+    for mode, times in timings.items():
+        print("  {0:<13} {1:.2f}s".format(mode, min(times)))
+    print("  speed up      {0:.2f}x".format(min(timings["1 process"]) / min(list(timings.values())[1])))
+    print("  output identical: {}".format(identical))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+'''
+Compares the end to end time of processing and uploading a crawl style CSV with
+and without --pipeline. Without it the processed file is written to disk and then
+uploaded, with it the upload starts with the first chunk, so the total should come
+close to the slower of processing and uploading rather than their sum.
+
+The local backend is used with the upload throttled to --bandwidth MB/s, as in
+compress_upload.py.
+
+    python benchmarks/pipeline_upload.py --rows 1000000 --bandwidth 2
+'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bq_upload.bootstrap as bootstrap
+from compress_upload import ThrottledBackend, write_crawl_csv
+
+
+def run_upload(path, args, pipeline):
+    '''
+    This function runs the processing and upload of one file, guessing its dates so
+    it goes through pandas.
+
+    Returns: The number of seconds it took.
+    '''
+    argv = ["bq-upload", path, args.bucket, args.dataset, args.table,
+            "-b", args.backend, "-nc", "True", "-gd", "True", "-cs", str(args.chunksize)]
+    if args.backend == "local":
+        argv += ["-lb", args.local_backend_path]
+    if pipeline:
+        argv += ["-pl", "True"]
+
+    sys.argv = argv
+    start_time = time.time()
+    bootstrap.main()
+    return time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times processed uploads with and without --pipeline.")
+    parser.add_argument("--rows", default=500000, type=int,
+                        help="The number of rows in the generated CSV. Default: 500000.")
+    parser.add_argument("--chunksize", default=100000, type=int,
+                        help="The number of rows processed at a time. Default: 100000.")
+    parser.add_argument("--bandwidth", default=2.0, type=float,
+                        help="The simulated upload speed in MB/s, 0 to not throttle. Default: 2.")
+    parser.add_argument("--backend", default="local", choices=["cli", "python", "local"])
+    parser.add_argument("--bucket", default="bq-upload-benchmark")
+    parser.add_argument("--dataset", default="benchmark")
+    parser.add_argument("--table", default="pipeline_upload")
+    parser.add_argument("--repeat", default=3, type=int,
+                        help="The number of times to run each mode. Default: 3.")
+    args = parser.parse_args()
+
+    real_get_backend = bootstrap.get_backend
+    bootstrap.get_backend = lambda backend_args: ThrottledBackend(real_get_backend(backend_args), args.bandwidth)
+
+    with tempfile.TemporaryDirectory() as folder:
+        args.local_backend_path = os.path.join(folder, "backend")
+        path = os.path.join(folder, "crawl.csv")
+        write_crawl_csv(path, args.rows)
+        size = os.path.getsize(path) / 1024 / 1024
+
+        timings = {"sequential": [], "pipelined": []}
+        for _ in range(args.repeat):
+            timings["sequential"].append(run_upload(path, args, pipeline=False))
+            timings["pipelined"].append(run_upload(path, args, pipeline=True))
+
+    print("")
+    print("{0} rows, {1:.1f}MB, {2} MB/s uplink, best of {3}:".format(
+        args.rows, size, args.bandwidth or "unthrottled", args.repeat))
+    for mode, times in timings.items():
+        print("  {0:<13} {1:.2f}s".format(mode, min(times)))
+    print("  speed up      {0:.2f}x".format(min(timings["sequential"]) / min(timings["pipelined"])))
+
+
+if __name__ == "__main__":
+    main()
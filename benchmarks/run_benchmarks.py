@@ -0,0 +1,328 @@
+'''
+Times bq-upload end to end on generated CSV, JSON and zip files of several sizes,
+with the time spent in each stage (sniffing, schema, processing, upload and load)
+recorded separately. The results are written to a JSON file, and can be compared
+against an earlier one to catch regressions.
+
+By default the cli backend is run against the fake gcloud, gsutil and bq in
+benchmarks/fake_sdk, which are put first on the PATH. --latency, --bandwidth,
+--load_seconds and --fail configure them, see benchmarks/fake_sdk/fake_sdk.py.
+
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 --latency 0.5
+    python benchmarks/run_benchmarks.py --baseline benchmark_results.json --output new.json
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import bq_upload.bootstrap as bootstrap
+from bq_upload.metrics import get_records, summarise as summarise_metrics
+from compress_upload import write_crawl_csv
+
+
+# The input each scenario uploads and the options it's uploaded with.
+SCENARIOS = {
+    "csv": ("csv", []),
+    "csv_strict_schema": ("csv", ["-ss", "True"]),
+    "csv_guess_date": ("csv", ["-gd", "True"]),
+    "csv_guess_date_chunked": ("csv", ["-gd", "True", "-cs", "50000"]),
+    "csv_compress": ("csv", ["-z", "True"]),
+    "csv_async_load": ("csv", ["-al", "True"]),
+    "csv_timestamps": ("csv", ["-tc", "crawled_at", "-ts", "%Y-%m-%d %H:%M:%S"]),
+    "csv_timestamps_pandas": ("csv", ["-tc", "crawled_at", "-ts", "%Y-%m-%d %H:%M:%S", "-np", "True"]),
+    "json": ("json", []),
+    "zip_stream": ("zip", ["-sa", "True"]),
+}
+
+# The functions of bootstrap timed as each stage. A stage called from inside another
+# is counted as part of the outer one, e.g. processing in a pipelined upload. Reads
+# of the file into pandas are processing unless they're part of working out a schema.
+STAGES = {
+    "sniffing": ["sniff_file"],
+    "schema": ["get_non_numeric_columns", "create_schema", "infer_schema"],
+    "processing": ["read_csv_to_df", "write_processed_file", "write_processed_file_in_parts",
+                   "format_json_for_upload", "rewrite_timestamps"],
+    "upload": ["upload_to_gsc", "upload_processed_file_in_pipeline", "upload_archive_members"],
+    "load": ["upload_to_bq"],
+}
+
+_stage_state = threading.local()
+stage_times = {}
+failed_loads = []
+
+
+def time_stage(stage, function):
+    '''
+    This function wraps a function so the time spent in it is added to a stage.
+
+    Returns: The wrapped function.
+    '''
+    def timed_function(*args, **kwargs):
+        if getattr(_stage_state, "stage", None):
+            return function(*args, **kwargs)
+        _stage_state.stage = stage
+        start_time = time.time()
+        try:
+            result = function(*args, **kwargs)
+            if stage == "load" and result is False:
+                failed_loads.append(args[0])
+            return result
+        finally:
+            stage_times[stage] = stage_times.get(stage, 0.0) + time.time() - start_time
+            _stage_state.stage = None
+    return timed_function
+
+
+def write_crawl_json(path, rows):
+    '''
+    This function writes a JSON array of crawl style records, which bq-upload turns
+    into newline delimited JSON.
+    '''
+    statuses = [200, 200, 200, 200, 301, 404]
+    with open(path, 'w') as f:
+        f.write("[\n")
+        for i in range(rows):
+            f.write(json.dumps({"url": "https://www.example.com/page/{}".format(i),
+                                "status_code": random.choice(statuses),
+                                "word_count": random.randint(50, 3000),
+                                "crawled_at": "2023-05-{0:02d} 10:{1:02d}:00".format(i % 28 + 1, i % 60)}))
+            f.write(",\n" if i < rows - 1 else "\n")
+        f.write("]\n")
+
+
+def write_input(folder, kind, rows):
+    '''
+    This function generates an input file of the given kind and number of rows.
+
+    Returns: The path of the file.
+    '''
+    path = os.path.join(folder, "crawl_{0}.{1}".format(rows, kind))
+    if kind == "json":
+        write_crawl_json(path, rows)
+    elif kind == "zip":
+        csv_path = os.path.join(folder, "crawl_{}.csv".format(rows))
+        if not os.path.exists(csv_path):
+            write_crawl_csv(csv_path, rows)
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.write(csv_path, "crawl.csv")
+    else:
+        write_crawl_csv(path, rows)
+    return path
+
+
+def count_calls(fake_sdk_root):
+    '''
+    Returns: The number of fake SDK commands run so far.
+    '''
+    calls_log = os.path.join(fake_sdk_root, "calls.log")
+    if not os.path.exists(calls_log):
+        return 0
+    with open(calls_log) as f:
+        return sum(1 for _ in f)
+
+
+def run_scenario(path, options, args, fake_sdk_root):
+    '''
+    This function uploads one file with bq-upload.
+
+    Returns: A dictionary of whether it succeeded, the total time, the time of each
+    stage and the number of fake SDK commands run.
+    '''
+    sys.argv = ["bq-upload", path, args.bucket, args.dataset, args.table,
+                "-b", args.backend, "-nc", "True", "-nm", "True"] + options
+    if args.backend == "local":
+        sys.argv += ["-lb", fake_sdk_root]
+
+    stage_times.clear()
+    del failed_loads[:]
+    calls = count_calls(fake_sdk_root)
+    exited = False
+    start_time = time.time()
+    try:
+        bootstrap.main()
+    except SystemExit:
+        # bq-upload exits when it can't carry on, e.g. an upload failed.
+        exited = True
+    total_time = time.time() - start_time
+
+    return {
+        "succeeded": not exited and not failed_loads,
+        "total_seconds": round(total_time, 4),
+        "stages": {stage: round(stage_times.get(stage, 0.0), 4) for stage in STAGES},
+        "fake_sdk_calls": count_calls(fake_sdk_root) - calls,
+        # What bq-upload recorded itself, including every Cloud SDK command.
+        "metrics": summarise_metrics(get_records()),
+    }
+
+
+def summarise(runs):
+    '''
+    This function takes the fastest of the repeated runs of a scenario, and of each
+    of its stages.
+
+    Returns: A dictionary.
+    '''
+    return {
+        "total_seconds": min(run["total_seconds"] for run in runs),
+        "stages": {stage: min(run["stages"][stage] for run in runs) for stage in STAGES},
+        "failures": sum(1 for run in runs if not run["succeeded"]),
+    }
+
+
+def compare_results(results, baseline, tolerance):
+    '''
+    This function prints how much each scenario and stage has changed since a
+    baseline run. Stages under a hundredth of a second are ignored as noise.
+
+    Returns: A list of the scenarios which got more than tolerance slower.
+    '''
+    old_results = {(r["scenario"], r["rows"]): r["summary"] for r in baseline["results"]}
+    regressions = []
+    print("\nCompared with {}:".format(baseline.get("timestamp")))
+    for result in results:
+        old = old_results.get((result["scenario"], result["rows"]))
+        if old is None:
+            continue
+        new = result["summary"]
+        ratio = new["total_seconds"] / old["total_seconds"] if old["total_seconds"] else 1.0
+        slower_stages = ["{0} {1:+.0%}".format(stage, new["stages"][stage] / old["stages"][stage] - 1)
+                         for stage in STAGES
+                         if old["stages"].get(stage, 0) >= 0.01
+                         and new["stages"][stage] / old["stages"][stage] > 1 + tolerance]
+        regressed = ratio > 1 + tolerance
+        if regressed:
+            regressions.append("{0} ({1} rows)".format(result["scenario"], result["rows"]))
+        print("  {0:<24} {1:>8} rows  {2:+.0%}{3}{4}".format(
+            result["scenario"], result["rows"], ratio - 1, "  REGRESSION" if regressed else "",
+            "  slower: " + ", ".join(slower_stages) if slower_stages else ""))
+    return regressions
+
+
+def get_git_commit():
+    '''
+    Returns: The commit the benchmarks were run at, or None outside a git checkout.
+    '''
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARKS_DIR, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times each stage of bq-upload on generated files.")
+    parser.add_argument("--sizes", default=[10000, 100000], type=int, nargs="+",
+                        help="The numbers of rows in the generated files. Default: 10000 100000.")
+    parser.add_argument("--scenarios", default=list(SCENARIOS), nargs="+", choices=list(SCENARIOS),
+                        help="The scenarios to run. Default: all of them.")
+    parser.add_argument("--repeat", default=3, type=int,
+                        help="The number of times to run each scenario. Default: 3.")
+    parser.add_argument("--backend", default="cli", choices=["cli", "local"],
+                        help="cli runs the fake SDK tools, local uses the local backend in process. "
+                             "Default: cli.")
+    parser.add_argument("--latency", default=0.0, type=float,
+                        help="Seconds every fake SDK command takes on top of starting up. Default: 0.")
+    parser.add_argument("--bandwidth", default=0.0, type=float,
+                        help="The upload speed of the fake gsutil in MB/s, 0 to not throttle. Default: 0.")
+    parser.add_argument("--load_seconds", default=0.0, type=float,
+                        help="How long every fake bq load job runs for. Default: 0.")
+    parser.add_argument("--fail", default="",
+                        help="Comma separated fake SDK commands which fail, e.g. \"bq load\".")
+    parser.add_argument("--failure_rate", default=1.0, type=float,
+                        help="The chance each of the --fail commands fails. Default: 1.")
+    parser.add_argument("--bucket", default="bq-upload-benchmark")
+    parser.add_argument("--dataset", default="benchmark")
+    parser.add_argument("--table", default="benchmark")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="The JSON file the results are written to. Default: benchmark_results.json.")
+    parser.add_argument("--baseline", default=None,
+                        help="An earlier results file to compare against.")
+    parser.add_argument("--tolerance", default=0.2, type=float,
+                        help="How much slower than the baseline a scenario can be before it counts as "
+                             "a regression. Default: 0.2.")
+    args = parser.parse_args()
+
+    for stage, function_names in STAGES.items():
+        for name in function_names:
+            setattr(bootstrap, name, time_stage(stage, getattr(bootstrap, name)))
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        fake_sdk_root = os.path.join(folder, "fake_sdk")
+        os.environ.update({
+            "PATH": os.path.join(BENCHMARKS_DIR, "fake_sdk") + os.pathsep + os.environ["PATH"],
+            "FAKE_SDK_ROOT": fake_sdk_root,
+            "FAKE_SDK_LATENCY": str(args.latency),
+            "FAKE_SDK_BANDWIDTH": str(args.bandwidth),
+            "FAKE_SDK_LOAD_SECONDS": str(args.load_seconds),
+            "FAKE_SDK_FAIL": args.fail,
+            "FAKE_SDK_FAILURE_RATE": str(args.failure_rate),
+            "BQ_UPLOAD_DATA_DIR": os.path.join(folder, "user_data"),
+        })
+        # gsutil ls doesn't list anything if the project has no buckets, which
+        # bq-upload treats as an error, so the bucket is made up front.
+        os.makedirs(os.path.join(fake_sdk_root, "storage", args.bucket))
+
+        inputs = {}
+        for rows in args.sizes:
+            for scenario in args.scenarios:
+                kind, options = SCENARIOS[scenario]
+                if (kind, rows) not in inputs:
+                    inputs[(kind, rows)] = write_input(folder, kind, rows)
+                path = inputs[(kind, rows)]
+
+                runs = [run_scenario(path, options, args, fake_sdk_root) for _ in range(args.repeat)]
+                results.append({
+                    "scenario": scenario,
+                    "rows": rows,
+                    "bytes": os.path.getsize(path),
+                    "options": options,
+                    "runs": runs,
+                    "summary": summarise(runs),
+                })
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"backend": args.backend, "latency": args.latency, "bandwidth": args.bandwidth,
+                     "load_seconds": args.load_seconds, "fail": args.fail, "failure_rate": args.failure_rate, "repeat": args.repeat},
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print("")
+    print("Best of {0}, written to {1}:".format(args.repeat, args.output))
+    print("  {0:<24} {1:>8} {2:>9} ".format("scenario", "rows", "total") +
+          " ".join("{:>10}".format(stage) for stage in STAGES))
+    for result in results:
+        summary = result["summary"]
+        print("  {0:<24} {1:>8} {2:>8.2f}s ".format(result["scenario"], result["rows"], summary["total_seconds"]) +
+              " ".join("{:>9.2f}s".format(summary["stages"][stage]) for stage in STAGES) +
+              ("  {} failed".format(summary["failures"]) if summary["failures"] else ""))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nSlower than the baseline: {}".format(", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""bq_upload.archives: streams the files inside zip and tar archives into the bucket."""
+
+import io
+import os
+import re
+import logging
+from pathlib import Path
+
+from .compression import gzip_chunks
+from .json_stream import iterate_ndjson_lines, lines_are_ndjson, READ_SIZE
+from .line_index import LineIndexBuilder
+from .metrics import count_bytes, timed_stage
+
+
+logger = logging.getLogger(__name__)
+
+
+class GeneratorReader(io.RawIOBase):
+    '''
+    A read-only binary file object over a generator of byte strings, so generated
+    data can be streamed into an upload.
+    '''
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._leftover = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._leftover:
+            try:
+                self._leftover = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._leftover))
+        buffer[:size] = self._leftover[:size]
+        self._leftover = self._leftover[size:]
+        return size
+
+
+def iterate_archive_members(path):
+    '''
+    This function opens a zip or tar archive and yields the name and a binary
+    stream of every file inside it, decompressing as the stream is read. Tar
+    archives are read in a single pass so compressed tars are never seeked.
+    '''
+    if ".tar" in Path(path).suffixes:
+        import tarfile
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member)
+    else:
+        import zipfile
+        with zipfile.ZipFile(path, "r") as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and not info.filename.startswith("__MACOSX/"):
+                    with archive.open(info) as member:
+                        yield info.filename, member
+
+
+def iterate_chunks(stream):
+    '''
+    This function yields a binary stream in blocks of READ_SIZE bytes.
+    '''
+    for chunk in iter(lambda: stream.read(READ_SIZE), b''):
+        yield chunk
+
+
+def iterate_json_member(stream):
+    '''
+    This function yields a JSON archive member as newline delimited JSON, passing it
+    through untouched if it already is.
+    '''
+    buffered = io.BufferedReader(stream, buffer_size=READ_SIZE)
+    head = buffered.peek(READ_SIZE).decode('utf-8-sig', 'replace')
+    if lines_are_ndjson(head.splitlines()[:2]):
+        yield from iterate_chunks(buffered)
+        return
+
+    text = io.TextIOWrapper(buffered, encoding='utf-8-sig')
+    lines = []
+    size = 0
+    for line in iterate_ndjson_lines(text):
+        lines.append(line)
+        size += len(line)
+        if size >= READ_SIZE:
+            yield ''.join(lines).encode('utf-8')
+            lines = []
+            size = 0
+    if lines:
+        yield ''.join(lines).encode('utf-8')
+
+
+def index_chunks(chunks, line_index_builder):
+    '''
+    This function passes a stream of byte strings through, feeding each one to a
+    line index as it goes.
+    '''
+    for chunk in chunks:
+        line_index_builder.feed(chunk)
+        yield chunk
+
+
+def get_member_object_name(member_name, prefix, used_names):
+    '''
+    This function names the object an archive member is uploaded as. The name is the
+    prefix and the member's filename without the characters gsutil doesn't like,
+    numbered if another member of the archive already has that name.
+
+    Returns: A string.
+    '''
+    object_name = re.sub("[&\\*\\?\\-]", "", prefix + os.path.basename(member_name))
+    if object_name in used_names:
+        stem, suffix = os.path.splitext(object_name)
+        number = 2
+        while "{0}_{1}{2}".format(stem, number, suffix) in used_names:
+            number += 1
+        object_name = "{0}_{1}{2}".format(stem, number, suffix)
+    used_names.add(object_name)
+    return object_name
+
+
+def upload_archive_members(backend, path, bucket, compress=False):
+    '''
+    This function streams every file inside an archive into the bucket as its own
+    object, without extracting anything to disk. JSON members are converted to
+    newline delimited JSON on the way and, if compress is set, CSV and JSON members are
+    gzipped.
+
+    Returns: A list of dictionaries with the object name, file format and line index
+    (None if compressed) of each uploaded member.
+    '''
+    uploads = []
+    used_names = set()
+    # Members are prefixed with the archive name so members with the same name in
+    # different archives of a folder don't overwrite each other.
+    prefix = Path(path).name.split(".")[0] + "_"
+    for member_name, member in iterate_archive_members(path):
+        suffixes = Path(member_name).suffixes
+        if ".json" in suffixes:
+            file_format = "NEWLINE_DELIMITED_JSON"
+            chunks = iterate_json_member(member)
+        elif ".avro" in suffixes:
+            file_format = "AVRO"
+            chunks = iterate_chunks(member)
+        else:
+            file_format = "CSV"
+            chunks = iterate_chunks(member)
+
+        line_index_builder = None
+        object_name = get_member_object_name(member_name, prefix, used_names)
+        # Avro files are compressed inside and BigQuery won't load them gzipped.
+        if compress and file_format != "AVRO":
+            chunks = gzip_chunks(chunks)
+            object_name += ".gz"
+        elif file_format != "AVRO":
+            line_index_builder = LineIndexBuilder()
+            chunks = index_chunks(chunks, line_index_builder)
+
+        logger.info("Streaming {0} from the archive to gs://{1}/{2}.".format(member_name, bucket, object_name))
+        with timed_stage("upload", object_name) as stage:
+            backend.upload_stream(io.BufferedReader(GeneratorReader(count_bytes(chunks, stage)), READ_SIZE),
+                                  bucket, object_name)
+
+        uploads.append({
+            "file_upload_name": object_name,
+            "file_format": file_format,
+            "line_index": line_index_builder.build().to_dict() if line_index_builder else None
+        })
+
+    return uploads
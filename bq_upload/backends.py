@@ -0,0 +1,583 @@
+"""bq_upload.backends: the ways of talking to Google Cloud Storage and BigQuery."""
+
+from subprocess import DEVNULL, PIPE, Popen, run
+import os
+import re
+import json
+import shutil
+import logging
+import time
+import tempfile
+import threading
+
+from .metrics import timed_stage
+
+
+logger = logging.getLogger(__name__)
+
+# The size of each request of a resumable upload of a stream of unknown size. It has
+# to be a multiple of 256KB.
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class BackendError(Exception):
+    '''
+    Raised when a backend can't complete an operation. The message is the output
+    of the failed operation so it can be shown to the user.
+    '''
+
+
+def get_command_name(command):
+    '''
+    This function names a command by the tool and what it's asked to do, e.g.
+    "gsutil cp", leaving out the paths and options.
+
+    Returns: A string.
+    '''
+    return " ".join([command[0]] + [arg for arg in command[1:] if not arg.startswith("-")][:1])
+
+
+def run_shell_command(command):
+    '''
+    This function runs a shell command and returns the returncode, stdout and stderr
+    in a dictionary.
+    '''
+    # The Cloud SDK tools are .cmd files on Windows and need the shell to be found.
+    # Elsewhere a list of arguments must not be passed to the shell, or only the
+    # first one is run.
+    with timed_stage("command", get_command_name(command)):
+        result = run(command, stdout=PIPE, stderr=PIPE, universal_newlines=True, shell=(os.name == 'nt'))
+    return {
+        "args":result.args,
+        "code":result.returncode,
+        "stdout":result.stdout,
+        "stderr":result.stderr
+    }
+
+
+def get_job_status(job):
+    '''
+    This function reads the state of a BigQuery job resource, as returned by the API
+    and bq show.
+
+    Returns: A tuple of whether the job has finished, whether it succeeded and its
+    errors or a short description of what it loaded.
+    '''
+    status = job.get('status', {})
+    if status.get('state') != "DONE":
+        return (False, False, status.get('state', "PENDING"))
+    if status.get('errorResult'):
+        errors = [status['errorResult']] + [e for e in status.get('errors', []) if e != status['errorResult']]
+        return (True, False, "BigQuery error in load operation: " + "\n".join(
+            "{0}: {1}".format(error.get('location', error.get('reason', '')), error.get('message', ''))
+            for error in errors))
+    output_rows = job.get('statistics', {}).get('load', {}).get('outputRows', 0)
+    return (True, True, "Loaded {} rows.".format(output_rows))
+
+
+class CliBackend:
+    '''
+    Runs the gcloud, gsutil and bq command line tools from the Cloud SDK.
+    '''
+    name = "cli"
+    required_commands = ['gsutil', 'bq']
+
+    def get_default_project(self):
+        output_default_project = run_shell_command(['gcloud','config','list'])
+        regex_project = re.search("project = (\S*)", output_default_project['stdout'])
+        if regex_project:
+            return regex_project.group(1)
+        return None
+
+    def check_project(self, project):
+        output_project_exist = run_shell_command(['gcloud','projects','describe',project])
+        if output_project_exist['stderr']:
+            raise BackendError(output_project_exist['stderr'])
+
+    def list_projects(self):
+        return run_shell_command(['gcloud','projects','list'])['stdout']
+
+    def bucket_exists(self, project, bucket):
+        output_bucket_exist = run_shell_command(['gsutil','ls','-p',project])
+        if not output_bucket_exist['stdout']:
+            raise BackendError(output_bucket_exist)
+        return "gs://{}/".format(bucket) in output_bucket_exist['stdout']
+
+    def create_bucket(self, project, bucket):
+        output_create_bucket = run_shell_command(['gsutil','mb','-p', project, "gs://{}/".format(bucket)])
+        if output_create_bucket['code'] != 0:
+            raise BackendError(output_create_bucket['stderr'])
+
+    def list_buckets(self):
+        return run_shell_command(['gsutil', 'list'])['stdout']
+
+    def upload_file(self, local_path, bucket, object_name, move=False):
+        output_upload = run_shell_command([
+            'gsutil',
+            'mv' if move else 'cp',
+            local_path,
+            'gs://{0}/{1}'.format(bucket, object_name)
+        ])
+        if output_upload['stderr'] and 'Operation completed over' not in output_upload['stderr']:
+            raise BackendError(output_upload['stderr'])
+
+    def upload_stream(self, stream, bucket, object_name, size=None):
+        '''
+        This function uploads everything read from a file-like object by piping it
+        into gsutil cp, so it never has to be written to disk. size, the number of
+        bytes the stream holds, is given if it's known.
+        '''
+        # gsutil's progress goes to a file rather than a pipe, which could fill up and
+        # stop gsutil while it's still being written to.
+        with tempfile.TemporaryFile() as stderr, timed_stage("command", "gsutil cp") as stage:
+            # Popen needs the full path of the command to run the .cmd file on Windows.
+            process = Popen([shutil.which('gsutil') or 'gsutil', 'cp', '-',
+                             'gs://{0}/{1}'.format(bucket, object_name)],
+                            stdin=PIPE, stdout=DEVNULL, stderr=stderr)
+            stage.bytes = 0
+            try:
+                for block in iter(lambda: stream.read(1024 * 1024), b''):
+                    process.stdin.write(block)
+                    stage.bytes += len(block)
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            except BaseException:
+                # gsutil saves the object once its input ends, so it's stopped before
+                # it can save what was read so far.
+                process.kill()
+                process.wait()
+                self.delete_objects(bucket, [object_name])
+                raise
+            process.wait()
+            if process.returncode != 0:
+                stderr.seek(0)
+                raise BackendError(stderr.read().decode('utf-8', 'replace'))
+
+    def read_range(self, bucket, object_name, start, end):
+        with timed_stage("command", "gsutil cat"):
+            result = run([shutil.which('gsutil') or 'gsutil', 'cat', '-r', '{0}-{1}'.format(start, end - 1),
+                          'gs://{0}/{1}'.format(bucket, object_name)], stdout=PIPE, stderr=PIPE)
+        if result.returncode != 0:
+            raise BackendError(result.stderr.decode('utf-8', 'replace'))
+        return result.stdout
+
+    def object_exists(self, bucket, object_name):
+        return run_shell_command(['gsutil', '-q', 'stat', 'gs://{0}/{1}'.format(bucket, object_name)])['code'] == 0
+
+    def get_object_generation(self, bucket, object_name):
+        output_stat = run_shell_command(['gsutil', 'stat', 'gs://{0}/{1}'.format(bucket, object_name)])
+        generation = re.search(r"Generation:\s*(\d+)", output_stat['stdout'])
+        if output_stat['code'] != 0 or generation is None:
+            return None
+        return generation.group(1)
+
+    def compose(self, bucket, source_names, object_name):
+        output_compose = run_shell_command(
+            ['gsutil', 'compose']
+            + ['gs://{0}/{1}'.format(bucket, name) for name in source_names]
+            + ['gs://{0}/{1}'.format(bucket, object_name)])
+        if output_compose['code'] != 0:
+            raise BackendError(output_compose['stderr'])
+
+    def delete_objects(self, bucket, object_names):
+        run_shell_command(['gsutil', '-m', 'rm'] + ['gs://{0}/{1}'.format(bucket, name) for name in object_names])
+
+    def dataset_exists(self, dataset):
+        output_dataset = run_shell_command(['bq', 'ls', dataset])
+        return "Not found:" not in output_dataset['stdout']
+
+    def create_dataset(self, dataset):
+        return run_shell_command(['bq', 'mk', dataset])['stdout']
+
+    def _load_arguments(self, source_uris, table, load_options):
+        '''
+        Returns: The list of arguments to bq load for a list of GCS URIs and load options.
+        '''
+        if load_options.get('schema'):
+            schema = ['--schema', load_options['schema']]
+        else:
+            schema = ['--autodetect']
+
+        file_type_params = []
+        if load_options['source_format'] == "CSV":
+            file_type_params = [
+                '--field_delimiter={0}'.format(load_options['field_delimiter']),
+                '--skip_leading_rows={0}'.format(load_options['skip_leading_rows']),
+            ]
+            if load_options.get('encoding', "UTF-8") != "UTF-8":
+                file_type_params.append('--encoding={0}'.format(load_options['encoding']))
+        elif load_options.get('use_avro_logical_types'):
+            file_type_params = ['--use_avro_logical_types']
+
+        standard_params = [
+            '--max_bad_records={0}'.format(load_options['max_bad_records']),
+            '--source_format={0}'.format(load_options['source_format']),
+            table,
+            ','.join(source_uris)
+        ]
+
+        return schema + file_type_params + standard_params
+
+    def load(self, source_uris, table, load_options):
+        '''
+        This function runs a bq load job for a list of GCS URIs into dataset.table.
+
+        Returns: A tuple of whether the load succeeded and the output of the job.
+        '''
+        output_load_data = run_shell_command(['bq', 'load'] + self._load_arguments(source_uris, table, load_options))
+
+        # Stdout contains the errors, stderr contains the loading messages
+        failed = ('error in load operation' in output_load_data['stdout']
+                  or "FATAL" in output_load_data['stdout'])
+        return (not failed, output_load_data['stdout'])
+
+    def submit_load(self, job_id, source_uris, table, load_options):
+        '''
+        This function starts a bq load job with the given job id without waiting for
+        it to finish.
+        '''
+        output_load_data = run_shell_command(['bq', '--nosync', '--job_id={}'.format(job_id), 'load']
+                                             + self._load_arguments(source_uris, table, load_options))
+        if output_load_data['code'] != 0 or 'error in load operation' in output_load_data['stdout']:
+            raise BackendError(output_load_data['stdout'] or output_load_data['stderr'])
+
+    def get_load_status(self, job_id):
+        '''
+        This function checks on a load job started by submit_load.
+
+        Returns: A tuple of whether the job has finished, whether it succeeded and its
+        errors or a short description of what it loaded.
+        '''
+        output_job = run_shell_command(['bq', '--format=json', 'show', '-j', job_id])
+        if output_job['code'] != 0:
+            raise BackendError(output_job['stdout'] or output_job['stderr'])
+        return get_job_status(json.loads(output_job['stdout']))
+
+
+class ClientBackend:
+    '''
+    Uses the google-cloud-storage and google-cloud-bigquery client libraries in
+    process. Clients are created once and reused, which avoids starting a new
+    Python interpreter and authenticating for every operation.
+    '''
+    name = "python"
+    required_commands = []
+
+    def __init__(self, project=None):
+        try:
+            import google.auth
+            from google.cloud import bigquery, storage
+            from google.api_core import exceptions
+        except ImportError:
+            raise BackendError("The python backend requires the google-cloud-storage and "
+                               "google-cloud-bigquery packages. Install them with "
+                               "pip install bq-upload[python].")
+        self._auth = google.auth
+        self._bigquery = bigquery
+        self._storage = storage
+        self._exceptions = exceptions
+        self._project = project
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, kind):
+        with self._lock:
+            if kind not in self._clients:
+                module = self._storage if kind == "storage" else self._bigquery
+                self._clients[kind] = module.Client(project=self._project)
+            return self._clients[kind]
+
+    def get_default_project(self):
+        try:
+            return self._auth.default()[1]
+        except self._auth.exceptions.DefaultCredentialsError:
+            return None
+
+    def check_project(self, project):
+        # Clients are bound to the project, so recreate them if it changes.
+        self._project = project
+        self._clients = {}
+        try:
+            list(self._client("storage").list_buckets(max_results=1))
+        except self._exceptions.GoogleAPIError as e:
+            raise BackendError(str(e))
+
+    def list_projects(self):
+        return "\n".join(p.project_id for p in self._client("bigquery").list_projects())
+
+    def bucket_exists(self, project, bucket):
+        try:
+            return self._client("storage").lookup_bucket(bucket) is not None
+        except self._exceptions.GoogleAPIError as e:
+            raise BackendError(str(e))
+
+    def create_bucket(self, project, bucket):
+        try:
+            self._client("storage").create_bucket(bucket, project=project)
+        except self._exceptions.GoogleAPIError as e:
+            raise BackendError(str(e))
+
+    def list_buckets(self):
+        return "\n".join("gs://{}/".format(b.name) for b in self._client("storage").list_buckets())
+
+    def upload_file(self, local_path, bucket, object_name, move=False):
+        try:
+            blob = self._client("storage").bucket(bucket).blob(object_name)
+            blob.upload_from_filename(local_path)
+        except self._exceptions.GoogleAPIError as e:
+            raise BackendError(str(e))
+        if move:
+            os.remove(local_path)
+
+    def upload_stream(self, stream, bucket, object_name, size=None):
+        '''
+        This function uploads a file-like object. With a size the stream is uploaded
+        as it is, which needs it to support tell and seek. Streams of unknown size,
+        e.g. generated ones, are sent as a resumable upload a chunk at a time, which
+        is only finished once the stream ends. If reading the stream fails the upload
+        is left unfinished and any object already saved under the name is deleted.
+        '''
+        gcs_bucket = self._client("storage").bucket(bucket)
+        try:
+            if size is not None:
+                gcs_bucket.blob(object_name).upload_from_file(stream, size=size)
+            else:
+                gcs_bucket.blob(object_name, chunk_size=STREAM_CHUNK_SIZE).upload_from_file(stream)
+        except self._exceptions.GoogleAPIError as e:
+            raise BackendError(str(e))
+        except BaseException:
+            self.delete_objects(bucket, [object_name])
+            raise
+
+    def read_range(self, bucket, object_name, start, end):
+        blob = self._client("storage").bucket(bucket).blob(object_name)
+        return blob.download_as_bytes(start=start, end=end - 1)
+
+    def object_exists(self, bucket, object_name):
+        return self._client("storage").bucket(bucket).blob(object_name).exists()
+
+    def get_object_generation(self, bucket, object_name):
+        blob = self._client("storage").bucket(bucket).get_blob(object_name)
+        return str(blob.generation) if blob is not None else None
+
+    def compose(self, bucket, source_names, object_name):
+        gcs_bucket = self._client("storage").bucket(bucket)
+        try:
+            gcs_bucket.blob(object_name).compose([gcs_bucket.blob(name) for name in source_names])
+        except self._exceptions.GoogleAPIError as e:
+            raise BackendError(str(e))
+
+    def delete_objects(self, bucket, object_names):
+        self._client("storage").bucket(bucket).delete_blobs(object_names, on_error=lambda blob: None)
+
+    def dataset_exists(self, dataset):
+        try:
+            self._client("bigquery").get_dataset(dataset)
+        except self._exceptions.NotFound:
+            return False
+        return True
+
+    def create_dataset(self, dataset):
+        created = self._client("bigquery").create_dataset(dataset)
+        return "Dataset '{}' successfully created.".format(created.full_dataset_id)
+
+    def _job_config(self, load_options):
+        job_config = self._bigquery.LoadJobConfig(
+            source_format=load_options['source_format'],
+            max_bad_records=int(load_options['max_bad_records'])
+        )
+        if load_options.get('schema'):
+            job_config.schema = [
+                self._bigquery.SchemaField(name, field_type.upper())
+                for name, field_type in (field.split(':') for field in load_options['schema'].split(','))
+            ]
+        else:
+            job_config.autodetect = True
+        if load_options['source_format'] == "CSV":
+            job_config.field_delimiter = load_options['field_delimiter']
+            job_config.skip_leading_rows = int(load_options['skip_leading_rows'])
+            job_config.encoding = load_options.get('encoding', "UTF-8")
+        elif load_options.get('use_avro_logical_types'):
+            job_config.use_avro_logical_types = True
+        return job_config
+
+    def load(self, source_uris, table, load_options):
+        job = self._client("bigquery").load_table_from_uri(source_uris, table,
+                                                           job_config=self._job_config(load_options))
+        try:
+            job.result()
+        except self._exceptions.GoogleAPIError as e:
+            errors = job.errors or []
+            return (False, "\n".join([str(e)] + ["{0}: {1}".format(error.get('location', ''), error.get('message', ''))
+                                              for error in errors]))
+        return (True, "Loaded {} rows.".format(job.output_rows))
+
+    def submit_load(self, job_id, source_uris, table, load_options):
+        try:
+            self._client("bigquery").load_table_from_uri(source_uris, table, job_id=job_id,
+                                                         job_config=self._job_config(load_options))
+        except self._exceptions.GoogleAPIError as e:
+            raise BackendError(str(e))
+
+    def get_load_status(self, job_id):
+        try:
+            job = self._client("bigquery").get_job(job_id)
+        except self._exceptions.GoogleAPIError as e:
+            raise BackendError(str(e))
+        return get_job_status(job.to_api_repr())
+
+
+class LocalBackend:
+    '''
+    A stand-in for Google Cloud which keeps buckets and datasets as folders on the
+    local disk. Load jobs check every URI exists and record themselves in
+    loads.jsonl inside the dataset folder. Used for testing and benchmarking.
+
+    Jobs take load_seconds to run. Jobs started without waiting are kept in the
+    jobs folder, so other processes can check on them.
+    '''
+    name = "local"
+    required_commands = []
+    load_seconds = 0
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.root, "storage"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "bigquery"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "jobs"), exist_ok=True)
+
+    def _bucket_path(self, bucket):
+        return os.path.join(self.root, "storage", bucket)
+
+    def _object_path(self, uri):
+        bucket, _, object_name = uri[len("gs://"):].partition("/")
+        return os.path.join(self._bucket_path(bucket), object_name)
+
+    def get_default_project(self):
+        return "local-project"
+
+    def check_project(self, project):
+        pass
+
+    def list_projects(self):
+        return "local-project"
+
+    def bucket_exists(self, project, bucket):
+        return os.path.isdir(self._bucket_path(bucket))
+
+    def create_bucket(self, project, bucket):
+        os.makedirs(self._bucket_path(bucket), exist_ok=True)
+
+    def list_buckets(self):
+        return "\n".join("gs://{}/".format(b) for b in os.listdir(os.path.join(self.root, "storage")))
+
+    def upload_file(self, local_path, bucket, object_name, move=False):
+        if not self.bucket_exists(None, bucket):
+            raise BackendError("BucketNotFoundException: 404 gs://{} bucket does not exist.".format(bucket))
+        destination = os.path.join(self._bucket_path(bucket), object_name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if move:
+            shutil.move(local_path, destination)
+        else:
+            shutil.copyfile(local_path, destination)
+
+    def upload_stream(self, stream, bucket, object_name, size=None):
+        if not self.bucket_exists(None, bucket):
+            raise BackendError("BucketNotFoundException: 404 gs://{} bucket does not exist.".format(bucket))
+        destination = os.path.join(self._bucket_path(bucket), object_name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            with open(destination, 'wb') as f:
+                shutil.copyfileobj(stream, f, 1024 * 1024)
+        except BaseException:
+            self.delete_objects(bucket, [object_name])
+            raise
+
+    def read_range(self, bucket, object_name, start, end):
+        with open(os.path.join(self._bucket_path(bucket), object_name), 'rb') as f:
+            f.seek(start)
+            return f.read(max(0, end - start))
+
+    def object_exists(self, bucket, object_name):
+        return os.path.isfile(os.path.join(self._bucket_path(bucket), object_name))
+
+    def get_object_generation(self, bucket, object_name):
+        # The modified time stands in for the generation, which changes every time
+        # an object is written.
+        path = os.path.join(self._bucket_path(bucket), object_name)
+        return str(os.stat(path).st_mtime_ns) if os.path.isfile(path) else None
+
+    def compose(self, bucket, source_names, object_name):
+        destination = os.path.join(self._bucket_path(bucket), object_name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Compose into a temporary object first as the destination may be one of the sources.
+        with open(destination + ".composing", 'wb') as f:
+            for name in source_names:
+                source = os.path.join(self._bucket_path(bucket), name)
+                if not os.path.exists(source):
+                    raise BackendError("No URLs matched: gs://{0}/{1}".format(bucket, name))
+                with open(source, 'rb') as part:
+                    shutil.copyfileobj(part, f, 1024 * 1024)
+        os.replace(destination + ".composing", destination)
+
+    def delete_objects(self, bucket, object_names):
+        for name in object_names:
+            path = os.path.join(self._bucket_path(bucket), name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def dataset_exists(self, dataset):
+        return os.path.isdir(os.path.join(self.root, "bigquery", dataset))
+
+    def create_dataset(self, dataset):
+        os.makedirs(os.path.join(self.root, "bigquery", dataset), exist_ok=True)
+        return "Dataset '{}' successfully created.".format(dataset)
+
+    def load(self, source_uris, table, load_options):
+        time.sleep(self.load_seconds)
+        return self._run_load(source_uris, table, load_options)
+
+    def _run_load(self, source_uris, table, load_options):
+        dataset = table.split(".")[0]
+        if not self.dataset_exists(dataset):
+            return (False, "BigQuery error in load operation: Not found: Dataset {}".format(dataset))
+        missing = [uri for uri in source_uris if not os.path.exists(self._object_path(uri))]
+        if missing:
+            return (False, "BigQuery error in load operation: Not found: URI {}".format(missing[0]))
+
+        with self._lock:
+            with open(os.path.join(self.root, "bigquery", dataset, "loads.jsonl"), "a") as f:
+                f.write(json.dumps({"table": table, "source_uris": source_uris,
+                                    "load_options": load_options}) + "\n")
+        return (True, "Loaded {} files into {}.".format(len(source_uris), table))
+
+    def submit_load(self, job_id, source_uris, table, load_options):
+        succeeded, output = self._run_load(source_uris, table, load_options)
+        with open(os.path.join(self.root, "jobs", job_id + ".json"), 'w') as f:
+            json.dump({"done_time": time.time() + self.load_seconds, "succeeded": succeeded,
+                       "output": output}, f)
+
+    def get_load_status(self, job_id):
+        path = os.path.join(self.root, "jobs", job_id + ".json")
+        if not os.path.exists(path):
+            raise BackendError("BigQuery error in show operation: Not found: Job {}".format(job_id))
+        with open(path, 'r') as f:
+            job = json.load(f)
+        if time.time() < job['done_time']:
+            return (False, False, "RUNNING")
+        return (True, job['succeeded'], job['output'])
+
+
+def get_backend(args):
+    '''
+    This function creates the backend selected in the config args.
+
+    Returns: A backend object.
+    '''
+    if args.backend == "python":
+        return ClientBackend(None if args.project == "default" else args.project)
+    elif args.backend == "local":
+        return LocalBackend(os.path.expanduser(args.local_backend_path))
+    return CliBackend()
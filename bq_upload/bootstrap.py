@@ -1,13 +1,11 @@
 """bootstrap.bootstrap: provides entry point main()."""
 
 __version__ = "0.25"
-import pandas as pd
 import argparse
-import tarfile
-import zipfile
+import io
+import gzip
 from pathlib import Path
 from shutil import copyfile
-from subprocess import PIPE, run
 import os
 import re
 import sys
@@ -17,12 +15,57 @@ from os import listdir
 import json
 import logging
 import logging.config
+import copy
+import codecs
+import csv
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from inspect import getsourcefile
 from os.path import abspath
+from .backends import BackendError, get_backend
+from .composite import FileRangeReader, upload_composite
+from .schema import infer_schema, sanitise_column_name
+from .upload_cache import UploadCache
+from .metadata_cache import CachingBackend
+from .line_index import LineIndex, LineIndexBuilder, log_error_rows
+from .json_stream import READ_SIZE, convert_json_to_ndjson, is_ndjson
+from .archives import GeneratorReader, index_chunks, upload_archive_members
+from .compression import gzip_chunks, gzip_file
+from .dates import (SAMPLE_SIZE, convert_date_columns, detect_date_formats, get_custom_date_formats,
+                    parse_date_column)
+from .sniffer import sniff_file
+from .columnar import ColumnarOutputError, OUTPUT_FORMATS, check_output_format, get_columnar_writer
+from .pipeline import PIPELINE_CHUNKSIZE, PipelineError, run_pipeline
+from .metrics import (count_bytes, format_profile, reset_metrics, set_current_file, time_chunks, timed_stage,
+                      write_metrics_file)
+from .ranges import RANGES_PER_WORKER, can_split, find_line_end, split_rows
+from .journal import FAILED, LOADED, PREPROCESSED, UPLOADED, RunJournal, get_run_key
+from .load_jobs import LoadJob, LoadScheduler
+from .passthrough import MissingColumnsError, rewrite_timestamp_columns
+from .memory import COMPACT_CHUNKSIZE, concat_chunks, downcast_integers, get_compact_dtypes, get_memory_size
+
+# pandas, tarfile, zipfile and multiprocessing are imported by the functions that use
+# them, so --help, reloads and JSON uploads don't wait for them to load.
 
 if sys.version_info[0]+(sys.version_info[1]/10) < 3.5:
     raise Exception("Python 3.3 or a more recent version is required.")
 
+# Used to tag log messages with the file being processed when uploading in parallel.
+_log_context = threading.local()
+
+# The background check of the project and bucket, which uploads wait for, and the
+# time spent waiting for it.
+bucket_check = None
+bucket_wait_time = [0.0]
+_bucket_wait_lock = threading.Lock()
+
+# The journal of the current run, which records how far each file has got.
+journal = None
+
+# Starts the load jobs of files as they're uploaded, when loads don't wait.
+load_scheduler = None
+
 
 def setup_logging(
     default_path='logging.json',
@@ -55,10 +98,11 @@ def make_sanitised_filename_copy(folderpath, filename):
     return [sanitized_filename,full_sanitized_path]
 
 
-def upload_to_gsc(absolute_path, filename, folderpath, bucket, movecopy):
+def upload_to_gsc(absolute_path, filename, folderpath, bucket, movecopy, args, compress=False):
     '''
-    Takes a filename and a bucket and then uses the CLI tool gsutil 
-    to upload them into Google Cloud Storage.
+    Takes a filename and a bucket and then uses the selected backend
+    to upload them into Google Cloud Storage. If compress is set the file is
+    gzipped first and uploaded with .gz on the end of its name.
 
     Returns: the name of the file loaded to Google Search Console.
     '''
@@ -75,173 +119,732 @@ def upload_to_gsc(absolute_path, filename, folderpath, bucket, movecopy):
             logger.error("The copyfile has failed. Script will now exit.")
             logger.error(e)
             exit()
-        upload_to_gsc = [
-            'gsutil',
-            'mv',
-            sanitized_path_info[1],
-            'gs://{0}/{1}'.format(bucket, sanitized_path_info[0])
-        ]
+        upload_path = sanitized_path_info[1]
         final_upload_name = sanitized_path_info[0]
+        movecopy = "mv"
     else:
-        upload_to_gsc = [
-            'gsutil',
-            movecopy,
-            absolute_path,
-            'gs://{0}/{1}'.format(bucket, filename)
-        ]
-
-    output_upload = run_shell_command(upload_to_gsc)
-
-    if output_upload['stderr']:
-        if 'Operation completed over' in output_upload['stderr']:
-            logger.info(final_upload_name+" was successfully uploaded to "+bucket)
-            return final_upload_name
-        else:
-            logger.info(output_upload['stderr'])
-            logger.info("Normally this error fires because the bucket doesn't exist or you don't have access. Buckets you have access to are:")
-
-            get_all_buckets = ['gsutil', 'list']
-            output_allprojects = run_shell_command(get_all_buckets)
-
-            logging.info(output_allprojects['stdout'])
-            exit(1)
+        upload_path = absolute_path
+
+    if compress:
+        compressed_path = upload_path + ".gz"
+        start_time = time.time()
+        with timed_stage("compress", final_upload_name) as stage:
+            stage.bytes = os.path.getsize(upload_path)
+            compressed_size = gzip_file(upload_path, compressed_path)
+        logger.info("The file was gzipped from {0:.1f}MB to {1:.1f}MB in {2:.1f} seconds.".format(
+            os.path.getsize(upload_path) / 1024 / 1024, compressed_size / 1024 / 1024,
+            time.time() - start_time))
+        if movecopy == "mv":
+            os.remove(upload_path)
+        upload_path = compressed_path
+        final_upload_name += ".gz"
+        movecopy = "mv"
+
+    wait_for_bucket()
+    try:
+        with timed_stage("upload", final_upload_name) as stage:
+            stage.bytes = os.path.getsize(upload_path)
+            if (args.composite_threshold is not None
+                    and os.path.getsize(upload_path) >= args.composite_threshold * 1024 * 1024):
+                upload_composite(backend, upload_path, bucket, final_upload_name,
+                                 args.part_size * 1024 * 1024, args.upload_concurrency,
+                                 move=(movecopy == "mv"))
+            else:
+                backend.upload_file(upload_path, bucket, final_upload_name, move=(movecopy == "mv"))
+    except BackendError as e:
+        logger.info(e)
+        logger.info("Normally this error fires because the bucket doesn't exist or you don't have access. Buckets you have access to are:")
+        logging.info(backend.list_buckets())
+        exit(1)
 
+    logger.info(final_upload_name+" was successfully uploaded to "+bucket)
     return final_upload_name
 
 
-def run_shell_command(command):
-    '''
-    This function runs a shell command and returns the returncode, stdout and stderr
-    in a dictionary.
-    '''
-    result = run(command, stdout=PIPE, stderr=PIPE, universal_newlines=True, shell=True)
-    return {
-        "args":result.args,
-        "code":result.returncode, 
-        "stdout":result.stdout, 
-        "stderr":result.stderr
-    }
-
-
-def read_csv_to_df(inputfile, args, line_skip, nrows, columns_to_date_guess, has_date=True):
+def read_csv_to_df(inputfile, args, line_skip, nrows, columns_to_date_guess, has_date=True,
+                   chunksize=None, dtype=None, date_formats=None, names=None):
     '''
     This function takes an input file and the config args and then uses it to open
-    a CSV format it depending on the arguments provided.
+    a CSV format it depending on the arguments provided. Date columns are converted
+    a whole column at a time, each with its own format. The formats of guessed date
+    columns are worked out from the data unless date_formats are given, and they are
+    read as text so those which aren't dates are left as they were. If names are
+    given the file has no header row and they are used as the column names.
 
-    Returns: A dataframe.
+    Returns: A dataframe, or an iterator of dataframes if a chunksize is given.
     '''
 
-    # custom_date_needed = False
-
     sep_var = args.delimiter
     encoding_var=args.encoding
-    date_columns = False
-    dateparse = None
+    strict_dates = False
+    # Reads of the head of the file held in memory are recorded without a name.
+    source_name = os.path.basename(inputfile) if isinstance(inputfile, str) else None
 
     if has_date is True:
-        if args.timestamp_columns is not "No":
+        if args.timestamp_columns != "No":
             if columns_to_date_guess is not False:
                 logging.info("You have set date guessing to true and set a custom timestamp format. \
                               Only the custom timestamp format will be used.")
-            # custom_date_needed = True
-            date_columns = args.timestamp_columns
-            dateparse = lambda x: pd.to_datetime(x, format=args.timestamp_strptime)
-        elif columns_to_date_guess is not False:
-            date_columns = columns_to_date_guess
-            dateparse = None
-    try:
-        df = pd.read_csv(inputfile, 
-                         parse_dates=date_columns, 
-                         date_parser=dateparse, 
-                         encoding=encoding_var, 
-                         sep=sep_var, 
-                         low_memory=False, 
-                         skiprows=line_skip, 
-                         nrows=nrows)
-    except FileNotFoundError as e:
-        logging.error("The file {} can't be found, please select an existing file.".format(inputfile))
-        exit()
-    except ValueError as e:
-        if has_date is True:
+            date_formats = get_custom_date_formats(args.timestamp_columns, args.timestamp_strptime)
+            strict_dates = True
+        elif columns_to_date_guess is False:
+            date_formats = None
+    else:
+        date_formats = None
+
+    converting_dates = not (has_date is False or (date_formats is None and columns_to_date_guess is False))
+    if converting_dates and not strict_dates and dtype is None and columns_to_date_guess:
+        # Guessed columns which turn out not to be dates are written as they were in
+        # the file, e.g. booleans stay lower case, as they are in a chunked read.
+        dtype = {column: object for column in columns_to_date_guess}
+
+    import pandas as pd
+    with timed_stage("read", source_name) as stage:
+        try:
+            df = pd.read_csv(inputfile, 
+                             encoding=encoding_var, 
+                             sep=sep_var, 
+                             low_memory=False, 
+                             skiprows=line_skip, 
+                             nrows=nrows,
+                             chunksize=chunksize,
+                             dtype=dtype,
+                             header=None if names else 'infer',
+                             names=names)
+        except FileNotFoundError as e:
+            logging.error("The file {} can't be found, please select an existing file.".format(inputfile))
+            exit()
+        except ValueError as e:
+            logging.error(e)
+            exit()
+
+        if not chunksize:
+            if converting_dates:
+                if date_formats is None:
+                    date_formats = detect_date_formats(df, columns_to_date_guess)
+                df = convert_dates(df, date_formats, strict_dates)
+            stage.rows = len(df)
+            if source_name and nrows is None:
+                stage.bytes = os.path.getsize(inputfile)
+            return df
+
+    # The chunks are read as they're used, so that's when they're timed.
+    if converting_dates:
+        df = convert_dates_in_chunks(df, columns_to_date_guess, date_formats, strict_dates)
+    return time_chunks(df, "read", source_name)
+
+
+def read_csv_to_df_compactly(inputfile, args, line_skip, columns_to_guess, head=None):
+    '''
+    This function reads a whole CSV into a dataframe with text columns stored as
+    categories or Arrow strings and integers in the smallest type they fit in. The
+    file is read in chunks, so only one chunk at a time is ever held as Python
+    objects, with the same dtypes as a chunked read so the dataframe matches a full
+    read. The dtype of each text column is picked from a sample at the top of the
+    file. Columns converted to dates are read as normal.
+
+    Returns: A dataframe.
+    '''
+    date_columns, date_formats = get_date_columns(inputfile, args, line_skip, columns_to_guess, head)
+    dtypes = get_chunk_dtypes(inputfile, args, line_skip, COMPACT_CHUNKSIZE, date_columns, date_formats)
+    if columns_to_guess:
+        columns_to_guess = [column for column in columns_to_guess if column not in dtypes]
+        date_formats = {column: date_formats[column] for column in columns_to_guess}
+
+    sample = read_csv_to_df(inputfile, args, line_skip, SAMPLE_SIZE, False, has_date=False, dtype=dtypes)
+    dtypes.update(get_compact_dtypes(sample, exclude=date_columns))
+
+    chunks = read_csv_to_df(inputfile, args, line_skip, None, columns_to_guess,
+                            chunksize=COMPACT_CHUNKSIZE, dtype=dtypes, date_formats=date_formats)
+    df = concat_chunks(downcast_integers(chunk) for chunk in chunks)
+    if df is None:
+        # There are no rows, so there's nothing to save memory on.
+        return read_csv_to_df(inputfile, args, line_skip, None, columns_to_guess)
+    logger.info("The file takes up {:.1f}MB in memory.".format(get_memory_size(df)))
+    return df
+
+
+def rewrite_timestamps(inputfile, args, line_skip, output_path):
+    '''
+    This function writes a copy of a CSV with only its timestamp columns converted,
+    every other value is copied as it is. The copy is in the encoding BigQuery will be
+    told to load it in, and keeps the delimiter of the original.
+    '''
+    date_formats = get_custom_date_formats(args.timestamp_columns, args.timestamp_strptime)
+    output_encoding = "ISO-8859-1" if get_load_encoding(args) == "ISO-8859-1" else "utf-8"
+    with timed_stage("write", os.path.basename(output_path)) as stage:
+        try:
+            stage.rows = rewrite_timestamp_columns(inputfile, output_path, date_formats, args.encoding,
+                                                   args.delimiter, line_skip, output_encoding)
+        except MissingColumnsError as e:
+            logging.error(e)
+            logging.error("Please check the columns given to --timestamp_columns. The script will now exit.")
+            exit()
+        except ValueError as e:
             logging.error("The strptime string provided for parsing the dates has failed. "
                           "Please check your string. A guide can be found here. http://strftime.org/ "
                           "The script will now exit.")
+            logging.error(e)
+            exit()
+        except csv.Error as e:
+            logging.error(e)
+            exit()
+        stage.bytes = os.path.getsize(output_path)
+
+
+def convert_dates(df, date_formats, strict_dates):
+    '''
+    This function converts the date columns of a dataframe, exiting if a custom
+    timestamp format doesn't match.
+
+    Returns: A dataframe.
+    '''
+    try:
+        return convert_date_columns(df, date_formats, strict=strict_dates)
+    except ValueError as e:
+        logging.error("The strptime string provided for parsing the dates has failed. "
+                      "Please check your string. A guide can be found here. http://strftime.org/ "
+                      "The script will now exit.")
         logging.error(e)
         exit()
 
-    return df
+
+def convert_dates_in_chunks(chunks, columns_to_date_guess, date_formats, strict_dates):
+    '''
+    This function converts the date columns of every chunk of a chunked read. If the
+    formats of guessed columns aren't given they are worked out from the first chunk.
+    '''
+    for chunk in chunks:
+        if date_formats is None:
+            date_formats = detect_date_formats(chunk, columns_to_date_guess)
+        yield convert_dates(chunk, date_formats, strict_dates)
 
 
-def format_json_for_upload(filename, folderpath):
+def write_processed_csv(df, output_path, mode='w', header=True):
     '''
-    This function takes a JSON file and outputs it so there is a single object per
-    line.
+    This function writes a processed dataframe out to a BigQuery friendly CSV.
+    '''
+    is_path = isinstance(output_path, str)
+    with timed_stage("write", os.path.basename(output_path) if is_path else None) as stage:
+        start_size = os.path.getsize(output_path) if is_path and mode == 'a' else 0
+        df.to_csv(output_path, 
+                  mode=mode,
+                  header=header,
+                  index=False, 
+                  date_format='%Y-%m-%d %H:%M:%S', 
+                  quoting=1, 
+                  encoding='utf-8')
+        stage.rows = len(df)
+        if is_path:
+            stage.bytes = os.path.getsize(output_path) - start_size
+
+
+def get_chunk_kind(series):
+    '''
+    This function describes the values pandas has parsed into a single column of
+    a chunk, so the types of several chunks can be reconciled.
 
-    Returns: The name of the new json file.
+    Returns: One of empty, bool, boolobj, int, float or object.
+    '''
+    if series.isna().all():
+        return "empty"
+    if series.dtype == bool:
+        return "bool"
+    if series.dtype.kind in "iu":
+        return "int"
+    if series.dtype.kind == "f":
+        return "float"
+    if series.dtype == object and series.dropna().map(type).eq(bool).all():
+        return "boolobj"
+    return "object"
+
+
+def get_column_kinds(chunks, date_columns, date_formats, guessing_dates):
     '''
+    This function describes the values in every column of each chunk of a file.
 
-    df = pd.read_json(os.path.join(folderpath,filename))
-    new_json_loc = os.path.join(folderpath, "formatted_json_{}".format(filename))
-    df.to_json(new_json_loc, orient="records", lines=True)
+    Returns: A dictionary of column name to the set of kinds seen in it.
+    '''
+    column_kinds = {}
+    for chunk in chunks:
+        for column in chunk.columns:
+            if column in date_columns and guessing_dates:
+                parsed = parse_date_column(chunk[column], date_formats.get(column))
+                kind = "date" if parsed is not None else "object"
+            else:
+                kind = get_chunk_kind(chunk[column])
+            column_kinds.setdefault(column, set()).add(kind)
+    return column_kinds
 
-    return "formatted_json_{}".format(filename)
+
+def get_dtypes_from_kinds(column_kinds, date_columns, guessing_dates):
+    '''
+    This function picks the dtype of each column from the kinds of values seen in
+    it across the whole file.
+
+    Returns: A dictionary of column name to dtype.
+    '''
+    dtypes = {}
+    for column, kinds in column_kinds.items():
+        if column in date_columns:
+            if guessing_dates and "object" in kinds:
+                dtypes[column] = object
+            continue
+        if kinds == {"empty"} or kinds <= {"int", "float", "empty"}:
+            dtypes[column] = "int64" if kinds == {"int"} else "float64"
+        elif kinds <= {"bool", "boolobj", "empty"}:
+            dtypes[column] = "bool" if kinds == {"bool"} else "boolean"
+        else:
+            dtypes[column] = object
+    return dtypes
 
 
-def upload_to_bq(upload_file_name, original_file_path, args, strict_schema, file_format):
+def get_chunk_dtypes(inputfile, args, line_skip, chunksize, date_columns, date_formats=None):
     '''
-    This function takes a filename and some config arguments and then calls the
-    bq command line utility to upload a file to BigQuery.
+    This function reads a file chunk by chunk and works out the dtype pandas would
+    have given each column if the whole file had been read in one go. Reading every
+    chunk with these dtypes makes the chunked output identical to the full read,
+    e.g. an integer column with a gap in a later chunk is written as floats in every
+    chunk. Guessed date columns which aren't dates in date_formats all the way through
+    the file are left as text, as they would be in a full read, and are given the
+    object dtype.
+
+    Returns: A dictionary of column name to dtype.
     '''
-    load_data_bq = [
-        'bq',
-        'load'
-    ]
+    if date_columns is False or date_columns is None:
+        date_columns = []
+    guessing_dates = args.timestamp_columns == "No"
+
+    chunks = read_csv_to_df(inputfile, args, line_skip, None, False, has_date=False,
+                            chunksize=chunksize)
+    column_kinds = get_column_kinds(chunks, date_columns, date_formats, guessing_dates)
+    return get_dtypes_from_kinds(column_kinds, date_columns, guessing_dates)
 
-    standard_params = [
-        '--max_bad_records={0}'.format(args.max_bad_records),
-        '--source_format={0}'.format(file_format),
-        '{0}.{1}'.format(args.dataset, args.table),
-        'gs://{0}/{1}'.format(args.bucket, upload_file_name)
-    ]
 
-    if file_format == "CSV":
-        file_type_params = [
-            '--field_delimiter={0}'.format(args.delimiter),
-            '--skip_leading_rows={0}'.format(args.line_skip),
-        ]
+def write_processed_file(df, output_path, output_format):
+    '''
+    This function writes a processed dataframe out as a CSV, or as Parquet or Avro.
+    '''
+    if output_format == "csv":
+        write_processed_csv(df, output_path)
     else:
-        file_type_params = []
+        with timed_stage("write", output_format) as stage:
+            writer = get_columnar_writer(output_format, output_path)
+            writer.write(df)
+            writer.close()
+            stage.rows = len(df)
+
 
-    if strict_schema:
-        schema = [
-            '--schema',
-            strict_schema
-        ]
+def write_processed_file_in_chunks(inputfile, args, line_skip, columns_to_guess, output_path,
+                                   head=None):
+    '''
+    This function reads a CSV args.chunksize rows at a time, applies the same date
+    parsing as a full read to each chunk and appends it to the output file. Memory use
+    is bounded by the chunk size rather than the size of the file. head is the start
+    of the file already read into memory, if there is one. output_path can also be a
+    binary file object, which is written to but not closed.
+    '''
+    # Every chunk is converted with the formats found at the top of the file.
+    date_columns, date_formats = get_date_columns(inputfile, args, line_skip, columns_to_guess, head)
+    dtypes = get_chunk_dtypes(inputfile, args, line_skip, args.chunksize, date_columns, date_formats)
+    if columns_to_guess:
+        columns_to_guess = [column for column in columns_to_guess if column not in dtypes]
+        date_formats = {column: date_formats[column] for column in columns_to_guess}
+
+    chunks = read_csv_to_df(inputfile, args, line_skip, None, columns_to_guess,
+                            chunksize=args.chunksize, dtype=dtypes, date_formats=date_formats)
+    if args.output_format != "csv":
+        writer = get_columnar_writer(args.output_format, output_path)
+        for chunk in chunks:
+            with timed_stage("write", args.output_format) as stage:
+                writer.write(chunk)
+                stage.rows = len(chunk)
+        writer.close()
+        return
+
+    if not isinstance(output_path, str):
+        output = io.TextIOWrapper(output_path, encoding='utf-8', newline='', write_through=True)
+        first_chunk = True
+        for chunk in chunks:
+            write_processed_csv(chunk, output, header=first_chunk)
+            first_chunk = False
+        output.detach()
+        return
+
+    first_chunk = True
+    for chunk in chunks:
+        write_processed_csv(chunk, output_path,
+                            mode='w' if first_chunk else 'a',
+                            header=first_chunk)
+        first_chunk = False
+
+
+def get_date_columns(inputfile, args, line_skip, columns_to_guess, head=None):
+    '''
+    This function works out which columns will be converted to dates and, for
+    guessed date columns, the format of each from the top of the file.
+
+    Returns: A tuple of the list of date columns and a dictionary of column name to
+    format, or None if the formats were given by the user.
+    '''
+    if args.timestamp_columns != "No":
+        return args.timestamp_columns, None
+    if not columns_to_guess:
+        return [], None
+    df_sample = read_csv_to_df(head or inputfile, args, line_skip, SAMPLE_SIZE, False, has_date=False)
+    return columns_to_guess, detect_date_formats(df_sample, columns_to_guess)
+
+
+def read_csv_range(path, byte_range, args, line_skip, columns, columns_to_date_guess, has_date=True,
+                   dtype=None, date_formats=None):
+    '''
+    This function reads the rows of a CSV between two byte offsets, args.chunksize
+    rows at a time if it's set. The range at the start of the file has the skipped
+    lines and the header row in it, the others are given the column names. The range
+    is read from the file as pandas needs it, so only a chunk is held in memory.
+
+    Yields: Dataframes.
+    '''
+    start, end = byte_range
+    with FileRangeReader(path, start, end - start) as data:
+        if start == 0:
+            df = read_csv_to_df(data, args, line_skip, None, columns_to_date_guess, has_date,
+                                chunksize=args.chunksize, dtype=dtype, date_formats=date_formats)
+        else:
+            df = read_csv_to_df(data, args, 0, None, columns_to_date_guess, has_date,
+                                chunksize=args.chunksize, dtype=dtype, date_formats=date_formats,
+                                names=columns)
+        if args.chunksize:
+            yield from df
+        else:
+            yield df
+
+
+def get_range_column_kinds(path, byte_range, args, line_skip, columns, date_columns, date_formats):
+    '''
+    This function describes the values in every column of one range of a file, in a
+    worker process.
+
+    Returns: A dictionary of column name to the set of kinds seen in it.
+    '''
+    chunks = read_csv_range(path, byte_range, args, line_skip, columns, False, has_date=False)
+    return get_column_kinds(chunks, date_columns, date_formats, args.timestamp_columns == "No")
+
+
+def write_processed_range(path, byte_range, args, line_skip, columns, columns_to_guess, dtypes,
+                          date_formats, part_path):
+    '''
+    This function processes one range of a file in a worker process and writes it to
+    its own CSV, with the header row only if it's the start of the file.
+    '''
+    chunks = read_csv_range(path, byte_range, args, line_skip, columns, columns_to_guess,
+                            dtype=dtypes, date_formats=date_formats)
+    first_chunk = True
+    for chunk in chunks:
+        write_processed_csv(chunk, part_path,
+                            mode='w' if first_chunk else 'a',
+                            header=first_chunk and byte_range[0] == 0)
+        first_chunk = False
+    if first_chunk:
+        open(part_path, 'w').close()
+
+
+def write_processed_file_in_parallel(inputfile, args, line_skip, columns_to_guess, output_path,
+                                     head=None):
+    '''
+    This function splits a CSV into byte ranges of whole rows and processes them in
+    args.processing_workers processes at once, joining the results back together in
+    order. The type of every column is worked out across all of the ranges first, as
+    for a chunked read, so the output is identical to processing the file in one go.
+    output_path can also be a binary file object, which is written to but not closed.
+    '''
+    date_columns, date_formats = get_date_columns(inputfile, args, line_skip, columns_to_guess, head)
+    columns = list(read_csv_to_df(inputfile, args, line_skip, 1, False, has_date=False).columns)
+
+    data_start = find_line_end(inputfile, line_skip + 1)
+    byte_ranges = split_rows(inputfile, data_start, args.processing_workers * RANGES_PER_WORKER)
+    if byte_ranges:
+        byte_ranges[0] = (0, byte_ranges[0][1])
     else:
-        schema = [
-            '--autodetect'
-        ]
+        byte_ranges = [(0, os.path.getsize(inputfile))]
+    logger.info("Processing the file in {0} parts across {1} processes."
+                .format(len(byte_ranges), args.processing_workers))
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=args.processing_workers) as executor:
+        column_kinds = {}
+        for range_kinds in executor.map(get_range_column_kinds, *zip(*[
+                (inputfile, byte_range, args, line_skip, columns, date_columns, date_formats)
+                for byte_range in byte_ranges])):
+            for column, kinds in range_kinds.items():
+                column_kinds.setdefault(column, set()).update(kinds)
+        dtypes = get_dtypes_from_kinds(column_kinds, date_columns, args.timestamp_columns == "No")
+        if columns_to_guess:
+            columns_to_guess = [column for column in columns_to_guess if column not in dtypes]
+            date_formats = {column: date_formats[column] for column in columns_to_guess}
+
+        parts_folder = tempfile.mkdtemp(prefix="bq_upload_", dir=os.path.dirname(inputfile))
+        try:
+            part_paths = [os.path.join(parts_folder, "part{}.csv".format(i)) for i in range(len(byte_ranges))]
+            futures = [executor.submit(write_processed_range, inputfile, byte_range, args, line_skip,
+                                       columns, columns_to_guess, dtypes, date_formats, part_path)
+                       for byte_range, part_path in zip(byte_ranges, part_paths)]
+
+            # Parts are joined on as soon as they and the ones before them are done.
+            output = open(output_path, 'wb') if isinstance(output_path, str) else output_path
+            try:
+                for future, part_path in zip(futures, part_paths):
+                    future.result()
+                    with open(part_path, 'rb') as part:
+                        shutil.copyfileobj(part, output, 1024 * 1024)
+                    os.remove(part_path)
+            finally:
+                if output is not output_path:
+                    output.close()
+        finally:
+            shutil.rmtree(parts_folder, ignore_errors=True)
+
+
+def write_processed_file_in_parts(inputfile, args, line_skip, columns_to_guess, output_path, head=None):
+    '''
+    This function writes the processed file in chunks, or in parallel processes if
+    args.processing_workers is more than 1 and the file can be split up.
+    '''
+    if args.processing_workers > 1:
+        if args.output_format == "csv" and can_split(inputfile, args.encoding):
+            write_processed_file_in_parallel(inputfile, args, line_skip, columns_to_guess, output_path, head)
+            return
+        logger.info("Only uncompressed CSV output can be processed in parallel, the file will be "
+                    "processed in a single process.")
+    write_processed_file_in_chunks(inputfile, args, line_skip, columns_to_guess, output_path, head)
 
-    final_command = load_data_bq + schema + file_type_params + standard_params
 
-    output_load_data = run_shell_command(final_command)
+def upload_processed_file_in_pipeline(file, filename, args, columns_to_guess, head, compress=False,
+                                      index=False):
+    '''
+    This function processes a file in chunks and uploads the output while it's being
+    written, rather than writing it to disk and uploading it afterwards. The upload
+    runs in its own thread and the processing waits whenever it gets too far ahead,
+    so only a few blocks are ever held in memory and the whole thing takes about as
+    long as the slower of the two. If compress is set the output is gzipped on the
+    way, and if index is set a line index of it is built.
+
+    Returns: A tuple of the name of the uploaded object and the line index, or None.
+    '''
+    # The output is streamed rather than copied, so the name is sanitised here.
+    object_name = re.sub("[&\*\?\-]", "", filename)
+    if compress:
+        object_name += ".gz"
+    line_index_builder = LineIndexBuilder() if index else None
+
+    def write(pipe):
+        write_processed_file_in_parts(file, args, args.line_skip-1, columns_to_guess, pipe, head=head)
+
+    wait_for_bucket()
+    logger.info("Processing the file in chunks of {0} rows and streaming it to gs://{1}/{2}."
+                .format(args.chunksize, args.bucket, object_name))
+
+    def upload(blocks):
+        # Commands run by the upload belong to this file too.
+        set_current_file(stage.file)
+        if line_index_builder:
+            blocks = index_chunks(blocks, line_index_builder)
+        if compress:
+            blocks = gzip_chunks(blocks)
+        backend.upload_stream(io.BufferedReader(GeneratorReader(count_bytes(blocks, stage)), READ_SIZE),
+                              args.bucket, object_name)
+
+    try:
+        # The upload runs alongside the processing, so it's timed from when that starts.
+        with timed_stage("upload", object_name) as stage:
+            total_time, processing_time, wait_time = run_pipeline(write, upload)
+    except (BackendError, PipelineError) as e:
+        logger.info(e)
+        logger.info("Normally this error fires because the bucket doesn't exist or you don't have access. Buckets you have access to are:")
+        logging.info(backend.list_buckets())
+        exit(1)
+    except Exception as e:
+        logging.error("Processing and uploading {0} to gs://{1}/{2} failed.".format(filename, args.bucket, object_name))
+        logging.error(e)
+        exit(1)
+
+    logger.info("{0} was processed and uploaded to {1} in {2:.1f} seconds. Processing took {3:.1f} "
+                "seconds and waited {4:.1f} seconds for the upload."
+                .format(object_name, args.bucket, total_time, processing_time, wait_time))
+    return object_name, line_index_builder.build().to_dict() if line_index_builder else None
+
+
+def format_json_for_upload(filename, folderpath):
+    '''
+    This function takes a JSON file and outputs it so there is a single object per
+    line. Arrays are converted as a stream, so the file never has to fit in memory.
+    Files which are already one object per line are left as they are.
+
+    Returns: The name of the new json file, or filename if no conversion was needed.
+    '''
+    json_loc = os.path.join(folderpath,filename)
+    new_json_name = "formatted_json_{}".format(Path(filename).stem if filename.endswith(".gz") else filename)
+    new_json_loc = os.path.join(folderpath, new_json_name)
+
+    with timed_stage("json", filename) as stage:
+        stage.bytes = os.path.getsize(json_loc)
+        open_json = gzip.open if filename.endswith(".gz") else open
+        with open_json(json_loc, 'rt', encoding='utf-8-sig') as in_file:
+            if is_ndjson(in_file):
+                logger.info("{} is already newline delimited JSON and doesn't need formatting.".format(filename))
+                return filename
+
+            try:
+                with open(new_json_loc, 'w', encoding='utf-8') as out_file:
+                    records = convert_json_to_ndjson(in_file, out_file)
+                logger.info("{0} records were written to {1}.".format(records, new_json_name))
+                stage.rows = records
+                return new_json_name
+            except ValueError:
+                os.remove(new_json_loc)
+
+        # Anything other than an array, e.g. an object of columns, is left to pandas.
+        import pandas as pd
+        df = pd.read_json(json_loc)
+        df.to_json(new_json_loc, orient="records", lines=True)
+        stage.rows = len(df)
+
+    return new_json_name
+
+
+def get_load_encoding(args):
+    '''
+    This function works out the encoding BigQuery should read an uploaded CSV in.
+    Files processed by pandas are written as UTF-8, other files are uploaded as they
+    are so may be Latin-1.
+
+    Returns: "ISO-8859-1" or "UTF-8".
+    '''
+    if args.pandas_processing is False and codecs.lookup(args.encoding).name == "iso8859-1":
+        return "ISO-8859-1"
+    return "UTF-8"
+
+
+def get_load_options(args, strict_schema, file_format):
+    '''
+    This function works out the options of the load job of a group of files.
+
+    Returns: A dictionary.
+    '''
+    return {
+        "source_format": file_format,
+        "max_bad_records": args.max_bad_records,
+        "schema": strict_schema,
+        "field_delimiter": args.delimiter,
+        "encoding": get_load_encoding(args),
+        "skip_leading_rows": args.line_skip,
+        # Avro files written by this script store dates as timestamp logical types.
+        "use_avro_logical_types": getattr(args, "output_format", "csv") == "avro"
+    }
+
+
+def upload_to_bq(upload_file_names, uploaded_paths, args, strict_schema, file_format, line_indexes=None):
+    '''
+    This function takes a list of uploaded filenames and some config arguments and
+    then uses the selected backend to load all of them into BigQuery with a single
+    load job. uploaded_paths are the local copies of the uploaded files, or None for
+    files which were moved, and line_indexes their saved line indexes if there are any.
 
-    if 'error in load operation' in output_load_data['stdout'] or "FATAL" in output_load_data['stdout']:
-        # Stdout contains the errors, stderr contains the loading messages
+    Returns: Whether the load succeeded.
+    '''
+    if not isinstance(upload_file_names, list):
+        upload_file_names = [upload_file_names]
+        uploaded_paths = [uploaded_paths]
+
+    # bq accepts a comma separated list of URIs for a single load job.
+    source_uris = ['gs://{0}/{1}'.format(args.bucket, name) for name in upload_file_names]
+
+    with timed_stage("load", ", ".join(upload_file_names)):
+        load_succeeded, load_output = backend.load(source_uris, '{0}.{1}'.format(args.dataset, args.table),
+                                                   get_load_options(args, strict_schema, file_format))
+
+    report_load(load_succeeded, load_output, upload_file_names, uploaded_paths, args, line_indexes)
+    return load_succeeded
+
+
+def report_load(load_succeeded, load_output, upload_file_names, uploaded_paths, args, line_indexes=None):
+    '''
+    This function logs whether the load job of a list of uploaded files succeeded
+    and, if it failed, the rows of the files its errors are about.
+    '''
+    if line_indexes is None:
+        line_indexes = [None] * len(upload_file_names)
+    source_uris = ['gs://{0}/{1}'.format(args.bucket, name) for name in upload_file_names]
+    uploaded_names = ", ".join(upload_file_names)
+
+    if not load_succeeded:
         logging.info("FAILURE: {0} was not uploaded into {1}.{2}" 
-                     .format(upload_file_name, args.dataset, args.table))
-        logging.info(output_load_data['stdout'])
-        file_fail_position = re.search("starting at\s(location|position)\s(\d*)",output_load_data['stdout'])
-        if file_fail_position:
-            fail_byte = file_fail_position.group(1)
-            with open(original_file_path, 'r') as f:    
-                f.seek(int(fail_byte))
-                logging.info("The line which contains the byte {} and is causing the error \
-                              above is:".format(fail_byte))
-                logging.info(f.readline())
+                     .format(uploaded_names, args.dataset, args.table))
+        logging.info(load_output)
+
+        uploads = [{
+            "uri": uri,
+            "object_name": name,
+            "local_path": path,
+            "line_index": LineIndex.from_dict(line_index) if line_index else None
+        } for uri, name, path, line_index in zip(source_uris, upload_file_names, uploaded_paths, line_indexes)]
+        log_error_rows(load_output, uploads, backend, args.bucket)
     else:
         logging.info("SUCCESS: {0} was successfully uploaded into {1}.{2}" 
-                     .format(upload_file_name, args.dataset, args.table))        
+                     .format(uploaded_names, args.dataset, args.table))        
+
+
+def make_load_jobs(results):
+    '''
+    This function groups the results of uploaded files into load jobs, for loading
+    without waiting.
+
+    Returns: A list of LoadJobs.
+    '''
+    return [LoadJob(group, ['gs://{0}/{1}'.format(group['args'].bucket, name) for name in group['file_upload_names']],
+                    '{0}.{1}'.format(group['args'].dataset, group['args'].table),
+                    get_load_options(group['args'], group['strict_schema'], group['file_format']))
+            for group in group_results_for_load(results)]
+
+
+def record_load(group, load_succeeded, **details):
+    '''
+    This function records in the journal whether the files of a load group were loaded.
+    '''
+    for file in dict.fromkeys(group['source_files']):
+        if load_succeeded:
+            record_in_journal(file, LOADED, **details)
+        else:
+            record_in_journal(file, FAILED, stage="load", **details)
+
+
+def finish_load_job(job):
+    '''
+    This function reports on a load job which was started without waiting, once it
+    has finished.
+    '''
+    group = job.group
+    report_load(job.succeeded, job.output, group['file_upload_names'], group['uploaded_paths'],
+                group['args'], group['line_indexes'])
+    if job.succeeded:
+        record_load(group, True, job_id=job.job_id)
+    else:
+        record_load(group, False, job_id=job.job_id, error=job.output)
+
+
+def log_load_summary(jobs):
+    '''
+    This function logs the outcome of every load job which was started without waiting.
+    '''
+    failed_jobs = [job for job in jobs if not job.succeeded]
+    logger.info("Load summary: {0} jobs succeeded, {1} failed.".format(len(jobs) - len(failed_jobs),
+                                                                        len(failed_jobs)))
+    for job in jobs:
+        logger.info("{0}: {1} ({2:.1f} seconds) {3}".format(
+            "SUCCESS" if job.succeeded else "FAILURE", job.job_id, job.get_seconds(),
+            ", ".join(job.group['file_upload_names'])))
+        if not job.succeeded:
+            logger.info(job.output)
 
 
 def create_schema(df, args):
@@ -256,7 +859,7 @@ def create_schema(df, args):
     schema_list = []
     date_fields = []
     for k,v in schema_series.iteritems(): 
-        key_str = str(k).translate(str.maketrans('','','!@/()%,')).replace(" ","_").replace("-","_")
+        key_str = sanitise_column_name(k)
         key_val = str(v).replace('object','string').replace('int64','integer').replace('float64','float').replace('bool','boolean').replace('datetime64[ns]', 'timestamp')
         array = [key_str,key_val]
         schema_list.append(array)
@@ -289,30 +892,112 @@ def get_sane_path(p):
     return p
 
 
-def last_uploaded_file(config_dict):
+def check_project(args):
     '''
-    This function saves a config dictionary to a file.
+    This function checks the project exists, or finds the default project if one
+    wasn't given, and saves it in args.
     '''
+    # If project isn't set, get default project and log it
+    if args.project == "default":
+        regex_project = backend.get_default_project()
+        if regex_project is None:
+            logger.error("There is no default project set in gcloud, run gcloud init and set it up.")
+            exit()
+        args.project = regex_project
 
-    output_loc = os.path.join(os.path.dirname(abspath(getsourcefile(lambda:0))),
-        "last_uploaded_file.txt")
+        logger.info("The default configured project is {}.".format(regex_project))
+    else:
+        # Check the project provided exists
+        try:
+            backend.check_project(args.project)
+        except BackendError as e:
+            logger.info(e)
+            logger.info("Available projects are:")
+            logger.info(backend.list_projects())
+            exit(1)
+        else:
+            logger.info("The Google Cloud project {} exists".format(args.project))
 
-    file = open(output_loc,"w") 
-    json.dump(config_dict, file)
-    file.close() 
+
+def setup_bucket(args):
+    '''
+    This function checks the bucket exists and creates it if it doesn't.
+    '''
+    try:
+        bucket_exists = backend.bucket_exists(args.project, args.bucket)
+    except BackendError as e:
+        logger.info("Something has gone wrong, the output from the backend is logged below.")
+        logger.info(e)
+        exit(1)
+
+    if bucket_exists:
+        logger.info("The GCS bucket {} exists.".format(args.bucket))
+    else:
+        try:
+            backend.create_bucket(args.project, args.bucket)
+        except BackendError as e:
+            logger.info("The GCS bucket {} doesn't exist and couldn't be created, the output from "
+                        "the backend is logged below.".format(args.bucket))
+            logger.info(e)
+            exit(1)
+        logger.info("The GCS bucket {} didn't exist and has been created: Standard storage, "
+                     "American region.".format(args.bucket))
+
+
+def check_project_and_bucket(args):
+    '''
+    This function checks the project and, unless the last upload is being reloaded,
+    sets up the bucket.
+    '''
+    check_project(args)
+    if args.reload_uploaded_file is False:
+        setup_bucket(args)
+
+
+def timed(function, *function_args):
+    '''
+    This function runs a function and times it.
+
+    Returns: The number of seconds it took.
+    '''
+    start_time = time.time()
+    function(*function_args)
+    return time.time() - start_time
+
+
+def wait_for_bucket():
+    '''
+    This function waits for the bucket checks running alongside the preprocessing to
+    finish, so nothing is uploaded before the bucket exists. If the checks failed
+    the same exit is raised here.
+    '''
+    if bucket_check is not None and not bucket_check.done():
+        start_time = time.time()
+        try:
+            bucket_check.result()
+        finally:
+            with _bucket_wait_lock:
+                bucket_wait_time[0] += time.time() - start_time
+    elif bucket_check is not None:
+        bucket_check.result()
+
+
+def log_preflight_overlap(preflight_time, processing_time, total_time):
+    '''
+    This function logs how long the checks against Google Cloud took and how much
+    time was saved by running them alongside the preprocessing and upload.
+    '''
+    saved_time = max(0, preflight_time + processing_time - total_time)
+    logger.info("The project, bucket and dataset checks took {0:.1f} seconds and ran alongside "
+                "the file processing, saving {1:.1f} seconds.".format(preflight_time, saved_time))
 
 
 def setup_bq(args):
     '''
     This function checks if the specified dataset opens.
     '''
-    bq_dataset_exists = ['bq', 'ls', args.dataset]
-    output_dataset = run_shell_command(bq_dataset_exists)
-
-    if "Not found:" in output_dataset['stdout']:
-        create_bq_dataset = ['bq', 'mk', args.dataset]
-        output_create_dataset = run_shell_command(create_bq_dataset)
-        logging.info(output_create_dataset['stdout'])
+    if not backend.dataset_exists(args.dataset):
+        logging.info(backend.create_dataset(args.dataset))
     else:
         logging.info("The dataset {} already exists in BQ".format(args.dataset))
 
@@ -330,6 +1015,453 @@ def get_non_numeric_columns(file, args, line_skip, nrows):
     return columns_to_guess
 
 
+def process_file(file, args):
+    '''
+    This function takes the absolute path of a single file and the config args. It
+    pre-processes the file if needed and uploads it to Google Cloud Storage. The args
+    are modified for this file only, so a copy should be passed in.
+
+    Returns: A list of dictionaries with the details needed to load each uploaded
+    object into BigQuery. This is one object, unless the files in an archive were
+    streamed into the bucket separately.
+    '''
+    source_file = file
+    filename = os.path.basename(file)
+    folderpath = os.path.dirname(file)
+    set_current_file(filename)
+
+    logger.info("The script will attempt to upload: {}".format(filename))
+
+    upload_cache = None
+    if args.no_upload_cache is False:
+        upload_cache = UploadCache(file, args)
+        cached_uploads = upload_cache.lookup(backend.get_object_generation)
+        if cached_uploads:
+            logger.info("{0} hasn't changed since it was uploaded as {1}, the upload will be skipped."
+                        .format(filename, ", ".join("gs://{0}/{1}".format(args.bucket, upload['file_upload_name'])
+                                                    for upload in cached_uploads)))
+            args.line_skip = cached_uploads[0]['line_skip']
+            args.delimiter = cached_uploads[0].get('delimiter', args.delimiter)
+            args.encoding = cached_uploads[0].get('encoding', args.encoding)
+            # Files pandas processed were uploaded as UTF-8, whatever they were read in.
+            args.pandas_processing = cached_uploads[0].get('pandas_processing', args.pandas_processing)
+            return [{
+                "file": file,
+                "file_upload_name": upload['file_upload_name'],
+                "uploaded_path": upload.get('uploaded_path'),
+                "line_index": upload['line_index'],
+                "strict_schema": upload['strict_schema'],
+                "file_format": upload['file_format'],
+                "args": args
+            } for upload in cached_uploads]
+
+    file_format = "CSV"
+    suffixes = Path(filename).suffixes
+    non_supported_archive = set([".zip", ".tar"])
+
+    if "xz" in suffixes or "bz2" in suffixes:
+        logger.info("BigQuery doesn't support xz or bz2 compression you'll need to "
+                    "uncompress before loading with this script.")
+        exit()
+
+    # Things that need to be handled with tar
+    # Non gzip needs to be decompressed. This will be done automatically by pandas.
+    # If there is an intersection then some compression work is needed
+    zipped_non_delimit = False
+    zip_file_extracted = False
+    if set(suffixes) & non_supported_archive:
+
+        if (args.stream_archive is True and args.pandas_processing is False
+                and args.guess_date is False and args.strict_schema is False
+                and args.timestamp_passthrough is False):
+            wait_for_bucket()
+            member_uploads = upload_archive_members(backend, file, args.bucket, compress=args.compress)
+            if upload_cache:
+                upload_cache.record([dict(upload, strict_schema=None, line_skip=args.line_skip,
+                                          pandas_processing=args.pandas_processing)
+                                     for upload in member_uploads], backend.get_object_generation)
+            return [{
+                "file": file,
+                "file_upload_name": upload['file_upload_name'],
+                "uploaded_path": None,
+                "line_index": upload['line_index'],
+                "strict_schema": None,
+                "file_format": upload['file_format'],
+                "args": args
+            } for upload in member_uploads]
+
+        if ".tar" in suffixes:
+            # tar = tarfile.open("sample.tar.gz", "w:gz")
+            import tarfile
+            archive = tarfile.open(file)
+            if len(archive.getmembers()) != 1:
+                logger.info("This script only supports tar archives with a single file inside."
+                            "Please open the archive manually and run on the folder.")
+                exit()
+            else:
+                # Filename is only used for generating new files not loading
+                # so to avoid pandas writing out uncompressed dataframes as .gz files
+                # we set filename here.
+                archived_filename = archive.getmembers()[0].name
+                filename = Path(archived_filename).resolve().stem
+                # Overwrite suffixes with file inside archive as pandas can read
+                # both zip and tar
+                suffixes = Path(archived_filename).suffixes
+        else:
+            import zipfile
+            archive = zipfile.ZipFile(file, "r")
+            if len(archive.infolist()) != 1:
+                logger.info("This script only supports zip archives with a single file inside."
+                            "Please open the archive manually and run on the folder.")
+                exit()
+            else:
+                archived_filename = archive.namelist()[0]
+                filename = Path(archived_filename).resolve().stem
+                suffixes = Path(archived_filename).suffixes
+
+        # If tar won't be opened in pandas then it needs to be opened.
+        if args.guess_date is False and args.pandas_processing is False: 
+            logger.info("An archive is being uploaded directly. BigQuery doesn't support archives "
+                        "so {} will be extracted and then uploaded.".format(archived_filename))
+            archive.extractall(folderpath)
+            zip_file_extracted = True
+
+            file = os.path.join(folderpath,archived_filename)
+            filename = archived_filename
+
+    # Create strict schema for BQ if needed
+    strict_schema = None
+    gcs_mv_or_cp = "cp"
+
+    if ".json" in suffixes or ".avro" in suffixes or zipped_non_delimit is True:
+        if ".json" in suffixes:
+            file_format = "NEWLINE_DELIMITED_JSON"
+            gcs_mv_or_cp = "mv"
+
+            # We have to format and duplicate the JSON file so we rewrite names
+            old_file = file
+            formatted_filename = format_json_for_upload(filename,folderpath)
+
+            if formatted_filename == filename:
+                # Already newline delimited so the original is uploaded.
+                gcs_mv_or_cp = "mv" if zip_file_extracted else "cp"
+            else:
+                filename = formatted_filename
+                file = os.path.join(folderpath, filename)
+                record_in_journal(source_file, PREPROCESSED, output=file)
+
+                # If file was a zip, then extracted file will need to be removed
+                # once JSON copy is processed.
+                if zip_file_extracted:
+                    os.remove(old_file)
+
+        elif ".avro" in suffixes:
+            file_format = "AVRO"
+
+        logger.info("You are uploading a non-CSV file, this means non of the optional "
+                    "functionality can be used, the file will uploaded as is or in the case "
+                    "of JSON, formatted so there is one object per line and then uploaded.")
+        args.pandas_processing = False
+    else:
+        # The head of the file is read once, and the checks and samples below read it
+        # from memory rather than opening the file again.
+        sniff = sniff_file(file, args.encoding, args.delimiter, args.line_skip, SAMPLE_SIZE)
+        args.encoding = sniff.encoding
+        args.delimiter = sniff.delimiter
+
+        # The csv module only splits on single characters, pandas can do the rest.
+        if args.timestamp_passthrough is True and len(args.delimiter) != 1:
+            args.timestamp_passthrough = False
+            args.pandas_processing = True
+
+        # To check line skip we try to open the first line of the file in pandas
+        open_current_skip = read_csv_to_df(sniff.buffer(), args, args.line_skip-1, 2, False)
+        open_test_skip = read_csv_to_df(sniff.buffer(), args, 10, 2, False, has_date=False)
+
+        if open_current_skip.shape != open_test_skip.shape:
+            logger.error("The number of columns in your file changes if 10 rows are skipped. Your line skip is set incorrectly. Remember the skip should also skip the header row.")
+            exit()
+
+        columns_to_guess = False
+        if args.strict_schema is True: 
+            nrows = 2
+            if args.guess_date is True:
+                # There's no reason strict schema can't also be with guessed dates
+                args.pandas_processing = True
+                columns_to_guess = get_non_numeric_columns(sniff.buffer(), args, args.line_skip-1, 200)
+            df_sliced_data = read_csv_to_df(sniff.buffer(), args, args.line_skip-1, nrows, columns_to_guess)
+            strict_schema = create_schema(df_sliced_data, args) 
+        elif args.guess_date is True:
+            # Guessing the dates, means we'll need then open the file in pandas
+            # to output the dates in the correct format.
+            args.pandas_processing = True
+            columns_to_guess = get_non_numeric_columns(sniff.buffer(), args, args.line_skip-1, 200)
+            df_sliced_data = read_csv_to_df(sniff.buffer(), args, args.line_skip-1, 200, columns_to_guess)
+            strict_schema = create_schema(df_sliced_data, args)
+
+            logger.info("You are guessing dates, this means pandas_processing will be enabled "
+                         "and the file opened in pandas to allow date formatting into a BigQuery "
+                         "friendly date format. It will attempt to guess dates based on the top "
+                         "200 rows of the file.")
+
+        if strict_schema and args.schema_inference != "head" and args.output_format == "csv":
+            # Dates are parsed by pandas, so the sample tells us which columns will be dates.
+            date_columns = [str(c) for c in df_sliced_data.select_dtypes(include=['datetime64']).columns]
+            sample_size = args.schema_sample_size if args.schema_inference == "sample" else None
+            logger.info("Inferring the schema from the {} of the file.".format(
+                "whole" if sample_size is None else "a sample of {} rows".format(sample_size)))
+            strict_schema = infer_schema(file, args, args.line_skip-1, sample_size, date_columns)
+
+    # Rows in load errors are found with a line index, which is only built if the load
+    # fails, from the local copy or from the bucket for files which were moved. Files
+    # streamed into the bucket are indexed on the way, as they're read anyway.
+    line_index = None
+
+    # Parquet and Avro files carry the type of every column, so no schema is needed.
+    if args.pandas_processing is True and args.output_format != "csv":
+        file_format, extension = OUTPUT_FORMATS[args.output_format]
+        filename = Path(filename).name.split(".")[0] + extension
+        strict_schema = None
+
+    compress = args.compress is True and file_format in ("CSV", "NEWLINE_DELIMITED_JSON")
+    if args.timestamp_passthrough is True and file_format == "CSV":
+        # The timestamps are rewritten into an uncompressed copy of the file.
+        filename = filename[:-len(".gz")] if filename.endswith(".gz") else filename
+        timestamps_processed_out = os.path.join(folderpath, "timestamps_processed"+filename)
+        rewrite_timestamps(file, args, args.line_skip-1, timestamps_processed_out)
+        record_in_journal(source_file, PREPROCESSED, output=timestamps_processed_out)
+
+        # The lines above the header aren't copied.
+        args.line_skip = 1
+        uploaded_path = None
+        file_upload_name = upload_to_gsc(timestamps_processed_out, filename, folderpath, args.bucket, "mv", args,
+                                         compress=compress)
+    elif args.pandas_processing is False:
+        uploaded_path = file
+        if gcs_mv_or_cp == "mv":
+            uploaded_path = None
+        file_upload_name = upload_to_gsc(file, filename, folderpath, args.bucket, gcs_mv_or_cp, args,
+                                         compress=compress and not file.endswith(".gz"))
+    else:
+        pandas_processed_out = os.path.join(folderpath, "pandas_processed"+filename)
+
+        if args.pipeline is True:
+            if not args.chunksize:
+                logger.info("Pipelined uploads process the file in chunks, a chunksize of {} rows "
+                            "will be used.".format(PIPELINE_CHUNKSIZE))
+                args.chunksize = PIPELINE_CHUNKSIZE
+            file_upload_name, line_index = upload_processed_file_in_pipeline(
+                file, filename, args, columns_to_guess, sniff.buffer(), compress=compress,
+                index=file_format == "CSV")
+        elif args.chunksize or args.processing_workers > 1:
+            if args.chunksize:
+                logger.info("Processing the file in chunks of {} rows.".format(args.chunksize))
+            write_processed_file_in_parts(file, args, args.line_skip-1, columns_to_guess,
+                                          pandas_processed_out, head=sniff.buffer())
+        elif args.optimise_memory is True:
+            df = read_csv_to_df_compactly(file, args, args.line_skip-1, columns_to_guess, sniff.buffer())
+            write_processed_file(df, pandas_processed_out, args.output_format)
+        else:
+            df = read_csv_to_df(file,args,args.line_skip-1,None, columns_to_guess) 
+            write_processed_file(df, pandas_processed_out, args.output_format)
+
+        # If we've opened the file into pandas then we've already performed the line
+        # skip and it should be reset to 1. pandas also writes the file comma separated.
+        args.line_skip = 1
+        args.delimiter = ","
+        uploaded_path = None
+        if args.pipeline is False:
+            record_in_journal(source_file, PREPROCESSED, output=pandas_processed_out)
+            file_upload_name = upload_to_gsc(pandas_processed_out, filename, folderpath, args.bucket, "mv", args,
+                                             compress=compress and not pandas_processed_out.endswith(".gz"))
+
+    if upload_cache:
+        upload_cache.record([{
+            "file_upload_name": file_upload_name,
+            "strict_schema": strict_schema,
+            "file_format": file_format,
+            "line_skip": args.line_skip,
+            "delimiter": args.delimiter,
+            "encoding": args.encoding,
+            "pandas_processing": args.pandas_processing,
+            "uploaded_path": uploaded_path,
+            "line_index": line_index
+        }], backend.get_object_generation)
+
+    return [{
+        "file": file,
+        "file_upload_name": file_upload_name,
+        "uploaded_path": uploaded_path,
+        "line_index": line_index,
+        "strict_schema": strict_schema,
+        "file_format": file_format,
+        "args": args
+    }]
+
+
+def group_results_for_load(results):
+    '''
+    This function takes the results of process_file and groups together the files
+    which can be loaded into BigQuery with a single load job, i.e. those sharing a
+    file format, schema, delimiter, encoding and line skip.
+
+    Returns: A list of dictionaries, one per load job.
+    '''
+    groups = {}
+    for result in results:
+        key = (result['file_format'], result['strict_schema'], result['args'].delimiter,
+               get_load_encoding(result['args']), result['args'].line_skip)
+        if key not in groups:
+            groups[key] = {
+                "file_upload_names": [],
+                "files": [],
+                "source_files": [],
+                "uploaded_paths": [],
+                "line_indexes": [],
+                "strict_schema": result['strict_schema'],
+                "file_format": result['file_format'],
+                "args": result['args']
+            }
+        groups[key]['file_upload_names'].append(result['file_upload_name'])
+        groups[key]['files'].append(result['file'])
+        groups[key]['source_files'].append(result.get('source_file', result['file']))
+        groups[key]['uploaded_paths'].append(result['uploaded_path'])
+        groups[key]['line_indexes'].append(result['line_index'])
+
+    return list(groups.values())
+
+
+class FileLogFilter(logging.Filter):
+    '''
+    Prefixes every log message with the name of the file the current thread is
+    working on, so the logs of files uploaded in parallel can be told apart.
+    '''
+    def filter(self, record):
+        current_file = getattr(_log_context, "filename", None)
+        if current_file:
+            record.msg = "[{0}] {1}".format(current_file, record.getMessage())
+            record.args = None
+        return True
+
+
+def record_in_journal(file, state, **details):
+    '''
+    This function records a file reaching a state in the journal of the current run,
+    if there is one.
+    '''
+    if journal is not None:
+        journal.record(file, state, **details)
+
+
+def describe_error(error):
+    '''
+    Returns: A string describing why a file failed.
+    '''
+    if isinstance(error, SystemExit):
+        return "exited with code {}".format(error.code)
+    return repr(error)
+
+
+def process_and_record(file, args):
+    '''
+    This function runs process_file on a copy of the args and records in the journal
+    whether the file was uploaded, along with the results needed to load it later,
+    or why it failed.
+
+    Returns: The list of results of process_file.
+    '''
+    try:
+        file_results = process_file(file, copy.copy(args))
+    except BaseException as e:
+        record_in_journal(file, FAILED, stage="upload", error=describe_error(e))
+        raise
+
+    for result in file_results:
+        result['source_file'] = file
+    record_in_journal(file, UPLOADED, results=[dict(result, args=vars(result['args']))
+                                               for result in file_results])
+    if load_scheduler is not None:
+        load_scheduler.add(file_results)
+    return file_results
+
+
+def get_saved_results(entry, args):
+    '''
+    This function turns the results saved in the journal back into results which can
+    be loaded, using the max_bad_records given this time.
+
+    Returns: A list of results.
+    '''
+    results = []
+    for saved_result in entry['results']:
+        saved_args = Struct(**saved_result['args'])
+        saved_args.max_bad_records = args.max_bad_records
+        results.append(dict(saved_result, args=saved_args))
+    return results
+
+
+def process_file_in_worker(file, args):
+    '''
+    This function wraps process_and_record for use in a worker thread. It tags the
+    thread's log messages with the filename and turns any exit into a failure.
+
+    Returns: A tuple of the file, the list of results (or None) and the error (or None).
+    '''
+    _log_context.filename = os.path.basename(file)
+    try:
+        return (file, process_and_record(file, args), None)
+    except SystemExit as e:
+        return (file, None, describe_error(e))
+    except Exception as e:
+        logger.error(e)
+        return (file, None, describe_error(e))
+    finally:
+        _log_context.filename = None
+
+
+def process_files_in_parallel(file_list, args):
+    '''
+    This function pre-processes and uploads a list of files using a pool of
+    args.workers threads. A failure of one file doesn't stop the others.
+
+    Returns: A list of results in file_list order and a list of (file, error) failures.
+    '''
+    logger.info("Uploading {0} files using {1} workers.".format(len(file_list), args.workers))
+
+    log_filter = FileLogFilter()
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(log_filter)
+
+    results = []
+    failures = []
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            outcomes = list(executor.map(lambda f: process_file_in_worker(f, args), file_list))
+    finally:
+        for handler in logging.getLogger().handlers:
+            handler.removeFilter(log_filter)
+
+    for file, file_results, error in outcomes:
+        if error is None:
+            results.extend(file_results)
+        else:
+            failures.append((file, error))
+
+    return results, failures
+
+
+def log_upload_summary(results, failures):
+    '''
+    This function logs how many files were uploaded successfully and which failed.
+    '''
+    logger.info("Upload summary: {0} succeeded, {1} failed.".format(len(results), len(failures)))
+    for result in results:
+        logger.info("SUCCESS: {0} -> gs://{1}/{2}".format(
+            os.path.basename(result['file']), result['args'].bucket, result['file_upload_name']))
+    for file, error in failures:
+        logger.info("FAILURE: {0} ({1})".format(os.path.basename(file), error))
+
+
 class Struct:
     def __init__(self, **entries):
         self.__dict__.update(entries)
@@ -339,6 +1471,10 @@ def main():
     # Initialize logging.
     setup_logging()
     global logger
+    global backend
+    global bucket_check
+    global journal
+    global load_scheduler
 
     logger = logging.getLogger(__name__)
 
@@ -382,100 +1518,159 @@ def main():
                         help="This will take the first 200 lines of the file and use it to specify a "
                              "schema, it will also attempt to guess any non number fields as dates. Takes a boolean.")
     parser.add_argument("-tc", "--timestamp_columns",default="No", nargs="+", 
-                        help="Requires file processing. BQ only recognises certain timestamp "
-                             "formats. Enter any columns which have timestamp""s in them.")
-    parser.add_argument("-ts", "--timestamp_strptime",default="No", 
+                        help="BQ only recognises certain timestamp formats. Enter any columns which "
+                             "have timestamp""s in them, only these columns are rewritten unless file "
+                             "processing is needed for something else.")
+    parser.add_argument("-ts", "--timestamp_strptime",default="No", nargs="+",
                         help="Requires file processing. Provide a strptime string to process "
-                             "the dates with. Currently this script doesn""t support files with "
-                             "multiple different timestamps.")
+                             "the dates with. Give one per timestamp column, in the same order, "
+                             "if the columns have different formats.")
     parser.add_argument("-rl", "--reload_uploaded_file",default=False, type=bool,
                         help="Reload uploaded file. When you have uploaded a very large file "
                              "and it has failed to open in BigQuery, this option allows you to just "
-                             "retry the load. (Typically used for increasing error threshold). Takes a boolean.")
+                             "retry the load. (Typically used for increasing error threshold). Every "
+                             "uploaded file of the last run which wasn't loaded is reloaded. Takes a boolean.")
+    parser.add_argument("-rs", "--resume", default=False, type=bool,
+                        help="Carry on the last run of the same path into the same bucket and table. "
+                             "Files which were loaded are skipped, files which were uploaded are only "
+                             "loaded and the rest are uploaded again. Takes a boolean.")
+    parser.add_argument("-al", "--async_load", default=False, type=bool,
+                        help="Start each load job without waiting for it to finish and check on "
+                             "all of them together, so files carry on uploading while earlier ones "
+                             "load. Files uploaded while a job runs are loaded together in the next "
+                             "job. Takes a boolean.")
+    parser.add_argument("-np", "--no_passthrough", default=False, type=bool,
+                        help="When only timestamp columns are given, just those columns are rewritten "
+                             "and every other value is copied as it is. Set this to open the file in "
+                             "pandas and rewrite every column instead. Takes a boolean.")
+    parser.add_argument("-si", "--schema_inference", default="head", choices=["head", "full", "sample"],
+                        help="How strict_schema and guess_date work out column types. head uses the "
+                             "top 2 or 200 rows, full reads every row of the file and sample reads only a "
+                             "random sample of rows from across the file, the same rows every time. "
+                             "Default: head.")
+    parser.add_argument("-sn", "--schema_sample_size", default=100000, type=int,
+                        help="The number of rows used by the sample schema inference. Default: 100000.")
+    parser.add_argument("-w", "--workers", default=1, type=int,
+                        help="When uploading a folder, the number of files to pre-process and upload "
+                             "to Google Cloud Storage at the same time. Default: 1.")
+    parser.add_argument("-cs", "--chunksize", default=None, type=int,
+                        help="Requires file processing. Read and write the file this many rows at a "
+                             "time rather than opening the whole file in pandas, this keeps memory "
+                             "use down for very large files.")
+    parser.add_argument("-pl", "--pipeline", default=False, type=bool,
+                        help="Requires file processing. Upload the processed file while it's being "
+                             "written, chunk by chunk, instead of writing it to disk and uploading "
+                             "it afterwards. Uses a chunksize of {} rows if none is given. Takes a "
+                             "boolean.".format(PIPELINE_CHUNKSIZE))
+    parser.add_argument("-om", "--optimise_memory", default=False, type=bool,
+                        help="Requires file processing. Open the file in pandas a chunk at a time "
+                             "and store text columns as categories or Arrow strings and integers in "
+                             "the smallest type they fit in, which takes a fraction of the memory. The "
+                             "file is read twice so it's slower, the output is the same. Not used with "
+                             "a chunksize. Takes a boolean.")
+    parser.add_argument("-pw", "--processing_workers", default=1, type=int,
+                        help="Requires file processing. Split a large CSV into parts and process "
+                             "them in this many processes at once, one per core. The output is the "
+                             "same as processing it in one go. Only used for CSV output. Default: 1.")
+    parser.add_argument("-sa", "--stream_archive", default=False, type=bool,
+                        help="Stream the files inside zip and tar archives straight into Google Cloud "
+                             "Storage without extracting them to disk. Archives with several files are "
+                             "uploaded as one object per file. Can't be used with file processing, "
+                             "strict_schema or guess_date. Takes a boolean.")
+    parser.add_argument("-z", "--compress", default=False, type=bool,
+                        help="gzip CSV and JSON files before they are uploaded to Google Cloud Storage, "
+                             "compressing blocks of the file on every core at once. BigQuery loads "
+                             "gzipped files as they are. Takes a boolean.")
+    parser.add_argument("-of", "--output_format", default="csv", choices=["csv", "parquet", "avro"],
+                        help="The format processed files are written in before they are uploaded. "
+                             "Parquet and Avro are smaller than CSV, quicker for BigQuery to load and "
+                             "carry the type of every column so no schema is needed. Parquet needs "
+                             "pyarrow and Avro fastavro. Enables pandas processing. Default: csv.")
+    parser.add_argument("-nc", "--no_upload_cache", default=False, type=bool,
+                        help="Files which haven't changed since they were last uploaded with the "
+                             "same settings are normally not uploaded again. Set this to always "
+                             "upload them. Takes a boolean.")
+    parser.add_argument("-nm", "--no_metadata_cache", default=False, type=bool,
+                        help="The default project and the projects, buckets and datasets which exist "
+                             "are normally remembered between runs so they don't have to be checked "
+                             "every time. Set this to always check them. Takes a boolean.")
+    parser.add_argument("-rm", "--refresh_metadata_cache", default=False, type=bool,
+                        help="Check the project, bucket and dataset again this run and remember what "
+                             "is found. Takes a boolean.")
+    parser.add_argument("-mt", "--metadata_cache_ttl", default=60, type=int,
+                        help="The number of minutes the project, buckets and datasets are remembered "
+                             "for. Default: 60.")
+    parser.add_argument("-b", "--backend", default="cli", choices=["cli", "python", "local"],
+                        help="How to talk to Google Cloud. cli runs gsutil and bq, python uses the "
+                             "google-cloud client libraries in process which avoids the start up "
+                             "cost of each command, local stores everything in a folder on disk "
+                             "for testing. Default: cli.")
+    parser.add_argument("-ct", "--composite_threshold", default=None, type=int,
+                        help="Files of at least this many MB are split into parts which are uploaded "
+                             "in parallel and joined back together in Google Cloud Storage. If the "
+                             "upload is interrupted, running the same command again only uploads "
+                             "the missing parts.")
+    parser.add_argument("-ps", "--part_size", default=256, type=int,
+                        help="The size in MB of each part of a composite upload. Default: 256.")
+    parser.add_argument("-uc", "--upload_concurrency", default=4, type=int,
+                        help="The number of parts of a composite upload to upload at the same "
+                             "time. Default: 4.")
+    parser.add_argument("-mf", "--metrics_file", default=None,
+                        help="Write how long every stage took, e.g. each read, write, upload, load and "
+                             "Cloud SDK command, with the bytes, rows and MB/s of each, to this JSON file.")
+    parser.add_argument("-pr", "--profile", default=False, type=bool,
+                        help="Log a table of the time, bytes, rows and MB/s of each stage at the end. "
+                             "Takes a boolean.")
+    parser.add_argument("-lb", "--local_backend_path", default="~/.bq_upload/local_backend",
+                        help="The folder the local backend stores buckets and datasets in.")
 
     args = parser.parse_args()
+    args.timestamp_passthrough = False
+    start_time = time.time()
+    reset_metrics()
+    journal = None
+    load_scheduler = None
+    # A reload swaps the args for the saved ones, so these are kept aside.
+    metrics_file, profile, async_load = args.metrics_file, args.profile, args.async_load
 
     # Bucket data validation, if ends or starts in slash remove.
     args.bucket = args.bucket.strip("/")
 
-    # Check for existance of Google Cloud Console.
-    command = 'gsutil'
-    command2 = 'bq'
-
-    if shutil.which(command) is None:
-        logger.info("This script requires gsutil to be installed. The easiest way to get this "
-                    "is to install and setup the Google Cloud SDK. Instructions here: "
-                    "https://cloud.google.com/sdk/docs/quickstarts")
-        exit(1)
-    if shutil.which(command2) is None:
-        logger.info("This script requires bq to be installed. The easiest way to get this "
-                    "is to install and setup the Google Cloud SDK. Instructions here: "
-                    "https://cloud.google.com/sdk/docs/quickstarts")
+    try:
+        backend = get_backend(args)
+    except BackendError as e:
+        logger.error(e)
         exit(1)
 
-    logger.info("Both gsutil and bq are installed on this machine. Script will continue.")
+    # The project, buckets and datasets found to exist are remembered for a while so
+    # repeated runs don't have to check them again.
+    if args.no_metadata_cache is False and args.metadata_cache_ttl > 0:
+        backend = CachingBackend(backend, args.metadata_cache_ttl * 60, args.project,
+                                 refresh=args.refresh_metadata_cache)
 
-    # If project isn't set, get default project and log it
-    if args.project == "default":
-        get_default_project = ['gcloud','config','list']
-        output_default_project = run_shell_command(get_default_project)
-        try:
-            regex_project = re.search("project = (\S*)", output_default_project['stdout']).group(1)
-            args.project = regex_project
-        except Exception as e:
-            logger.error("There is no default project set in gcloud, run gcloud init and set it up.")
-            exit()
-
-        logger.info("The default configured project is {}.".format(regex_project))
-    else:
-        # Check the project provided exists
-        check_project_exists = ['gcloud','projects','describe',args.project]
-        output_project_exist = run_shell_command(check_project_exists)
-
-        if output_project_exist['stderr']:
-            logger.info(output_project_exist['stderr'])
-            logger.info("Available projects are:")
-
-            get_all_projects = ['gcloud','projects','list']
-            output_get_projects = run_shell_command(get_all_projects)
-
-            logger.info(output_get_projects['stdout'])
+    # Check for existance of Google Cloud Console.
+    for command in backend.required_commands:
+        if shutil.which(command) is None:
+            logger.info("This script requires {} to be installed. The easiest way to get this "
+                        "is to install and setup the Google Cloud SDK. Instructions here: "
+                        "https://cloud.google.com/sdk/docs/quickstarts".format(command))
             exit(1)
-        else:
-            logger.info("The Google Cloud project {} exists".format(args.project))
 
-    if args.reload_uploaded_file is False:
-        # Check the bucket provided exists
-        check_bucket_exists = ['gsutil','ls','-p',args.project]
-        output_bucket_exist = run_shell_command(check_bucket_exists)
-
-        if output_bucket_exist['stdout']:
-            if "gs://{}/".format(args.bucket) in output_bucket_exist['stdout']:
-                logger.info("The GCS bucket {} exists.".format(args.bucket))
-            else:
-                create_bucket = ['gsutil','mb','-p', args.project, "gs://{}/".format(args.bucket)]
-                output_create_bucket = run_shell_command(create_bucket)
-                logger.info("The GCS bucket {} didn't exist and has been created: Standard storage, "
-                             "American region.".format(args.bucket))
-        else:
-            logger.info("Something has gone wrong, stdout and stderr from gsutil logged below.")
-            logger.info(output_bucket_exist)
-            exit(1)
-
-        # Warn user about uploading a folder
-        is_file = True
-        if os.path.isdir(args.path):
-            logger.info("You have selected a folder to upload. This script will now attempt to upload "
-                         "everything in that folder. In case this was a mistake the script will now "
-                         "pause for 2 seconds.")
-            time.sleep(2)
-            is_file = False
+    if backend.required_commands:
+        logger.info("Both gsutil and bq are installed on this machine. Script will continue.")
 
+    # The arguments are checked before anything is created in Google Cloud.
+    if args.reload_uploaded_file is False:
         if args.timestamp_columns != "No":
             if args.timestamp_strptime == "No":
                 logger.info("A timestamp format must be provided with the timestamp column, please \
                              specify one.")
                 exit(1)
+            elif (args.no_passthrough is False and args.pandas_processing is False and args.guess_date is False
+                  and args.strict_schema is False and args.output_format == "csv"):
+                logger.info("You are setting custom timestamps. Only the timestamp columns will be "
+                            "rewritten, every other value is copied as it is.")
+                args.timestamp_passthrough = True
             else:
                 logger.info("You are setting custom timestamps, but didn\'t enabled pandas "
                              "processing. In order to process a specific timestamp format the file "
@@ -486,6 +1681,39 @@ def main():
             if args.timestamp_columns == "No":
                 logger.info("Timestamp column(s) must be provided with the format, please specify them.")
                 exit(1)
+            if len(args.timestamp_strptime) not in (1, len(args.timestamp_columns)):
+                logger.info("Provide either one timestamp format for all of the timestamp columns, "
+                            "or one for each of them.")
+                exit(1)
+
+        if args.output_format != "csv":
+            try:
+                check_output_format(args.output_format)
+            except ColumnarOutputError as e:
+                logger.error(e)
+                exit(1)
+            if args.pandas_processing is False:
+                logger.info("You are writing {} files, which means the file must be opened in "
+                            "pandas and so pandas processing has been enabled.".format(args.output_format))
+                args.pandas_processing = True
+
+    # The checks against Google Cloud run in the background while files are read and
+    # processed locally. Uploads wait for the bucket check to finish.
+    preflight_start = time.time()
+    preflight_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="preflight")
+    bucket_check = preflight_pool.submit(timed, check_project_and_bucket, args)
+
+    if args.reload_uploaded_file is False:
+        dataset_check = preflight_pool.submit(timed, setup_bq, args)
+
+        # Warn user about uploading a folder
+        is_file = True
+        if os.path.isdir(args.path):
+            logger.info("You have selected a folder to upload. This script will now attempt to upload "
+                         "everything in that folder. In case this was a mistake the script will now "
+                         "pause for 2 seconds.")
+            time.sleep(2)
+            is_file = False
 
         # Turn folder or file into list of absolute file paths.
         if is_file is False:
@@ -494,171 +1722,101 @@ def main():
         else:
             file_list = [get_sane_path(args.path)]
 
-        logger.info("Files to be uploaded: {0}".format(len(file_list)))
-
-        # Iterate through list of files to upload
-        for file in file_list:
-            filename = os.path.basename(file)
-            folderpath = os.path.dirname(file)
+        # Every file of the run is recorded in the journal as it's uploaded and loaded,
+        # so a run which was interrupted or failed can be resumed.
+        saved_results = []
+        if args.resume is True:
+            journal = RunJournal.find_last(get_run_key(args))
+            if journal is None:
+                logger.info("No earlier run of {} was found, so every file will be uploaded."
+                            .format(args.path))
+        if journal is None:
+            journal = RunJournal.start(args, file_list)
+        else:
+            journal.resume(file_list)
+            file_states = journal.get_file_states()
+            loaded_files = [file for file in file_list if file_states[file]['state'] == LOADED]
+            uploaded_files = [file for file in file_list
+                              if file not in loaded_files and 'results' in file_states[file]]
+            for file in uploaded_files:
+                saved_results.extend(get_saved_results(file_states[file], args))
+            file_list = [file for file in file_list if file not in loaded_files and file not in uploaded_files]
+            logger.info("Resuming the last run: {0} files were loaded and will be skipped, {1} were "
+                        "uploaded and will only be loaded.".format(len(loaded_files), len(uploaded_files)))
+            if not file_list and not uploaded_files:
+                logger.info("Every file has already been loaded. Script will now exit.")
+                exit()
 
-            logger.info("The script will attempt to upload: {}".format(filename))
+        logger.info("Files to be uploaded: {0}".format(len(file_list)))
 
-            file_format = "CSV"
-            suffixes = Path(filename).suffixes
-            non_supported_archive = set([".zip", ".tar"])
+        # Load jobs are started as files finish uploading, once the dataset exists.
+        if async_load is True:
+            load_scheduler = LoadScheduler(backend, make_load_jobs, finish_load_job, wait=dataset_check.result)
+            load_scheduler.add(saved_results)
 
-            if "xz" in suffixes or "bz2" in suffixes:
-                logger.info("BigQuery doesn't support xz or bz2 compression you'll need to "
-                            "uncompress before loading with this script.")
-                exit()
+        # Iterate through list of files to upload
+        if args.workers > 1 and len(file_list) > 1:
+            results, failures = process_files_in_parallel(file_list, args)
+        else:
+            results = [result for file in file_list for result in process_and_record(file, args)]
+            failures = []
+        results = saved_results + results
 
-            # Things that need to be handled with tar
-            # Non gzip needs to be decompressed. This will be done automatically by pandas.
-            # If there is an intersection then some compression work is needed
-            zipped_non_delimit = False
-            zip_file_extracted = False
-            if set(suffixes) & non_supported_archive:
-
-                if ".tar" in suffixes:
-                    # tar = tarfile.open("sample.tar.gz", "w:gz")
-                    archive = tarfile.open(file)
-                    if len(archive.getmembers()) != 1:
-                        logger.info("This script only supports tar archives with a single file inside."
-                                    "Please open the archive manually and run on the folder.")
-                        exit()
-                    else:
-                        # Filename is only used for generating new files not loading
-                        # so to avoid pandas writing out uncompressed dataframes as .gz files
-                        # we set filename here.
-                        archived_filename = archive.getmembers()[0].name
-                        filename = Path(archived_filename).resolve().stem
-                        # Overwrite suffixes with file inside archive as pandas can read
-                        # both zip and tar
-                        suffixes = Path(archived_filename).suffixes
-                else:
-                    archive = zipfile.ZipFile(file, "r")
-                    if len(archive.infolist()) != 1:
-                        logger.info("This script only supports zip archives with a single file inside."
-                                    "Please open the archive manually and run on the folder.")
-                        exit()
-                    else:
-                        archived_filename = archive.namelist()[0]
-                        filename = Path(archived_filename).resolve().stem
-                        suffixes = Path(archived_filename).suffixes
-
-                # If tar won't be opened in pandas then it needs to be opened.
-                if args.guess_date is False and args.pandas_processing is False: 
-                    logger.info("An archive is being uploaded directly. BigQuery doesn't support archives "
-                                "so {} will be extracted and then uploaded.".format(archived_filename))
-                    archive.extractall(folderpath)
-                    zip_file_extracted = True
-
-                    file = os.path.join(folderpath,archived_filename)
-                    filename = archived_filename
-
-            # Create strict schema for BQ if needed
-            strict_schema = None
-            gcs_mv_or_cp = "cp"
-
-            if ".json" in suffixes or ".avro" in suffixes or zipped_non_delimit is True:
-                if ".json" in suffixes:
-                    file_format = "NEWLINE_DELIMITED_JSON"
-                    gcs_mv_or_cp = "mv"
-
-                    # We have to format and duplicate the JSON file so we rewrite names
-                    old_file = file
-                    filename = format_json_for_upload(filename,folderpath)
-                    file = os.path.join(folderpath, filename)
-
-                    # If file was a zip, then extracted file will need to be removed
-                    # once JSON copy is processed.
-                    if zip_file_extracted:
-                        os.remove(old_file)
-
-                elif ".avro" in suffixes:
-                    file_format = "AVRO"
-
-                logger.info("You are uploading a non-CSV file, this means non of the optional "
-                            "functionality can be used, the file will uploaded as is or in the case "
-                            "of JSON, formatted so there is one object per line and then uploaded.")
-                args.pandas_processing = False
-            else:
-                # To check line skip we try to open the first line of the file in pandas
-                open_current_skip = read_csv_to_df(file, args, args.line_skip-1, 2, False)
-                open_test_skip = read_csv_to_df(file, args, 10, 2, False, has_date=False)
-
-                if open_current_skip.shape != open_test_skip.shape:
-                    logger.error("The number of columns in your file changes if 10 rows are skipped. Your line skip is set incorrectly. Remember the skip should also skip the header row.")
-                    exit()
-
-                columns_to_guess = False
-                if args.strict_schema is True: 
-                    nrows = 2
-                    if args.guess_date is True:
-                        # There's no reason strict schema can't also be with guessed dates
-                        args.pandas_processing = True
-                        columns_to_guess = get_non_numeric_columns(file, args, args.line_skip-1, 200)
-                    df_sliced_data = read_csv_to_df(file, args, args.line_skip-1, nrows, columns_to_guess)
-                    strict_schema = create_schema(df_sliced_data, args) 
-                elif args.guess_date is True:
-                    # Guessing the dates, means we'll need then open the file in pandas
-                    # to output the dates in the correct format.
-                    args.pandas_processing = True
-                    columns_to_guess = get_non_numeric_columns(file, args, args.line_skip-1, 200)
-                    df_sliced_data = read_csv_to_df(file, args, args.line_skip-1, 200, columns_to_guess)
-                    strict_schema = create_schema(df_sliced_data, args)
-
-                    logger.info("You are guessing dates, this means pandas_processing will be enabled "
-                                 "and the file opened in pandas to allow date formatting into a BigQuery "
-                                 "friendly date format. It will attempt to guess dates based on the top "
-                                 "200 rows of the file.")
+        if len(file_list) + len(saved_results) > 1:
+            log_upload_summary(results, failures)
 
-            if args.pandas_processing is False:
-                file_upload_name = upload_to_gsc(file, filename, folderpath, args.bucket, gcs_mv_or_cp)
-            else:
-                df = read_csv_to_df(file,args,args.line_skip-1,None, columns_to_guess) 
-                pandas_processed_out = os.path.join(folderpath, "pandas_processed"+filename)
-
-                df.to_csv(pandas_processed_out, 
-                          index=False, 
-                          date_format='%Y-%m-%d %H:%M:%S', 
-                          quoting=1, 
-                          encoding='utf-8')
-
-                # If we've opened the file into pandas then we've already performed the line
-                # skip and it should be reset to 1.
-                args.line_skip = 1
-                file_upload_name = upload_to_gsc(pandas_processed_out, filename, folderpath, args.bucket, "mv")
-
-            last_config = {
-                "file_upload_name": file_upload_name,
-                "file": file,
-                "args": vars(args),
-                "strict_schema": strict_schema,
-                "file_format": file_format
-            }
+        if not results:
+            logger.error("None of the files were uploaded. Script will now exit.")
+            exit(1)
 
-            last_uploaded_file(last_config)
+        load_groups = group_results_for_load(results)
     elif args.reload_uploaded_file is True:
-        output_loc = os.path.join(os.path.dirname(abspath(getsourcefile(lambda:0))),
-                                  "last_uploaded_file.txt")
-        with open(output_loc, 'r') as file:
-            saved_args = json.load(file)
-
-        file_upload_name = saved_args['file_upload_name']
-        file = saved_args['file']
-        strict_schema = saved_args['strict_schema']
-        file_format = saved_args['file_format']
+        journal = RunJournal.find_last()
+        file_states = journal.get_file_states() if journal else {}
+        results = [result for file, entry in file_states.items()
+                   if entry['state'] != LOADED and 'results' in entry
+                   for result in get_saved_results(entry, args)]
+        if not results:
+            logger.info("There are no uploaded files from the last run which haven't been loaded "
+                        "to reload. Script will now exit.")
+            exit(1)
 
         # Overwrite previous settings with new error number
-        args_temp = Struct(**saved_args['args'])
-        args_temp.max_bad_records = args.max_bad_records
-        args = args_temp
-
-        logger.info("Attempting to reload the last loaded file into BigQuery: {}".format(file_upload_name))
+        for result in results:
+            result['args'].reload_uploaded_file = True
+        load_groups = group_results_for_load(results)
+        args = load_groups[0]['args']
+        dataset_check = preflight_pool.submit(timed, setup_bq, args)
+
+        logger.info("Attempting to reload the last loaded file(s) into BigQuery: {}".format(
+            ", ".join(result['file_upload_name'] for result in results)))
+
+        if async_load is True:
+            load_scheduler = LoadScheduler(backend, make_load_jobs, finish_load_job, wait=dataset_check.result)
+            load_scheduler.add(results)
+
+    processing_time = time.time() - preflight_start - bucket_wait_time[0]
+    preflight_time = max(bucket_check.result(), dataset_check.result())
+    preflight_pool.shutdown()
+    if args.reload_uploaded_file is False:
+        log_preflight_overlap(preflight_time, processing_time, time.time() - preflight_start)
 
-    setup_bq(args)
-    upload_to_bq(file_upload_name,file, args, strict_schema, file_format)
+    # Loads are of groups of files, which are named in the metrics instead.
+    set_current_file(None)
+    if load_scheduler is not None:
+        log_load_summary(load_scheduler.close())
+    else:
+        for group in load_groups:
+            load_succeeded = upload_to_bq(group['file_upload_names'], group['uploaded_paths'], group['args'],
+                                          group['strict_schema'], group['file_format'], group['line_indexes'])
+            record_load(group, load_succeeded)
+
+    if metrics_file:
+        write_metrics_file(metrics_file, time.time() - start_time)
+        logger.info("The metrics of each stage were written to {}.".format(metrics_file))
+    if profile is True:
+        logger.info("Time spent in each stage, stages inside others are counted in both:\n{}"
+                    .format(format_profile(time.time() - start_time)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,197 @@
+"""bq_upload.columnar: writes processed dataframes as Parquet or Avro instead of CSV."""
+
+import re
+
+from .schema import sanitise_column_name
+
+
+# The BigQuery source format and file extension of each output format.
+OUTPUT_FORMATS = {
+    "parquet": ("PARQUET", ".parquet"),
+    "avro": ("AVRO", ".avro"),
+}
+
+
+class ColumnarOutputError(Exception):
+    '''
+    Raised when a columnar output format can't be used, e.g. the package it needs
+    isn't installed.
+    '''
+
+
+def check_output_format(output_format):
+    '''
+    This function checks the packages an output format needs are installed, so the
+    script can stop before anything is uploaded.
+    '''
+    try:
+        if output_format == "parquet":
+            import pyarrow.parquet
+        elif output_format == "avro":
+            import fastavro
+    except ImportError:
+        raise ColumnarOutputError("Writing {0} requires the {1} package. Install it with "
+                                  "pip install bq-upload[{2}]."
+                                  .format(output_format, "pyarrow" if output_format == "parquet" else "fastavro",
+                                          output_format))
+
+
+def get_avro_name(name):
+    '''
+    This function turns a column header into a name Avro accepts, which is stricter
+    than BigQuery.
+
+    Returns: A string.
+    '''
+    avro_name = re.sub("[^A-Za-z0-9_]", "_", sanitise_column_name(name))
+    if not re.match("[A-Za-z_]", avro_name):
+        avro_name = "_" + avro_name
+    return avro_name
+
+
+def get_avro_type(dtype):
+    '''
+    This function maps a pandas dtype to a nullable Avro type. Dates are written as
+    timestamps, which BigQuery reads as TIMESTAMP columns.
+
+    Returns: An Avro type.
+    '''
+    if str(dtype).startswith("datetime64"):
+        avro_type = {"type": "long", "logicalType": "timestamp-micros"}
+    elif str(dtype) in ("bool", "boolean"):
+        avro_type = "boolean"
+    elif dtype.kind in "iu":
+        avro_type = "long"
+    elif dtype.kind == "f":
+        avro_type = "double"
+    else:
+        avro_type = "string"
+    return ["null", avro_type]
+
+
+class ColumnarWriter:
+    '''
+    The shared part of the Parquet and Avro writers. The type of every column is
+    fixed by the first dataframe written, and later dataframes (the chunks of a
+    chunked read) are made to match it.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.dtypes = None
+
+    def conform(self, df):
+        '''
+        This function makes a dataframe's columns match the types of the first one.
+        Date columns can come out of pandas as dates in one chunk and text in another,
+        so dates are written as text if the column started out as text, or was empty.
+
+        Returns: A dataframe.
+        '''
+        if self.dtypes is None:
+            for column in df.columns:
+                if str(df[column].dtype).startswith("datetime64") and df[column].isna().all():
+                    df[column] = df[column].astype(object)
+            self.dtypes = df.dtypes.to_dict()
+            return df
+
+        for column, dtype in self.dtypes.items():
+            series = df[column]
+            if series.dtype == dtype:
+                continue
+            if series.isna().all():
+                df[column] = series.astype(object).where(series.notna(), None).astype(dtype)
+            elif dtype == object:
+                if str(series.dtype).startswith("datetime64"):
+                    text = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+                else:
+                    text = series.astype(str)
+                df[column] = text.where(series.notna(), None)
+            else:
+                raise ColumnarOutputError("The column {0} is {1} in the first chunk of the file but "
+                                          "{2} in a later one. Try again without a chunksize."
+                                          .format(column, dtype, series.dtype))
+        return df
+
+
+class ParquetWriter(ColumnarWriter):
+    '''
+    Writes dataframes to a single Parquet file, or a binary file object. Text columns
+    are always written as strings, even if they are empty in the first chunk.
+    '''
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        super().__init__(path)
+        self._pyarrow = pyarrow
+        self._parquet = pyarrow.parquet
+        self._writer = None
+        self._schema = None
+
+    def _get_schema(self, df):
+        schema = self._pyarrow.Schema.from_pandas(df, preserve_index=False)
+        for i, column in enumerate(df.columns):
+            if df[column].dtype == object or schema.field(i).type == self._pyarrow.null():
+                schema = schema.set(i, self._pyarrow.field(schema.field(i).name, self._pyarrow.string()))
+        return schema
+
+    def write(self, df):
+        df = self.conform(df).rename(columns=sanitise_column_name)
+        if self._writer is None:
+            self._schema = self._get_schema(df)
+            # BigQuery reads timestamps down to the microsecond.
+            self._writer = self._parquet.ParquetWriter(self.path, self._schema, compression="snappy",
+                                                       coerce_timestamps="us",
+                                                       allow_truncated_timestamps=True)
+        self._writer.write_table(self._pyarrow.Table.from_pandas(df, schema=self._schema,
+                                                                 preserve_index=False))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class AvroWriter(ColumnarWriter):
+    '''
+    Writes dataframes to a single Avro file. Every field is nullable. path can also
+    be a binary file object, which is left open.
+    '''
+    def __init__(self, path):
+        import fastavro
+        from fastavro.write import Writer
+        super().__init__(path)
+        self._fastavro = fastavro
+        self._writer_class = Writer
+        self._file = None
+        self._writer = None
+
+    def write(self, df):
+        df = self.conform(df).rename(columns=get_avro_name)
+        if self._writer is None:
+            schema = {
+                "type": "record",
+                "name": "Row",
+                "fields": [{"name": column, "type": get_avro_type(df[column].dtype), "default": None}
+                           for column in df.columns]
+            }
+            self._file = open(self.path, 'wb') if isinstance(self.path, str) else self.path
+            self._writer = self._writer_class(self._file, self._fastavro.parse_schema(schema),
+                                              codec="deflate")
+        for record in df.astype(object).where(df.notna(), None).to_dict('records'):
+            self._writer.write(record)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.flush()
+            if self._file is not self.path:
+                self._file.close()
+
+
+def get_columnar_writer(output_format, path):
+    '''
+    This function creates the writer for an output format.
+
+    Returns: A ParquetWriter or AvroWriter.
+    '''
+    if output_format == "parquet":
+        return ParquetWriter(path)
+    return AvroWriter(path)
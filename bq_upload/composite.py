@@ -0,0 +1,189 @@
+"""bq_upload.composite: resumable parallel composite uploads of very large files."""
+
+import io
+import os
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .userdata import get_user_data_dir
+
+
+logger = logging.getLogger(__name__)
+
+# Google Cloud Storage can compose at most 32 objects in one request.
+MAX_COMPOSE_SOURCES = 32
+
+
+class FileRangeReader(io.RawIOBase):
+    '''
+    A read-only file-like object over length bytes of a file starting at offset.
+    Positions are counted from offset, so it looks like a file of length bytes.
+    '''
+    def __init__(self, path, offset, length):
+        super().__init__()
+        self._file = open(path, 'rb')
+        self._file.seek(offset)
+        self._offset = offset
+        self._length = length
+        self._position = 0
+
+    def read(self, size=-1):
+        remaining = self._length - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self._file.read(size)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self._position
+        elif whence == io.SEEK_END:
+            position += self._length
+        self._position = min(max(position, 0), self._length)
+        self._file.seek(self._offset + self._position)
+        return self._position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def get_progress_path(absolute_path, bucket, object_name):
+    '''
+    This function returns where the progress of uploading a file to an object is saved.
+
+    Returns: String of the progress file path.
+    '''
+    key = "{0}|{1}|{2}".format(absolute_path, bucket, object_name)
+    return os.path.join(get_user_data_dir("uploads"),
+                        hashlib.sha1(key.encode('utf-8')).hexdigest() + ".json")
+
+
+def load_progress(progress_path, expected):
+    '''
+    This function reads the saved progress of an upload. Progress is thrown away if
+    the file or the part size has changed since it was saved.
+
+    Returns: A set of the part numbers already uploaded.
+    '''
+    if not os.path.exists(progress_path):
+        return set()
+
+    try:
+        with open(progress_path, 'r') as f:
+            progress = json.load(f)
+    except ValueError:
+        return set()
+
+    if any(progress.get(key) != value for key, value in expected.items()):
+        logger.info("The file has changed since the last attempt, the upload will start again.")
+        return set()
+
+    return set(progress['completed_parts'])
+
+
+def save_progress(progress_path, expected, completed_parts):
+    '''
+    This function saves which parts of an upload are complete.
+    '''
+    progress = dict(expected, completed_parts=sorted(completed_parts))
+    with open(progress_path + ".tmp", 'w') as f:
+        json.dump(progress, f)
+    os.replace(progress_path + ".tmp", progress_path)
+
+
+def compose_parts(backend, bucket, part_names, object_name, temp_prefix):
+    '''
+    This function composes a list of uploaded parts into a single object, composing
+    in several rounds if there are more parts than a single compose allows.
+
+    Returns: A list of the intermediate objects created, to be deleted afterwards.
+    '''
+    intermediates = []
+    sources = part_names
+    compose_round = 0
+    while len(sources) > MAX_COMPOSE_SOURCES:
+        next_sources = []
+        for i in range(0, len(sources), MAX_COMPOSE_SOURCES):
+            intermediate = "{0}compose_{1}_{2:05d}".format(temp_prefix, compose_round, i // MAX_COMPOSE_SOURCES)
+            backend.compose(bucket, sources[i:i + MAX_COMPOSE_SOURCES], intermediate)
+            next_sources.append(intermediate)
+        intermediates.extend(next_sources)
+        sources = next_sources
+        compose_round += 1
+
+    backend.compose(bucket, sources, object_name)
+    return intermediates
+
+
+def upload_composite(backend, absolute_path, bucket, object_name, part_size, concurrency, move=False):
+    '''
+    This function splits a file into parts of part_size bytes, uploads concurrency
+    parts at a time and then composes them into object_name in the bucket. Finished
+    parts are saved to disk, so if the upload is interrupted running it again only
+    uploads the missing parts.
+
+    Raises BackendError if any part fails to upload.
+    '''
+    stat = os.stat(absolute_path)
+    part_count = max(1, -(-stat.st_size // part_size))
+    temp_prefix = "{0}.bq_upload_parts/".format(object_name)
+    part_names = ["{0}part_{1:05d}".format(temp_prefix, i) for i in range(part_count)]
+
+    expected = {
+        "file": absolute_path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "bucket": bucket,
+        "object_name": object_name,
+        "part_size": part_size
+    }
+    progress_path = get_progress_path(absolute_path, bucket, object_name)
+    completed_parts = load_progress(progress_path, expected)
+    if completed_parts:
+        logger.info("Resuming the upload of {0}, {1} of {2} parts are already uploaded."
+                    .format(object_name, len(completed_parts), part_count))
+
+    progress_lock = threading.Lock()
+
+    def upload_part(part_number):
+        offset = part_number * part_size
+        length = min(part_size, stat.st_size - offset)
+        with FileRangeReader(absolute_path, offset, length) as part:
+            backend.upload_stream(part, bucket, part_names[part_number], length)
+        with progress_lock:
+            completed_parts.add(part_number)
+            save_progress(progress_path, expected, completed_parts)
+
+    remaining_parts = [i for i in range(part_count) if i not in completed_parts]
+    logger.info("Uploading {0} in {1} parts of {2} MB, {3} at a time."
+                .format(object_name, part_count, part_size // (1024 * 1024), concurrency))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # list() re-raises the first error once the other parts have finished.
+        list(executor.map(upload_part, remaining_parts))
+
+    intermediates = compose_parts(backend, bucket, part_names, object_name, temp_prefix)
+    backend.delete_objects(bucket, part_names + intermediates)
+    os.remove(progress_path)
+
+    if move:
+        os.remove(absolute_path)
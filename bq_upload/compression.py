@@ -0,0 +1,100 @@
+"""bq_upload.compression: gzips files on every core by compressing blocks in parallel."""
+
+import os
+import time
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+BLOCK_SIZE = 1024 * 1024
+COMPRESS_LEVEL = 6
+
+# Deflate can refer back up to 32KB, so each block is primed with the end of the one
+# before it and compresses about as well as if the file was compressed in one go.
+WINDOW_SIZE = 32 * 1024
+
+# An empty final deflate block, which ends a stream whose blocks were all sync flushed.
+FINAL_BLOCK = b'\x03\x00'
+
+
+def get_gzip_header():
+    '''
+    Returns: The 10 byte header of a gzip member with no file name.
+    '''
+    return struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0, int(time.time()), 0, 255)
+
+
+def compress_block(block, dictionary, level):
+    '''
+    This function deflates one block, ending it on a byte boundary so the compressed
+    blocks can be joined together into a single deflate stream.
+
+    Returns: Bytes.
+    '''
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def iterate_blocks(chunks, block_size=BLOCK_SIZE):
+    '''
+    This function regroups a stream of byte strings of any size into blocks of
+    block_size bytes, the last of which may be shorter.
+    '''
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= block_size:
+            data = b''.join(pending)
+            for start in range(0, len(data) - block_size + 1, block_size):
+                yield data[start:start + block_size]
+            remainder = data[len(data) - len(data) % block_size:]
+            pending = [remainder] if remainder else []
+            pending_size = len(remainder)
+    if pending_size:
+        yield b''.join(pending)
+
+
+def gzip_chunks(chunks, level=COMPRESS_LEVEL, workers=None):
+    '''
+    This function gzip compresses a stream of byte strings as it's read. Blocks are
+    compressed on a pool of threads (zlib releases the GIL) and written out in order
+    as a single gzip member, so anything that reads gzip can read the result. Only a
+    couple of blocks per thread are held in memory at a time.
+    '''
+    workers = workers or os.cpu_count() or 1
+    crc = 0
+    size = 0
+    dictionary = b''
+    pending = deque()
+
+    yield get_gzip_header()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for block in iterate_blocks(chunks):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            pending.append(executor.submit(compress_block, block, dictionary, level))
+            dictionary = (dictionary + block)[-WINDOW_SIZE:]
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    yield FINAL_BLOCK + struct.pack('<II', crc, size & 0xffffffff)
+
+
+def gzip_file(in_path, out_path, level=COMPRESS_LEVEL, workers=None):
+    '''
+    This function gzips a file on disk using every core.
+
+    Returns: The size of the gzipped file in bytes.
+    '''
+    with open(in_path, 'rb') as in_file, open(out_path, 'wb') as out_file:
+        for compressed in gzip_chunks(iter(lambda: in_file.read(BLOCK_SIZE), b''), level, workers):
+            out_file.write(compressed)
+    return os.path.getsize(out_path)
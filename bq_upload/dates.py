@@ -0,0 +1,138 @@
+"""bq_upload.dates: works out the format of date columns and converts them in one go."""
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# The formats tried when guessing dates, in order of preference. Where a date could be
+# either day or month first, month first wins as that's what pandas assumes.
+DATE_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%SZ",
+    "%Y-%m-%dT%H:%M:%S.%fZ",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y/%m/%d",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y",
+    "%d/%m/%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y",
+    "%d-%m-%Y %H:%M:%S",
+    "%d-%m-%Y",
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y",
+    "%d %b %Y %H:%M:%S",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%b %d %Y",
+    "%b %d, %Y",
+    "%B %d, %Y",
+    "%a, %d %b %Y %H:%M:%S GMT",
+]
+
+# The number of rows at the top of a file the formats are tested against.
+SAMPLE_SIZE = 1000
+
+
+def get_custom_date_formats(columns, formats):
+    '''
+    This function pairs up the timestamp columns with their strptime formats. A
+    single format is used for every column.
+
+    Returns: A dictionary of column name to format.
+    '''
+    if isinstance(formats, str):
+        formats = [formats]
+    if len(formats) == 1:
+        formats = formats * len(columns)
+    return dict(zip(columns, formats))
+
+
+def to_datetime(values, date_format, errors='coerce'):
+    '''
+    This function converts a column to dates with a single vectorised call. Dates
+    with a UTC offset are converted to UTC, as that's how BigQuery reads timestamps
+    without one. Without a format pandas works out the format of every value
+    separately, which is much slower.
+
+    Returns: A series of datetime64 values.
+    '''
+    import pandas as pd
+    return pd.to_datetime(values, format=date_format, errors=errors, utc=True).dt.tz_localize(None)
+
+
+def detect_date_format(values):
+    '''
+    This function tests every candidate format against the values of a column and
+    picks the first one they all match.
+
+    Returns: A strptime format string, or None if none of them match.
+    '''
+    sample = values.dropna().astype(str)
+    if sample.empty:
+        return None
+    for date_format in DATE_FORMATS:
+        if to_datetime(sample, date_format).notna().all():
+            return date_format
+    return None
+
+
+def detect_date_formats(df, columns):
+    '''
+    This function picks a date format for each of the columns of a dataframe, from
+    its first SAMPLE_SIZE rows.
+
+    Returns: A dictionary of column name to format, None where no format matched and
+    pandas has to work it out value by value.
+    '''
+    date_formats = {}
+    for column in columns:
+        date_formats[column] = detect_date_format(df[column].head(SAMPLE_SIZE))
+        if date_formats[column] is None:
+            logger.info("No date format matched the column {}, pandas will try to work out "
+                        "the format of each value.".format(column))
+        else:
+            logger.info("The column {0} has dates in the format {1}.".format(column, date_formats[column]))
+    return date_formats
+
+
+def parse_date_column(values, date_format):
+    '''
+    This function converts a column of guessed dates, as long as every value is a
+    date.
+
+    Returns: A series of datetime64 values, or None if any value isn't a date.
+    '''
+    parsed = to_datetime(values, date_format)
+    if parsed.notna().sum() != values.notna().sum():
+        return None
+    return parsed
+
+
+def convert_date_columns(df, date_formats, strict=False):
+    '''
+    This function converts the date columns of a dataframe, each with its own format.
+    Guessed date columns with values that aren't dates are left as text. If strict is
+    set the formats were given by the user, and a value that doesn't match raises a
+    ValueError.
+
+    Returns: The dataframe.
+    '''
+    for column, date_format in date_formats.items():
+        if column not in df.columns:
+            continue
+        if strict:
+            df[column] = to_datetime(df[column], date_format, errors='raise')
+            continue
+        parsed = parse_date_column(df[column], date_format)
+        if parsed is not None:
+            df[column] = parsed
+    return df
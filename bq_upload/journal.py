@@ -0,0 +1,193 @@
+"""bq_upload.journal: records how far every file of a run got, so runs can be resumed."""
+
+import os
+import json
+import time
+import uuid
+import threading
+
+from .userdata import get_user_data_dir, lock_user_data
+
+
+# The states a file goes through. Files are pending until something is recorded
+# for them, and failed files can be retried.
+PENDING = "pending"
+PREPROCESSED = "preprocessed"
+UPLOADED = "uploaded"
+LOADED = "loaded"
+FAILED = "failed"
+
+# Runs are forgotten once nothing has been recorded for them for this many seconds,
+# and only this many of the most recent runs are kept, so the journal --resume reads
+# doesn't grow forever.
+JOURNAL_MAX_AGE = 30 * 24 * 60 * 60
+JOURNAL_MAX_RUNS = 100
+
+_journal_lock = threading.Lock()
+
+
+def get_journal_path():
+    '''
+    Returns: String of the path of the journal.
+    '''
+    return os.path.join(get_user_data_dir(), "journal.jsonl")
+
+
+def append_entry(entry):
+    '''
+    This function adds an entry to the end of the journal. Entries are only ever
+    added, so a crash can at worst leave the last line half written.
+    '''
+    entry = dict(entry, time=time.time())
+    # Pruning rewrites the journal, so appends by other runs wait for it to finish.
+    with _journal_lock, lock_user_data("journal"):
+        with open(get_journal_path(), 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+def read_entries():
+    '''
+    This function reads every entry in the journal, skipping any line left half
+    written by a crash.
+
+    Returns: A list of dictionaries, oldest first.
+    '''
+    with _journal_lock:
+        return _read_journal(get_journal_path())
+
+
+def _read_journal(path):
+    '''
+    This function reads the entries of a journal without taking the lock.
+
+    Returns: A list of dictionaries, oldest first.
+    '''
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+
+def prune_journal(max_age=None, max_runs=None):
+    '''
+    This function drops every entry of the runs which are older than max_age seconds
+    or aren't among the max_runs most recent, replacing the journal in one step so an
+    interrupted run can't leave it half written. Other runs can't append to the
+    journal while it's being pruned, so none of their entries are lost.
+
+    Returns: The number of runs dropped.
+    '''
+    max_age = JOURNAL_MAX_AGE if max_age is None else max_age
+    max_runs = JOURNAL_MAX_RUNS if max_runs is None else max_runs
+    path = get_journal_path()
+    with _journal_lock, lock_user_data("journal"):
+        entries = _read_journal(path)
+        # The time and position of each run's last entry, so runs started in the same
+        # instant are still ordered.
+        last_seen = {}
+        for position, entry in enumerate(entries):
+            last_seen[entry.get('run')] = (entry.get('time', 0), position)
+        cutoff = time.time() - max_age
+        recent = sorted((run for run, seen in last_seen.items() if seen[0] >= cutoff),
+                        key=lambda run: last_seen[run], reverse=True)
+        keep = set(recent[:max_runs])
+        if len(keep) == len(last_seen):
+            return 0
+        with open(path + ".tmp", 'w') as f:
+            for entry in entries:
+                if entry.get('run') in keep:
+                    f.write(json.dumps(entry) + "\n")
+        os.replace(path + ".tmp", path)
+    return len(last_seen) - len(keep)
+
+
+def get_run_key(args):
+    '''
+    This function describes what a run uploads and where to, which is how a run to
+    resume is found.
+
+    Returns: A dictionary.
+    '''
+    return {
+        "path": os.path.abspath(os.path.expanduser(args.path)),
+        "bucket": args.bucket,
+        "dataset": args.dataset,
+        "table": args.table,
+    }
+
+
+class RunJournal:
+    '''
+    The journal entries of one run. Every file's state is recorded as it changes,
+    along with what's needed to load it once it's uploaded.
+    '''
+    def __init__(self, run_id):
+        self.run_id = run_id
+
+    @classmethod
+    def start(cls, args, files):
+        '''
+        This function starts a new run of a list of files, first dropping the runs
+        too old to be resumed.
+
+        Returns: A RunJournal.
+        '''
+        prune_journal()
+        journal = cls(uuid.uuid4().hex)
+        append_entry({"run": journal.run_id, "event": "run", "key": get_run_key(args), "files": files})
+        return journal
+
+    @classmethod
+    def find_last(cls, key=None):
+        '''
+        This function finds the most recent run, or the most recent one with the
+        given key.
+
+        Returns: A RunJournal, or None if there isn't one.
+        '''
+        for entry in reversed(read_entries()):
+            if entry['event'] == "run" and (key is None or entry['key'] == key):
+                return cls(entry['run'])
+        return None
+
+    def resume(self, files):
+        '''
+        This function records the run being picked up again, with the files found
+        this time.
+        '''
+        append_entry({"run": self.run_id, "event": "resume", "files": files})
+
+    def record(self, file, state, **details):
+        '''
+        This function records a file reaching a state, e.g. the results of its upload
+        or the error it failed with.
+        '''
+        append_entry(dict(details, run=self.run_id, event="file", file=file, state=state))
+
+    def get_file_states(self):
+        '''
+        This function works out where every file of the run got to.
+
+        Returns: A dictionary of file to its latest entry, which has a state of pending
+        if nothing has been recorded for it.
+        '''
+        states = {}
+        for entry in read_entries():
+            if entry.get('run') != self.run_id:
+                continue
+            if entry['event'] in ("run", "resume"):
+                for file in entry['files']:
+                    states.setdefault(file, {"file": file, "state": PENDING})
+            else:
+                # Failures don't lose the results of an earlier upload, so the load
+                # can be retried without uploading again.
+                if entry['state'] == FAILED and 'results' not in entry and 'results' in states.get(entry['file'], {}):
+                    entry = dict(entry, results=states[entry['file']]['results'])
+                states[entry['file']] = entry
+        return states
@@ -0,0 +1,136 @@
+"""bq_upload.json_stream: converts JSON arrays to newline delimited JSON as a stream."""
+
+import json
+
+
+READ_SIZE = 1024 * 1024
+WHITESPACE = ' \t\n\r'
+
+
+def is_ndjson(stream):
+    '''
+    This function checks whether a text stream is already newline delimited JSON,
+    i.e. its first two lines are complete JSON objects. A file with a single object
+    on one line could also be pandas' column format, so it doesn't count. The
+    stream is left where it was.
+
+    Returns: A boolean.
+    '''
+    position = stream.tell()
+    first_lines = [stream.readline(READ_SIZE), stream.readline(READ_SIZE)]
+    stream.seek(position)
+    return lines_are_ndjson(first_lines)
+
+
+def lines_are_ndjson(first_lines):
+    '''
+    This function checks whether the first two lines of a file are both complete
+    JSON objects.
+
+    Returns: A boolean.
+    '''
+    if len(first_lines) < 2:
+        return False
+
+    for line in first_lines[:2]:
+        line = line.strip()
+        if not line.startswith('{'):
+            return False
+        try:
+            if not isinstance(json.loads(line), dict):
+                return False
+        except ValueError:
+            return False
+    return True
+
+
+def iterate_json_array(stream):
+    '''
+    This function reads a JSON document whose top level is an array and yields each
+    element of the array as soon as it has been read, so only one element needs to
+    be held in memory at a time.
+
+    Raises ValueError if the document isn't a JSON array.
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    finished_reading = False
+
+    def fill():
+        nonlocal buffer, position, finished_reading
+        data = stream.read(max(READ_SIZE, len(buffer)))
+        if not data:
+            finished_reading = True
+        buffer = buffer[position:] + data
+        position = 0
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position < len(buffer) or finished_reading:
+                return
+            fill()
+
+    skip_whitespace()
+    if buffer[position:position + 1] != '[':
+        raise ValueError("The JSON document isn't an array.")
+    position += 1
+
+    expect_comma = False
+    while True:
+        skip_whitespace()
+        if position >= len(buffer):
+            raise ValueError("The JSON array isn't closed.")
+        if buffer[position] == ']':
+            return
+        if expect_comma:
+            if buffer[position] != ',':
+                raise ValueError("Expected a comma between array elements.")
+            position += 1
+            skip_whitespace()
+
+        # An element may be split across reads, in which case read more and try again.
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if finished_reading:
+                    raise
+                fill()
+                continue
+            # A number at the end of the buffer may continue in the next read.
+            if end == len(buffer) and not finished_reading:
+                fill()
+                continue
+            break
+
+        position = end
+        expect_comma = True
+        yield element
+
+
+def iterate_ndjson_lines(in_stream):
+    '''
+    This function yields every element of the JSON array read from in_stream as a
+    line of newline delimited JSON.
+    '''
+    for element in iterate_json_array(in_stream):
+        yield json.dumps(element, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def convert_json_to_ndjson(in_stream, out_stream):
+    '''
+    This function writes every element of the JSON array read from in_stream to
+    out_stream as one JSON object per line. Values are written exactly as they were
+    read, without any type conversion.
+
+    Returns: The number of records written.
+    '''
+    records = 0
+    for line in iterate_ndjson_lines(in_stream):
+        out_stream.write(line)
+        records += 1
+    return records
@@ -0,0 +1,221 @@
+"""bq_upload.line_index: maps byte offsets in BigQuery load errors back to rows."""
+
+import os
+import re
+import logging
+
+from .backends import BackendError
+
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1024 * 1024
+
+# The number of blocks read at a time when indexing, so a file in the bucket isn't
+# read with a request per block.
+READ_BLOCKS = 16
+
+# The longest row shown when printing the row an error is on.
+MAX_ROW_BYTES = 64 * 1024
+
+# bq reports errors as e.g. "gs://bucket/file.csv: Error while reading data, error
+# message: ... starting at location 1234" or "... starting at position: 1234".
+ERROR_OFFSET_RE = re.compile(r"starting at\s(?:location|position):?\s(\d+)")
+ERROR_URI_RE = re.compile(r"(gs://[^\s:,]+)")
+
+
+class LineIndex:
+    '''
+    A sparse index of a file which records how many lines come before the start of
+    every block of BLOCK_SIZE bytes. Finding the line a byte is on only needs the
+    newlines in one block to be counted, rather than the whole file.
+    '''
+    def __init__(self, block_line_counts, block_size=BLOCK_SIZE):
+        self.block_line_counts = block_line_counts
+        self.block_size = block_size
+
+    @classmethod
+    def build(cls, reader, block_size=BLOCK_SIZE):
+        '''
+        This function reads a file once in blocks, using reader to read it from disk
+        or the bucket, and counts the newlines in each.
+
+        Returns: A LineIndex.
+        '''
+        builder = LineIndexBuilder(block_size)
+        start = 0
+        while True:
+            try:
+                data = reader.read_range(start, start + block_size * READ_BLOCKS)
+            except BackendError:
+                # Google Cloud Storage won't read from the very end of an object.
+                if start == 0:
+                    raise
+                break
+            builder.feed(data)
+            start += len(data)
+            if len(data) < block_size * READ_BLOCKS:
+                break
+        return builder.build()
+
+    def to_dict(self):
+        return {"block_line_counts": self.block_line_counts, "block_size": self.block_size}
+
+    @classmethod
+    def from_dict(cls, saved):
+        return cls(saved['block_line_counts'], saved['block_size'])
+
+    def find_row(self, reader, offset):
+        '''
+        This function finds the line containing the byte at offset, using reader to
+        read parts of the file.
+
+        Returns: A tuple of the 1-based line number and the text of the line.
+        '''
+        block_number = min(offset // self.block_size, len(self.block_line_counts) - 1)
+        block_start = block_number * self.block_size
+        before = reader.read_range(block_start, offset)
+        line_number = self.block_line_counts[block_number] + before.count(b'\n') + 1
+
+        # Search back for the start of the line, which may be in an earlier block.
+        line_start = offset
+        window = before
+        window_start = block_start
+        while True:
+            newline = window.rfind(b'\n')
+            if newline != -1:
+                line_start = window_start + newline + 1
+                break
+            if window_start == 0 or offset - window_start > MAX_ROW_BYTES:
+                line_start = max(window_start, offset - MAX_ROW_BYTES)
+                break
+            window_end = window_start
+            window_start = max(0, window_start - self.block_size)
+            window = reader.read_range(window_start, window_end)
+
+        after = reader.read_range(offset, offset + MAX_ROW_BYTES)
+        newline = after.find(b'\n')
+        line_end = offset + (newline if newline != -1 else len(after))
+
+        row = reader.read_range(line_start, line_end)
+        return line_number, row.decode('utf-8', 'replace').rstrip('\r')
+
+
+class LineIndexBuilder:
+    '''
+    Builds a LineIndex from data as it's written or streamed, for files which are
+    never on disk as a whole.
+    '''
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.block_line_counts = []
+        self._lines = 0
+        self._position = 0
+
+    def feed(self, data):
+        while data:
+            block_offset = self._position % self.block_size
+            if block_offset == 0:
+                self.block_line_counts.append(self._lines)
+            part = data[:self.block_size - block_offset]
+            self._lines += part.count(b'\n')
+            self._position += len(part)
+            data = data[len(part):]
+
+    def build(self):
+        return LineIndex(self.block_line_counts or [0], self.block_size)
+
+
+class LocalFileReader:
+    '''
+    Reads byte ranges from a local file.
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def read_range(self, start, end):
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(max(0, end - start))
+
+
+class ObjectReader:
+    '''
+    Reads byte ranges from an object in Google Cloud Storage, for files which were
+    moved rather than copied into the bucket.
+    '''
+    def __init__(self, backend, bucket, object_name):
+        self.backend = backend
+        self.bucket = bucket
+        self.object_name = object_name
+
+    def read_range(self, start, end):
+        if end <= start:
+            return b''
+        return self.backend.read_range(self.bucket, self.object_name, start, end)
+
+
+def get_error_offsets(load_output, source_uris):
+    '''
+    This function finds every byte offset mentioned in the output of a failed load
+    job, along with the URI of the file it refers to where bq names one.
+
+    Returns: A list of (uri or None, offset) tuples in the order they were reported.
+    '''
+    error_offsets = []
+    for line in load_output.splitlines():
+        for offset_match in ERROR_OFFSET_RE.finditer(line):
+            uri = None
+            for uri_match in ERROR_URI_RE.finditer(line):
+                if uri_match.group(1) in source_uris:
+                    uri = uri_match.group(1)
+            if (uri, int(offset_match.group(1))) not in error_offsets:
+                error_offsets.append((uri, int(offset_match.group(1))))
+    return error_offsets
+
+
+def log_error_rows(load_output, uploads, backend, bucket, max_errors=20):
+    '''
+    This function logs the row and line number of every byte offset in the errors of
+    a failed load job. uploads is a list of dictionaries with the uri, object_name,
+    local_path (None if the file is no longer on disk) and line_index (None if it
+    hasn't been built yet) of each file in the job. Line indexes are only built when
+    there's an error to find, and are kept in uploads for the errors after it.
+    '''
+    source_uris = [upload['uri'] for upload in uploads]
+    error_offsets = get_error_offsets(load_output, source_uris)
+
+    for uri, offset in error_offsets[:max_errors]:
+        if uri is None:
+            if len(uploads) != 1:
+                logger.info("The error at byte {} doesn't say which file it is in.".format(offset))
+                continue
+            upload = uploads[0]
+        else:
+            upload = uploads[source_uris.index(uri)]
+
+        if upload['local_path'] and os.path.exists(upload['local_path']):
+            reader = LocalFileReader(upload['local_path'])
+        elif upload['object_name'].endswith(".gz"):
+            # Offsets are in the uncompressed data, which can't be read in ranges.
+            logger.info("{} was gzipped and isn't on disk any more so the row can't be found.".format(upload['object_name']))
+            continue
+        else:
+            reader = ObjectReader(backend, bucket, upload['object_name'])
+
+        # The index is built the first time it's needed and reused for later errors.
+        if upload['line_index'] is None:
+            logger.info("Counting the lines of {} to find the rows of the errors.".format(upload['object_name']))
+            try:
+                upload['line_index'] = LineIndex.build(reader)
+            except BackendError as e:
+                logger.info("{0} couldn't be read so the row can't be found. {1}".format(upload['object_name'], e))
+                continue
+
+        line_number, row = upload['line_index'].find_row(reader, offset)
+        logger.info("The error at byte {0} of {1} is on line {2}, which is:".format(
+            offset, upload['object_name'], line_number))
+        logger.info(row)
+
+    if len(error_offsets) > max_errors:
+        logger.info("{} more errors were reported.".format(len(error_offsets) - max_errors))
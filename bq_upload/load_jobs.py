@@ -0,0 +1,194 @@
+"""bq_upload.load_jobs: starts BigQuery load jobs without waiting and checks on them all together."""
+
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .backends import BackendError
+from .metrics import record_stage
+
+
+# How long to wait before first checking on a job, and how much longer to wait
+# each time it's still running, up to MAX_POLL_INTERVAL seconds.
+POLL_INTERVAL = 1.0
+POLL_BACKOFF = 1.5
+MAX_POLL_INTERVAL = 30.0
+
+# The number of jobs checked on at the same time.
+POLL_WORKERS = 8
+
+# A job is given up on after this many checks on it fail in a row.
+MAX_POLL_ERRORS = 5
+
+
+class LoadJob:
+    '''
+    One load job of a group of uploaded files, from when it's started until it has
+    finished.
+    '''
+    def __init__(self, group, source_uris, table, load_options):
+        self.job_id = "bq_upload_" + uuid.uuid4().hex
+        self.group = group
+        self.source_uris = source_uris
+        self.table = table
+        self.load_options = load_options
+        self.submitted_time = None
+        self.finished_time = None
+        self.done = False
+        self.succeeded = False
+        self.output = None
+        self.poll_interval = POLL_INTERVAL
+        self.next_poll_time = 0.0
+        self.poll_errors = 0
+
+    def finish(self, succeeded, output):
+        self.done = True
+        self.succeeded = succeeded
+        self.output = output
+        self.finished_time = time.time()
+
+    def get_seconds(self):
+        '''
+        Returns: The number of seconds the job took, or has taken so far.
+        '''
+        if self.submitted_time is None:
+            return 0.0
+        return (self.finished_time or time.time()) - self.submitted_time
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "table": self.table,
+            "source_uris": self.source_uris,
+            "state": "running" if not self.done else "succeeded" if self.succeeded else "failed",
+            "seconds": round(self.get_seconds(), 2),
+            "output": self.output,
+        }
+
+
+class LoadScheduler:
+    '''
+    Starts load jobs as files finish uploading, without waiting for them, and checks
+    on every running job at once in a background thread, backing off while they run.
+
+    Uploaded files are turned into jobs by make_jobs(results), a list of LoadJobs.
+    While a job is running newly uploaded files are held back and started together
+    when it finishes, so files are still loaded in as few jobs as possible. Once
+    close is called everything held back is started straight away.
+
+    on_finished(job) is called in the background thread as each job finishes, and
+    wait() before the first job is started, e.g. to wait for the dataset to exist.
+    '''
+    def __init__(self, backend, make_jobs, on_finished, wait=None):
+        self.backend = backend
+        self.make_jobs = make_jobs
+        self.on_finished = on_finished
+        self.wait = wait
+        self.jobs = []
+        self.error = None
+        self._pending = []
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="load-jobs", daemon=True)
+        self._thread.start()
+
+    def add(self, results):
+        '''
+        This function hands over the results of uploaded files to be loaded.
+        '''
+        with self._condition:
+            self._pending.extend(results)
+            self._condition.notify()
+
+    def close(self):
+        '''
+        This function starts the jobs of every file handed over and waits for all of
+        them to finish.
+
+        Returns: The list of LoadJobs, in the order they were started.
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.jobs
+
+    def _running_jobs(self):
+        return [job for job in self.jobs if not job.done]
+
+    def _take_pending(self):
+        '''
+        This function waits until there are files to start jobs for, or there's a
+        running job to check on.
+
+        Returns: The results to start jobs for, or None once everything is finished.
+        '''
+        with self._condition:
+            while True:
+                running = self._running_jobs()
+                if self._pending and (self._closed or not running):
+                    pending, self._pending = self._pending, []
+                    return pending
+                if running:
+                    return []
+                if self._closed:
+                    return None
+                self._condition.wait()
+
+    def _submit(self, job):
+        job.submitted_time = time.time()
+        job.next_poll_time = job.submitted_time + job.poll_interval
+        try:
+            self.backend.submit_load(job.job_id, job.source_uris, job.table, job.load_options)
+        except BackendError as e:
+            self._finish(job, False, str(e))
+
+    def _poll(self, job):
+        try:
+            done, succeeded, output = self.backend.get_load_status(job.job_id)
+        except BackendError as e:
+            job.poll_errors += 1
+            if job.poll_errors >= MAX_POLL_ERRORS:
+                self._finish(job, False, str(e))
+                return
+            done = False
+        else:
+            job.poll_errors = 0
+        if done:
+            self._finish(job, succeeded, output)
+        else:
+            job.poll_interval = min(job.poll_interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+            job.next_poll_time = time.time() + job.poll_interval
+
+    def _finish(self, job, succeeded, output):
+        job.finish(succeeded, output)
+        record_stage("load", ", ".join(job.group['file_upload_names']), job.get_seconds())
+        self.on_finished(job)
+
+    def _run(self):
+        try:
+            pending = self._take_pending()
+            if self.wait is not None and pending is not None:
+                self.wait()
+            with ThreadPoolExecutor(max_workers=POLL_WORKERS, thread_name_prefix="load-poll") as pool:
+                while pending is not None:
+                    new_jobs = self.make_jobs(pending) if pending else []
+                    self.jobs.extend(new_jobs)
+                    list(pool.map(self._submit, new_jobs))
+
+                    due = [job for job in self._running_jobs() if job.next_poll_time <= time.time()]
+                    list(pool.map(self._poll, due))
+
+                    running = self._running_jobs()
+                    if running:
+                        # Sleep until the next job is due a check, or more files are handed over.
+                        with self._condition:
+                            timeout = min(job.next_poll_time for job in running) - time.time()
+                            if timeout > 0 and not (self._pending and self._closed):
+                                self._condition.wait(timeout)
+                    pending = self._take_pending()
+        except BaseException as e:
+            self.error = e
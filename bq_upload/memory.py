@@ -0,0 +1,91 @@
+"""bq_upload.memory: reads files into dataframes using less memory."""
+
+from importlib.util import find_spec
+
+
+# The number of rows read at a time, so only one chunk is ever held as Python objects.
+COMPACT_CHUNKSIZE = 100000
+
+# Text columns where at most this share of the values in the sample are distinct are
+# read as categories, which store each distinct value once.
+CATEGORY_RATIO = 0.5
+
+
+def get_string_dtype():
+    '''
+    This function picks the dtype of text columns with many distinct values. Arrow
+    strings are stored in one block of memory rather than as a Python object each.
+
+    Returns: "string[pyarrow]" if pyarrow is installed, otherwise None.
+    '''
+    # Only whether it's installed matters here, so it isn't imported.
+    if find_spec("pyarrow") is None:
+        return None
+    return "string[pyarrow]"
+
+
+def get_compact_dtypes(sample, exclude=()):
+    '''
+    This function picks a compact dtype for every text column of a sample from the
+    top of a file. Only columns pandas reads as text are changed, as a column with
+    text at the top of the file is text all the way through, and they are written
+    out exactly as before. Columns with values pandas reads as True and False are
+    left alone, as are the columns in exclude, e.g. the ones converted to dates.
+
+    Returns: A dictionary of column name to dtype.
+    '''
+    string_dtype = get_string_dtype()
+    dtypes = {}
+    for column in sample.columns:
+        if column in exclude or sample[column].dtype != object:
+            continue
+        values = sample[column].dropna()
+        if not values.map(type).eq(str).all():
+            continue
+        if len(values) and values.nunique() <= len(values) * CATEGORY_RATIO:
+            dtypes[column] = "category"
+        elif string_dtype:
+            dtypes[column] = string_dtype
+    return dtypes
+
+
+def downcast_integers(df):
+    '''
+    This function stores every integer column of a dataframe in the smallest integer
+    type its values fit in. The values themselves don't change.
+
+    Returns: A dataframe.
+    '''
+    import pandas as pd
+    for column in df.columns:
+        if df[column].dtype.kind == "i":
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
+
+
+def concat_chunks(chunks):
+    '''
+    This function joins the chunks of a file back into one dataframe. Category
+    columns are first given the categories of every chunk, otherwise they would be
+    joined as Python objects.
+
+    Returns: A dataframe, or None if there are no chunks.
+    '''
+    import pandas as pd
+    chunks = list(chunks)
+    if not chunks:
+        return None
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            categories = chunks[0][column].cat.categories.append(
+                [chunk[column].cat.categories for chunk in chunks[1:]]).unique()
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def get_memory_size(df):
+    '''
+    Returns: The number of MB a dataframe takes up in memory.
+    '''
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
@@ -0,0 +1,184 @@
+"""bq_upload.metadata_cache: remembers the project, buckets and datasets between runs."""
+
+import os
+import json
+import time
+import threading
+
+from .backends import BackendError
+from .userdata import get_user_data_dir
+
+
+_cache_lock = threading.Lock()
+
+
+def get_metadata_cache_path():
+    '''
+    Returns: String of the path of the metadata cache.
+    '''
+    return os.path.join(get_user_data_dir(), "metadata_cache.json")
+
+
+def read_metadata_cache():
+    '''
+    This function reads the metadata cache.
+
+    Returns: A dictionary of cache entries.
+    '''
+    path = get_metadata_cache_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def write_metadata_cache(cache):
+    '''
+    This function saves the metadata cache, replacing the old one in one step so an
+    interrupted run can't leave it half written.
+    '''
+    path = get_metadata_cache_path()
+    with open(path + ".tmp", 'w') as f:
+        json.dump(cache, f)
+    os.replace(path + ".tmp", path)
+
+
+def get_backend_scope(backend):
+    '''
+    This function names what a backend talks to, so the local backend's folders
+    aren't mistaken for real buckets.
+
+    Returns: A string.
+    '''
+    if backend.name == "local":
+        return "local:{}".format(os.path.abspath(backend.root))
+    return "cloud"
+
+
+class CachingBackend:
+    '''
+    Wraps a backend and remembers the default project and which projects, buckets
+    and datasets exist for ttl seconds, so runs in quick succession don't have to ask
+    Google Cloud again. Only things that exist are remembered. Everything else is
+    passed straight through to the wrapped backend.
+
+    If refresh is set nothing is read from the cache, but what is found is saved.
+    Datasets are remembered against the project given on the command line, as bq
+    looks for them in the default project.
+    '''
+    def __init__(self, backend, ttl, project, refresh=False):
+        self.backend = backend
+        self.ttl = ttl
+        self.project = project
+        self.refresh = refresh
+        self.scope = get_backend_scope(backend)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _key(self, kind, *names):
+        return "|".join((self.scope, kind) + names)
+
+    def _get(self, key):
+        if self.refresh:
+            return None
+        with _cache_lock:
+            entry = read_metadata_cache().get(key)
+        if entry and time.time() - entry['time'] < self.ttl:
+            return entry
+        return None
+
+    def _set(self, key, value=True):
+        with _cache_lock:
+            cache = read_metadata_cache()
+            cache[key] = {"value": value, "time": time.time()}
+            write_metadata_cache(cache)
+
+    def forget(self):
+        '''
+        This function removes everything cached for this backend, e.g. after a bucket
+        or dataset it said existed couldn't be found.
+        '''
+        with _cache_lock:
+            cache = read_metadata_cache()
+            write_metadata_cache({key: entry for key, entry in cache.items()
+                                  if not key.startswith(self.scope + "|")})
+
+    def get_default_project(self):
+        entry = self._get(self._key("default_project"))
+        if entry:
+            return entry['value']
+        project = self.backend.get_default_project()
+        if project is not None:
+            self._set(self._key("default_project"), project)
+        return project
+
+    def check_project(self, project):
+        if self._get(self._key("project", project)):
+            return
+        self.backend.check_project(project)
+        self._set(self._key("project", project))
+
+    def bucket_exists(self, project, bucket):
+        if self._get(self._key("bucket", project, bucket)):
+            return True
+        exists = self.backend.bucket_exists(project, bucket)
+        if exists:
+            self._set(self._key("bucket", project, bucket))
+        return exists
+
+    def create_bucket(self, project, bucket):
+        # A failed create raises, so only buckets which were created are remembered.
+        result = self.backend.create_bucket(project, bucket)
+        self._set(self._key("bucket", project, bucket))
+        return result
+
+    def dataset_exists(self, dataset):
+        if self._get(self._key("dataset", self.project, dataset)):
+            return True
+        exists = self.backend.dataset_exists(dataset)
+        if exists:
+            self._set(self._key("dataset", self.project, dataset))
+        return exists
+
+    def create_dataset(self, dataset):
+        result = self.backend.create_dataset(dataset)
+        self._set(self._key("dataset", self.project, dataset))
+        return result
+
+    def upload_file(self, local_path, bucket, object_name, move=False):
+        try:
+            return self.backend.upload_file(local_path, bucket, object_name, move)
+        except BackendError:
+            self.forget()
+            raise
+
+    def upload_stream(self, stream, bucket, object_name, size=None):
+        try:
+            return self.backend.upload_stream(stream, bucket, object_name, size)
+        except BackendError:
+            self.forget()
+            raise
+
+    def load(self, source_uris, table, load_options):
+        succeeded, output = self.backend.load(source_uris, table, load_options)
+        if not succeeded and "Not found" in output:
+            self.forget()
+        return (succeeded, output)
+
+    def submit_load(self, job_id, source_uris, table, load_options):
+        try:
+            return self.backend.submit_load(job_id, source_uris, table, load_options)
+        except BackendError as e:
+            if "Not found" in str(e):
+                self.forget()
+            raise
+
+    def get_load_status(self, job_id):
+        done, succeeded, output = self.backend.get_load_status(job_id)
+        if done and not succeeded and "Not found" in output:
+            self.forget()
+        return (done, succeeded, output)
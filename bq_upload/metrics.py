@@ -0,0 +1,197 @@
+"""bq_upload.metrics: records how long each stage of an upload takes and how much it moved."""
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+_lock = threading.Lock()
+_records = []
+_context = threading.local()
+
+
+class Stage:
+    '''
+    One timed stage, e.g. reading a file or running a command. bytes and rows are
+    filled in by the code being timed, if it knows them.
+    '''
+    def __init__(self, stage, detail=None):
+        self.stage = stage
+        self.detail = detail
+        self.file = getattr(_context, "file", None)
+        self.bytes = None
+        self.rows = None
+        self.seconds = 0.0
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "file": self.file,
+            "detail": self.detail,
+            "seconds": round(self.seconds, 4),
+            "bytes": self.bytes,
+            "rows": self.rows,
+            "mb_per_second": get_mb_per_second(self.bytes, self.seconds),
+        }
+
+
+def get_mb_per_second(size, seconds):
+    '''
+    Returns: The throughput in MB/s, or None if it isn't known.
+    '''
+    if not size or not seconds:
+        return None
+    return round(size / 1024 / 1024 / seconds, 2)
+
+
+def set_current_file(file):
+    '''
+    This function sets the file the stages timed in this thread belong to.
+    '''
+    _context.file = file
+
+
+def reset_metrics():
+    '''
+    This function throws away everything recorded so far.
+    '''
+    with _lock:
+        del _records[:]
+
+
+def get_records():
+    '''
+    Returns: A list of dictionaries, one per stage timed.
+    '''
+    with _lock:
+        return [record.to_dict() for record in _records]
+
+
+@contextmanager
+def timed_stage(stage, detail=None):
+    '''
+    This function times the code run inside it as a stage, which is recorded even if
+    the code fails.
+
+    Yields: The Stage, so bytes and rows can be set on it.
+    '''
+    record = Stage(stage, detail)
+    start_time = time.time()
+    try:
+        yield record
+    finally:
+        record.seconds = time.time() - start_time
+        with _lock:
+            _records.append(record)
+
+
+def record_stage(stage, detail=None, seconds=0.0):
+    '''
+    This function records a stage which was timed elsewhere, e.g. a load job which ran
+    while other work went on.
+    '''
+    record = Stage(stage, detail)
+    record.seconds = seconds
+    with _lock:
+        _records.append(record)
+
+
+def time_chunks(chunks, stage, detail=None):
+    '''
+    This function passes the chunks of a chunked read through, timing how long it
+    takes to produce them and counting their rows. The time spent by whoever is
+    using the chunks isn't counted.
+    '''
+    record = Stage(stage, detail)
+    record.rows = 0
+    chunks = iter(chunks)
+    try:
+        while True:
+            start_time = time.time()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                record.seconds += time.time() - start_time
+            record.rows += len(chunk)
+            yield chunk
+    finally:
+        with _lock:
+            _records.append(record)
+
+
+def count_bytes(chunks, stage):
+    '''
+    This function passes a stream of byte strings through, adding their size to a
+    stage as it goes.
+    '''
+    stage.bytes = stage.bytes or 0
+    for chunk in chunks:
+        stage.bytes += len(chunk)
+        yield chunk
+
+
+def summarise(records):
+    '''
+    This function adds up the records of each stage.
+
+    Returns: A dictionary of stage to the number of times it ran, the total seconds,
+    bytes and rows, and the throughput.
+    '''
+    stages = {}
+    for record in records:
+        summary = stages.setdefault(record['stage'], {"count": 0, "seconds": 0.0, "bytes": 0, "rows": 0})
+        summary['count'] += 1
+        summary['seconds'] += record['seconds']
+        summary['bytes'] += record['bytes'] or 0
+        summary['rows'] += record['rows'] or 0
+    for summary in stages.values():
+        summary['seconds'] = round(summary['seconds'], 4)
+        summary['mb_per_second'] = get_mb_per_second(summary['bytes'], summary['seconds'])
+    return stages
+
+
+def summarise_files(records):
+    '''
+    This function adds up the time spent on each file, to find the slow ones.
+
+    Returns: A dictionary of file name to stage to seconds.
+    '''
+    files = {}
+    for record in records:
+        if record['file']:
+            file_stages = files.setdefault(record['file'], {})
+            file_stages[record['stage']] = round(file_stages.get(record['stage'], 0.0) + record['seconds'], 4)
+    return files
+
+
+def write_metrics_file(path, total_seconds):
+    '''
+    This function writes everything recorded to a JSON file.
+    '''
+    records = get_records()
+    with open(path, 'w') as f:
+        json.dump({
+            "total_seconds": round(total_seconds, 4),
+            "stages": summarise(records),
+            "files": summarise_files(records),
+            "records": records,
+        }, f, indent=2)
+
+
+def format_profile(total_seconds):
+    '''
+    This function lays out the totals of each stage as a table.
+
+    Returns: A string.
+    '''
+    lines = ["{0:<12} {1:>6} {2:>10} {3:>10} {4:>12} {5:>8}".format(
+        "stage", "count", "seconds", "MB", "rows", "MB/s")]
+    for stage, summary in sorted(summarise(get_records()).items(), key=lambda item: -item[1]['seconds']):
+        lines.append("{0:<12} {1:>6} {2:>10.2f} {3:>10.1f} {4:>12} {5:>8}".format(
+            stage, summary['count'], summary['seconds'], summary['bytes'] / 1024 / 1024,
+            summary['rows'] or "", summary['mb_per_second'] or ""))
+    lines.append("{0:<12} {1:>6} {2:>10.2f}".format("total", "", total_seconds))
+    return "\n".join(lines)
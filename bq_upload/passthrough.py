@@ -0,0 +1,148 @@
+"""bq_upload.passthrough: rewrites the timestamp columns of a CSV and copies everything else as it is."""
+
+import gc
+import io
+import csv
+import gzip
+from itertools import chain, islice
+
+from .dates import to_datetime
+from .schema import PANDAS_NA_VALUES
+
+
+# The number of rows whose timestamps are converted in one go. Small batches keep
+# the number of rows the garbage collector has to look through down.
+BATCH_ROWS = 5000
+
+# The format timestamps are written in, the same as files processed in pandas.
+OUTPUT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class MissingColumnsError(Exception):
+    '''
+    Raised when timestamp columns to rewrite aren't in the header of the file.
+    '''
+
+
+def open_csv(path, encoding):
+    '''
+    This function opens a CSV, which may be gzipped, for reading with the csv module.
+
+    Returns: A text file object.
+    '''
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rt', encoding=encoding, newline='')
+    return open(path, 'r', encoding=encoding, newline='')
+
+
+def read_rows(input_file, delimiter, quotechar='"'):
+    '''
+    This function splits the lines of a CSV into values. Lines without a quote in them
+    are split on the delimiter, which is much quicker than the csv module and joins
+    back to exactly the same line. Lines with quotes are read with the csv module, so
+    quoted delimiters and values running over several lines are handled. Blank lines
+    are skipped.
+
+    Yields: A tuple of the list of values, whether the line had quotes and its line ending.
+    '''
+    lines = iter(input_file)
+    for line in lines:
+        body = line.rstrip('\r\n')
+        if not body:
+            continue
+        ending = line[len(body):]
+        if quotechar in body:
+            reader = csv.reader(chain([line], lines), delimiter=delimiter, quotechar=quotechar)
+            yield next(reader), True, ending
+        else:
+            yield body.split(delimiter), False, ending
+
+
+def format_timestamps(values):
+    '''
+    This function writes datetime64 values out in OUTPUT_DATE_FORMAT with numpy,
+    which is several times quicker than strftime.
+
+    Returns: A list of strings.
+    '''
+    import numpy as np
+    text = np.datetime_as_string(values.astype('datetime64[s]'), unit='s').tolist()
+    return [value.replace('T', ' ') for value in text]
+
+
+def convert_timestamps(rows, index, date_format):
+    '''
+    This function converts one timestamp column of a batch of rows in place, with a
+    single vectorised call. A value which doesn't match the format raises a ValueError.
+    '''
+    import pandas as pd
+    values = pd.Series([row[index] if index < len(row) else '' for row in rows], dtype=object)
+    # Timestamps pandas would read as missing are written out empty, as they are when
+    # the file is processed in pandas.
+    missing = values.isin(PANDAS_NA_VALUES)
+    text = format_timestamps(to_datetime(values.where(~missing), date_format, errors='raise').values)
+    for row, value, is_missing in zip(rows, text, missing.tolist()):
+        if index < len(row):
+            row[index] = '' if is_missing else value
+
+
+def rewrite_timestamp_columns(input_path, output_path, date_formats, encoding, delimiter, line_skip,
+                              output_encoding):
+    '''
+    This function copies a CSV in batches of rows, rewriting the timestamp columns in
+    date_formats into the format BigQuery reads. Every other value is copied through
+    as it was, so numbers aren't reformatted and integer columns with gaps don't turn
+    into floats. Lines without quotes are copied byte for byte apart from their
+    timestamps, lines with quotes are written back out by the csv module, which keeps
+    their values but only quotes them where it's needed. The line_skip lines above
+    the header and any blank lines are dropped. Timestamp columns that aren't in the
+    header raise a MissingColumnsError.
+
+    Returns: The number of rows written, not counting the header.
+    '''
+    # Every row is a new list, each of which counts towards the garbage collector's
+    # next run. Everything already in memory, e.g. pandas, is frozen out of its way
+    # while the file is copied, so those runs only look at the rows.
+    gc.freeze()
+    try:
+        return _rewrite_rows(input_path, output_path, date_formats, encoding, delimiter, line_skip,
+                             output_encoding)
+    finally:
+        gc.unfreeze()
+
+
+def _rewrite_rows(input_path, output_path, date_formats, encoding, delimiter, line_skip, output_encoding):
+    rows_written = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter, lineterminator='')
+
+    def format_row(values, quoted, ending):
+        if not quoted:
+            return delimiter.join(values) + ending
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue() + ending
+
+    with open_csv(input_path, encoding) as input_file:
+        rows = read_rows(input_file, delimiter)
+        for _ in range(line_skip):
+            next(rows, None)
+        header = next(rows, ([], False, '\n'))
+        missing_columns = [column for column in date_formats if column not in header[0]]
+        if missing_columns:
+            raise MissingColumnsError("The timestamp columns {0} aren't in the header of the file, which has "
+                                      "the columns {1}.".format(", ".join(missing_columns), ", ".join(header[0])))
+        columns = [(header[0].index(column), date_format) for column, date_format in date_formats.items()]
+
+        with open(output_path, 'w', encoding=output_encoding, newline='') as output_file:
+            output_file.write(format_row(*header))
+            while True:
+                batch = list(islice(rows, BATCH_ROWS))
+                if not batch:
+                    break
+                for index, date_format in columns:
+                    convert_timestamps([values for values, _, _ in batch], index, date_format)
+                output_file.write(''.join([format_row(*row) for row in batch]))
+                rows_written += len(batch)
+    return rows_written
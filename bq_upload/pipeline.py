@@ -0,0 +1,137 @@
+"""bq_upload.pipeline: uploads a file while it's still being written."""
+
+import io
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from .json_stream import READ_SIZE
+
+# The number of blocks the writer can get ahead of the upload before it has to wait.
+MAX_PENDING_BLOCKS = 16
+
+# The number of rows processed at a time when no chunksize is given.
+PIPELINE_CHUNKSIZE = 100000
+
+_END = object()
+
+
+class PipelineError(Exception):
+    '''
+    Raised in the writing thread when the upload reading from the pipe has failed.
+    '''
+
+
+class PipeWriter(io.RawIOBase):
+    '''
+    A write-only binary file object whose data is read, in blocks, by another thread.
+    Only MAX_PENDING_BLOCKS blocks are held at once, so if the reader falls behind
+    the writer waits for it rather than using more memory.
+    '''
+    def __init__(self, max_pending_blocks=MAX_PENDING_BLOCKS, block_size=READ_SIZE):
+        self._queue = queue.Queue(maxsize=max_pending_blocks)
+        self._block_size = block_size
+        self._buffer = bytearray()
+        self._position = 0
+        self._finished = False
+        self.reader_error = None
+        self.wait_time = 0.0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def _put(self, item):
+        start_time = time.time()
+        while True:
+            if self.reader_error is not None:
+                raise PipelineError("The upload failed: {}".format(self.reader_error))
+            try:
+                self._queue.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self.wait_time += time.time() - start_time
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self._block_size:
+            self._put(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(data)
+
+    def close(self):
+        if not self._finished:
+            self._finished = True
+            if self._buffer:
+                self._put(bytes(self._buffer))
+                self._buffer = bytearray()
+            self._put(_END)
+        super().close()
+
+    def abort(self, error):
+        '''
+        This function tells the reader the writer has failed, so the upload stops.
+        '''
+        self._finished = True
+        while True:
+            try:
+                self._queue.put_nowait(error)
+                return
+            except queue.Full:
+                # Blocks the upload hasn't taken yet are thrown away to make room.
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def iterate_blocks(self):
+        '''
+        This function yields the blocks written to the pipe until the writer closes it.
+        '''
+        while True:
+            block = self._queue.get()
+            if block is _END:
+                return
+            if isinstance(block, BaseException):
+                raise PipelineError("Writing the file failed: {}".format(block))
+            yield block
+
+
+def run_pipeline(write, upload):
+    '''
+    This function runs write(pipe) in this thread and upload(blocks) in another at
+    the same time, so the upload starts as soon as the first block is written.
+    Whichever fails first stops the other.
+
+    Returns: A tuple of the total time, the time spent writing and the time spent
+    waiting for the upload to catch up.
+    '''
+    pipe = PipeWriter()
+
+    def read():
+        try:
+            upload(pipe.iterate_blocks())
+        except BaseException as e:
+            pipe.reader_error = e
+            raise
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload") as executor:
+        upload_future = executor.submit(read)
+        try:
+            write(pipe)
+            pipe.close()
+        except PipelineError:
+            # The upload's own error is more useful and is raised below.
+            pass
+        except BaseException as e:
+            pipe.abort(e)
+            raise
+        upload_future.result()
+
+    total_time = time.time() - start_time
+    return total_time, total_time - pipe.wait_time, pipe.wait_time
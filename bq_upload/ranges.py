@@ -0,0 +1,97 @@
+"""bq_upload.ranges: splits a CSV into byte ranges which start and end on whole rows."""
+
+import os
+import codecs
+from pathlib import Path
+
+
+BLOCK_SIZE = 1024 * 1024
+
+# Files are split into ranges of at least this size, so small files aren't split
+# into more pieces than are worth the start up cost of a process.
+MIN_RANGE_SIZE = 8 * 1024 * 1024
+
+# The number of ranges per process a file is split into, so a process which finishes
+# early can pick up another range rather than waiting for the slowest.
+RANGES_PER_WORKER = 4
+
+# Files with these extensions have to be read from the start.
+UNSPLITTABLE_SUFFIXES = {".gz", ".zip", ".tar", ".bz2", ".xz"}
+
+
+def can_split(path, encoding):
+    '''
+    This function checks a file can be read starting part way through, i.e. it isn't
+    compressed and every newline is a single byte.
+
+    Returns: A boolean.
+    '''
+    if UNSPLITTABLE_SUFFIXES & set(Path(path).suffixes):
+        return False
+    return codecs.lookup(encoding).name not in ("utf-16", "utf-16-le", "utf-16-be",
+                                                "utf-32", "utf-32-le", "utf-32-be")
+
+
+def find_line_end(path, lines):
+    '''
+    This function finds where the given number of lines from the start of a file end,
+    e.g. the lines skipped and the header row.
+
+    Returns: The byte offset just after the last of them.
+    '''
+    position = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            index = -1
+            while lines > 0:
+                index = block.find(b'\n', index + 1)
+                if index == -1:
+                    break
+                lines -= 1
+            if lines == 0:
+                return position + index + 1
+            position += len(block)
+    return position
+
+
+def split_rows(path, start, parts, quotechar='"'):
+    '''
+    This function splits a file, from start, into about parts ranges of the same size.
+    Every range ends just after a newline which isn't inside a quoted value, so no
+    row is split between two ranges. Whether a newline is quoted is worked out by
+    counting the quotes before it, which also works for doubled quotes.
+
+    Returns: A list of (start, end) tuples covering the file from start to the end.
+    '''
+    size = os.path.getsize(path)
+    range_size = max(-(-(size - start) // parts), MIN_RANGE_SIZE)
+    quote = quotechar.encode('ascii')
+
+    boundaries = [start]
+    target = start + range_size
+    quoted = False
+    position = start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            block_end = position + len(block)
+            counted_to = 0
+            block_quoted = quoted
+            while target < block_end:
+                newline = block.find(b'\n', max(target - position, counted_to))
+                if newline == -1:
+                    break
+                block_quoted ^= block.count(quote, counted_to, newline) % 2 == 1
+                counted_to = newline
+                if not block_quoted:
+                    boundaries.append(position + newline + 1)
+                    target = position + newline + 1 + range_size
+                else:
+                    target = position + newline + 1
+            quoted ^= block.count(quote) % 2 == 1
+            position = block_end
+            target = max(target, position)
+
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
@@ -0,0 +1,220 @@
+"""bq_upload.schema: infers a BigQuery schema by streaming through a whole file."""
+
+import io
+import os
+import re
+import csv
+import random
+import logging
+from itertools import islice
+
+from .ranges import can_split, find_line_end
+from .sniffer import open_binary
+
+
+logger = logging.getLogger(__name__)
+
+INTEGER_RE = re.compile(r"^[+-]?\d+$")
+FLOAT_RE = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+BOOLEAN_RE = re.compile(r"^(true|false)$", re.IGNORECASE)
+DATE_RE = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}$")
+TIMESTAMP_RE = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}[ T]\d{1,2}:\d{2}(:\d{2}(\.\d{1,6})?)?( ?(UTC|Z|[+-]\d{2}:?\d{2}))?$")
+
+# Strings pandas reads as missing values, these end up empty in a pandas processed file.
+PANDAS_NA_VALUES = set(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+                        '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+                        'n/a', 'nan', 'null'])
+
+# The types a value can widen to, e.g. INTEGER and FLOAT values in the same column
+# make a FLOAT column. Anything not listed here widens to STRING.
+WIDENED_TYPES = {
+    frozenset(["INTEGER", "FLOAT"]): "FLOAT",
+    frozenset(["DATE", "TIMESTAMP"]): "TIMESTAMP",
+}
+
+# Sampled rows are read in runs of this many rows from random places in the file.
+SAMPLE_RUN_ROWS = 100
+
+# The sample is picked the same way every time, so the same file always gets the
+# same schema.
+SAMPLE_SEED = 0
+
+
+def sanitise_column_name(name):
+    '''
+    This function turns a column header into a name BigQuery accepts.
+
+    Returns: A string.
+    '''
+    return str(name).translate(str.maketrans('','','!@/()%,')).replace(" ","_").replace("-","_")
+
+
+def get_value_type(value):
+    '''
+    This function works out the narrowest BigQuery type a single CSV value fits.
+
+    Returns: A BigQuery type name.
+    '''
+    if INTEGER_RE.match(value):
+        # Integers outside of BigQuery's 64 bit range can only be loaded as floats.
+        return "INTEGER" if abs(int(value)) < 2 ** 63 else "FLOAT"
+    if FLOAT_RE.match(value):
+        return "FLOAT"
+    if BOOLEAN_RE.match(value):
+        return "BOOLEAN"
+    if DATE_RE.match(value):
+        return "DATE"
+    if TIMESTAMP_RE.match(value):
+        return "TIMESTAMP"
+    return "STRING"
+
+
+def widen_type(current_type, value_type):
+    '''
+    This function combines the type of a column so far with the type of a new value.
+
+    Returns: A BigQuery type name.
+    '''
+    if current_type is None or current_type == value_type:
+        return value_type
+    return WIDENED_TYPES.get(frozenset([current_type, value_type]), "STRING")
+
+
+class ColumnTypes:
+    '''
+    Keeps track of the widest type and whether there are empty values for every
+    column seen so far.
+    '''
+    def __init__(self, header, null_values):
+        self.header = header
+        self.null_values = null_values
+        self.types = [None] * len(header)
+        self.nullable = [False] * len(header)
+
+    def add_row(self, row):
+        for i, value in enumerate(row[:len(self.types)]):
+            if value in self.null_values:
+                self.nullable[i] = True
+            elif self.types[i] != "STRING":
+                self.types[i] = widen_type(self.types[i], get_value_type(value))
+        # Short rows have empty values in the missing columns.
+        for i in range(len(row), len(self.types)):
+            self.nullable[i] = True
+
+
+def open_csv_text(inputfile, encoding):
+    '''
+    This function opens a CSV for reading as text. Gzipped CSVs are decompressed and
+    for zip and tar archives the CSV inside is read.
+
+    Returns: A file object.
+    '''
+    return io.TextIOWrapper(open_binary(inputfile), encoding=encoding, newline='')
+
+
+def iterate_sample(rows, sample_size, seed=SAMPLE_SEED):
+    '''
+    This function picks sample_size rows spread evenly at random through an iterator
+    of rows, holding only the sample in memory (reservoir sampling). Every row has
+    to be read, so it's used for files which can't be read from part way through.
+
+    Returns: A list of rows.
+    '''
+    generator = random.Random(seed)
+    reservoir = []
+    for i, row in enumerate(rows):
+        if i < sample_size:
+            reservoir.append(row)
+        else:
+            j = generator.randint(0, i)
+            if j < sample_size:
+                reservoir[j] = row
+    return reservoir
+
+
+def iterate_sampled_runs(inputfile, encoding, delimiter, data_start, sample_size, columns, seed=SAMPLE_SEED):
+    '''
+    This function picks about sample_size rows from across a file by reading runs of
+    SAMPLE_RUN_ROWS rows from random places in it, so only the sample is read. Each
+    run starts at the first line after the place picked. That may be inside a quoted
+    value running over several lines, so rows which don't have the same number of
+    values as the header are left out.
+
+    Yields: Rows as lists of values.
+    '''
+    size = os.path.getsize(inputfile)
+    if size <= data_start:
+        return
+    generator = random.Random(seed)
+    offsets = sorted(generator.randrange(data_start, size) for _ in range(-(-sample_size // SAMPLE_RUN_ROWS)))
+
+    rows_read = 0
+    position = data_start
+    with open(inputfile, 'rb') as f:
+        for offset in offsets:
+            # Runs which would overlap carry on from the end of the last one.
+            if offset > position:
+                f.seek(offset - 1)
+                f.readline()
+            lines = (line.decode(encoding, 'replace') for line in iter(f.readline, b''))
+            for row in islice(csv.reader(lines, delimiter=delimiter), SAMPLE_RUN_ROWS):
+                if len(row) == columns:
+                    yield row
+                    rows_read += 1
+            position = f.tell()
+            if rows_read >= sample_size or position >= size:
+                return
+
+
+def infer_schema(inputfile, args, line_skip, sample_size=None, date_columns=None):
+    '''
+    This function reads a CSV row by row after skipping line_skip lines and the
+    header, and works out the type of every column from every value in it. If a
+    sample_size is given a random sample of about that many rows from across the
+    file is used instead, which is the same every time. Only the sample is read,
+    unless the file is compressed and has to be read from the start. Memory use
+    doesn't depend on the size of the file.
+
+    Columns in date_columns are parsed by pandas so are always TIMESTAMP. With pandas
+    processing pandas' missing values are treated as empty, and integer columns with
+    empty values become FLOAT as that's how pandas writes them.
+
+    Returns: A BQ compatible schema string.
+    '''
+    date_columns = date_columns or []
+    pandas_processing = args.pandas_processing is True
+    null_values = PANDAS_NA_VALUES if pandas_processing else set([''])
+
+    with open_csv_text(inputfile, args.encoding) as f:
+        for _ in range(line_skip):
+            f.readline()
+        reader = csv.reader(f, delimiter=args.delimiter)
+        header = next(reader)
+        column_types = ColumnTypes(header, null_values)
+
+        rows = reader
+        if sample_size and can_split(inputfile, args.encoding):
+            rows = iterate_sampled_runs(inputfile, args.encoding, args.delimiter,
+                                        find_line_end(inputfile, line_skip + 1), sample_size, len(header))
+        elif sample_size:
+            rows = iterate_sample(reader, sample_size)
+        row_count = 0
+        for row in rows:
+            column_types.add_row(row)
+            row_count += 1
+
+    schema_list = []
+    for name, column_type, nullable in zip(header, column_types.types, column_types.nullable):
+        if name in date_columns:
+            column_type = "TIMESTAMP"
+        elif column_type is None:
+            column_type = "STRING"
+        elif column_type == "INTEGER" and nullable and pandas_processing:
+            column_type = "FLOAT"
+        schema_list.append([sanitise_column_name(name), column_type.lower()])
+
+    nullable_columns = [name for name, nullable in zip(header, column_types.nullable) if nullable]
+    logger.info("The schema was inferred from {0} rows. Columns with empty values: {1}"
+                .format(row_count, ",".join(nullable_columns) or "none"))
+
+    return ','.join(':'.join(inner) for inner in schema_list)
@@ -0,0 +1,157 @@
+"""bq_upload.sniffer: reads the head of a file once and works out how to read the rest."""
+
+import io
+import csv
+import gzip
+import codecs
+import logging
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+
+# The delimiters tried if the file doesn't split into columns on the one given.
+DELIMITERS = [",", "\t", ";", "|"]
+
+# The encoding used if a file isn't valid UTF-8. Every byte is a valid character in
+# it and BigQuery can load it as it is.
+FALLBACK_ENCODING = "latin-1"
+
+
+class FileSniff:
+    '''
+    The head of a file, decoded, along with the encoding and delimiter worked out
+    from it. Every probe of the head reads from memory rather than opening the file.
+    '''
+    def __init__(self, text, encoding, delimiter, complete):
+        self.text = text
+        self.encoding = encoding
+        self.delimiter = delimiter
+        self.complete = complete
+
+    def buffer(self):
+        '''
+        Returns: A new text stream over the head of the file.
+        '''
+        return io.StringIO(self.text)
+
+
+def open_binary(path):
+    '''
+    This function opens a file for reading as bytes. Gzipped files are decompressed
+    and for zip and tar archives the first file inside is read, as pandas does.
+
+    Returns: A binary file object.
+    '''
+    suffixes = Path(path).suffixes
+    if ".tar" in suffixes:
+        import tarfile
+        archive = tarfile.open(path, "r|*")
+        for member in archive:
+            if member.isfile():
+                return archive.extractfile(member)
+    if ".zip" in suffixes:
+        import zipfile
+        archive = zipfile.ZipFile(path, "r")
+        return archive.open(archive.infolist()[0])
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_head(path, lines):
+    '''
+    This function reads blocks from the start of a file until it has at least the
+    given number of lines, or the file ends.
+
+    Returns: A tuple of the bytes read and whether that was the whole file.
+    '''
+    blocks = []
+    newlines = 0
+    with open_binary(path) as f:
+        while newlines < lines:
+            block = f.read(READ_SIZE)
+            if not block:
+                return b''.join(blocks), True
+            blocks.append(block)
+            newlines += block.count(b'\n')
+    return b''.join(blocks), False
+
+
+def detect_encoding(head, encoding, complete):
+    '''
+    This function checks the head of a file decodes with the encoding given. Byte
+    order marks are followed and, if the encoding is the default UTF-8 and the file
+    isn't valid UTF-8, the fallback encoding is used.
+
+    Returns: A tuple of the encoding and the decoded text.
+    '''
+    if encoding.lower().replace("-", "").replace("_", "") == "utf8":
+        if head.startswith(codecs.BOM_UTF8):
+            encoding = "utf-8-sig"
+        elif head.startswith(codecs.BOM_UTF16_LE) or head.startswith(codecs.BOM_UTF16_BE):
+            encoding = "utf-16"
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        return encoding, decoder.decode(head, final=complete)
+    except UnicodeDecodeError:
+        if encoding not in ("utf-8", "utf8"):
+            raise
+    logger.info("The file isn't valid UTF-8, it will be read as {}.".format(FALLBACK_ENCODING))
+    return FALLBACK_ENCODING, head.decode(FALLBACK_ENCODING)
+
+
+def count_columns(lines, delimiter):
+    '''
+    Returns: The set of the numbers of columns in the lines, split on delimiter.
+    '''
+    return set(len(row) for row in csv.reader(lines, delimiter=delimiter) if row)
+
+
+def detect_delimiter(lines, delimiter):
+    '''
+    This function checks the delimiter given splits the lines into columns. If they
+    are a single column, the other common delimiters are tried and the first one
+    which splits every line into the same number of columns is used.
+
+    Returns: A delimiter.
+    '''
+    if count_columns(lines, delimiter) != {1}:
+        return delimiter
+    for candidate in DELIMITERS:
+        if candidate == delimiter:
+            continue
+        column_counts = count_columns(lines, candidate)
+        if len(column_counts) == 1 and column_counts != {1}:
+            logger.info("The file doesn't have any {0!r} delimiters, it will be split on {1!r}."
+                        .format(delimiter, candidate))
+            return candidate
+    return delimiter
+
+
+def sniff_file(path, encoding, delimiter, line_skip, rows):
+    '''
+    This function reads the head of a file once, enough for the lines skipped and
+    the given number of rows, and works out the encoding and delimiter from it.
+    Delimiters are only looked for if the default comma is being used.
+
+    Returns: A FileSniff.
+    '''
+    head, complete = read_head(path, line_skip + rows + 1)
+    encoding, text = detect_encoding(head, encoding, complete)
+
+    # Drop a partial last line, unless it's the end of the file.
+    if not complete and "\n" in text:
+        text = text[:text.rindex("\n") + 1]
+
+    if delimiter == ",":
+        lines = text.splitlines()[max(line_skip - 1, 0):]
+        # The last line may be cut off part way through a quoted value.
+        if not complete:
+            lines = lines[:-1]
+        delimiter = detect_delimiter(lines, delimiter)
+
+    return FileSniff(text, encoding, delimiter, complete)
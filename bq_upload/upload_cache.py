@@ -0,0 +1,163 @@
+"""bq_upload.upload_cache: remembers which files are already in Google Cloud Storage."""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+from .userdata import get_user_data_dir
+
+
+# The settings which change what is uploaded for a file. A file is only skipped if
+# it was uploaded with the same values for all of these.
+PROCESSING_SETTINGS = [
+    "line_skip",
+    "pandas_processing",
+    "delimiter",
+    "encoding",
+    "strict_schema",
+    "guess_date",
+    "timestamp_columns",
+    "timestamp_strptime",
+    "timestamp_passthrough",
+    "schema_inference",
+    "stream_archive",
+    "compress",
+    "output_format",
+]
+
+_manifest_lock = threading.Lock()
+
+
+def get_manifest_path():
+    '''
+    Returns: String of the path of the upload manifest.
+    '''
+    return os.path.join(get_user_data_dir(), "upload_manifest.json")
+
+
+def read_manifest():
+    '''
+    This function reads the upload manifest.
+
+    Returns: A dictionary of manifest entries.
+    '''
+    path = get_manifest_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def write_manifest(manifest):
+    '''
+    This function saves the upload manifest, replacing the old one in one step so
+    an interrupted run can't leave it half written.
+    '''
+    path = get_manifest_path()
+    with open(path + ".tmp", 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def get_file_hash(path):
+    '''
+    This function works out the SHA-256 of a file, reading it in blocks.
+
+    Returns: The hex digest as a string.
+    '''
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_settings_fingerprint(args):
+    '''
+    This function summarises the settings that affect how a file is uploaded.
+
+    Returns: A string.
+    '''
+    settings = {name: getattr(args, name, None) for name in PROCESSING_SETTINGS}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class UploadCache:
+    '''
+    Looks up and records the uploads of a single file. The file's hash is only
+    worked out if its size or modified time has changed since it was last seen.
+    '''
+    def __init__(self, path, args):
+        self.path = path
+        self.bucket = args.bucket
+        self.fingerprint = get_settings_fingerprint(args)
+        self.key = "{0}|{1}|{2}".format(path, self.bucket, self.fingerprint)
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self._hash = None
+
+    @property
+    def file_hash(self):
+        if self._hash is None:
+            self._hash = get_file_hash(self.path)
+        return self._hash
+
+    def lookup(self, get_generation):
+        '''
+        This function finds a previous upload of this file's content with the same
+        settings, whose objects are still the ones it uploaded. get_generation(bucket,
+        name) gives the generation of an object, which changes whenever it's
+        overwritten, or None if it doesn't exist.
+
+        Returns: A list of the saved details of every object uploaded, or None.
+        '''
+        with _manifest_lock:
+            manifest = read_manifest()
+
+        entry = manifest.get(self.key)
+        if entry and entry['size'] == self.size and entry['mtime'] == self.mtime:
+            self._hash = entry['sha256']
+            candidates = [entry]
+        else:
+            candidates = [e for e in manifest.values()
+                          if e['size'] == self.size
+                          and e['bucket'] == self.bucket
+                          and e['fingerprint'] == self.fingerprint
+                          and e['sha256'] == self.file_hash]
+
+        for candidate in candidates:
+            uploads = candidate.get('uploads')
+            if uploads and all(upload.get('generation') is not None
+                               and get_generation(self.bucket, upload['file_upload_name']) == upload['generation']
+                               for upload in uploads):
+                return uploads
+        return None
+
+    def record(self, uploads, get_generation):
+        '''
+        This function saves the details of the objects this file was uploaded as,
+        along with their generations from get_generation(bucket, name), so objects
+        overwritten by another upload aren't reused.
+        '''
+        uploads = [dict(upload, generation=get_generation(self.bucket, upload['file_upload_name']))
+                   for upload in uploads]
+        entry = {
+            "path": self.path,
+            "size": self.size,
+            "mtime": self.mtime,
+            "sha256": self.file_hash,
+            "bucket": self.bucket,
+            "fingerprint": self.fingerprint,
+            "uploaded_at": time.time(),
+            "uploads": uploads
+        }
+        with _manifest_lock:
+            manifest = read_manifest()
+            manifest[self.key] = entry
+            write_manifest(manifest)
@@ -0,0 +1,59 @@
+"""bq_upload.userdata: where bq-upload keeps its state between runs."""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+def get_user_data_dir(*subfolders):
+    '''
+    This function returns a folder in the user's data directory, creating it if
+    it doesn't exist. BQ_UPLOAD_DATA_DIR overrides the location.
+
+    Returns: String of the absolute folder path.
+    '''
+    root = os.environ.get("BQ_UPLOAD_DATA_DIR")
+    if not root:
+        if sys.platform == "win32":
+            root = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "bq_upload")
+        else:
+            root = os.path.join(os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share")),
+                                "bq_upload")
+
+    path = os.path.join(root, *subfolders)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextmanager
+def lock_user_data(name):
+    '''
+    This function holds a lock shared with every other bq-upload process, for state
+    in the user's data directory which is read and rewritten, so runs at the same
+    time don't lose each other's changes. The lock is released when its process
+    ends, even if it crashes.
+    '''
+    with open(os.path.join(get_user_data_dir(), name + ".lock"), 'a+b') as f:
+        if sys.platform == "win32":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    # This only tries for 10 seconds before raising, so it's retried.
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
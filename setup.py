@@ -31,5 +31,10 @@ setup(
     author="Dominic Woodman",
     author_email="domwoodman@gmail.com",
     url="https://www.domwoodman.com",
+    extras_require={
+        "python": ["google-cloud-storage", "google-cloud-bigquery"],
+        "parquet": ["pyarrow"],
+        "avro": ["fastavro"]
+        },
     include_package_data=True
     )
\ No newline at end of file
@@ -0,0 +1,25 @@
+import zipfile
+
+from bq_upload.archives import upload_archive_members
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.objects = {}
+
+    def upload_stream(self, stream, bucket, object_name):
+        self.objects[object_name] = stream.read()
+
+
+def test_compress_leaves_avro_members_uncompressed(tmp_path):
+    path = tmp_path / "mixed.zip"
+    with zipfile.ZipFile(str(path), "w") as archive:
+        archive.writestr("x.avro", b"Obj\x01avro")
+        archive.writestr("y.csv", "a,b\n1,2\n")
+    backend = RecordingBackend()
+
+    uploads = upload_archive_members(backend, str(path), "bucket", compress=True)
+
+    assert [(upload["file_upload_name"], upload["file_format"]) for upload in uploads] == [
+        ("mixed_x.avro", "AVRO"), ("mixed_y.csv.gz", "CSV")]
+    assert backend.objects["mixed_x.avro"] == b"Obj\x01avro"
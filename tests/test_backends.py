@@ -0,0 +1,125 @@
+import io
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from bq_upload.archives import GeneratorReader
+from bq_upload.backends import CliBackend, ClientBackend, LocalBackend
+from bq_upload.composite import FileRangeReader
+
+FAKE_SDK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fake_sdk")
+
+
+class FakeBlob:
+    def __init__(self):
+        self.data = None
+        self.chunk_size = None
+
+    def upload_from_file(self, stream, size=None):
+        if size is None:
+            # Streams of unknown size are read a chunk at a time, and the upload only
+            # finishes when a read comes back short.
+            assert self.chunk_size
+            data = b""
+            for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+                data += chunk
+            self.data = data
+            return
+        # The resumable upload reads the stream in chunks, seeking back on retries.
+        assert stream.tell() == 0
+        first = stream.read(3)
+        stream.seek(0)
+        assert stream.read(3) == first
+        stream.seek(0)
+        self.data = stream.read(size)
+
+
+class FakeBucket:
+    def __init__(self, blob):
+        self._blob = blob
+        self.deleted = []
+
+    def blob(self, name, chunk_size=None):
+        self._blob.chunk_size = chunk_size
+        return self._blob
+
+    def delete_blobs(self, names, on_error=None):
+        self.deleted.extend(names)
+
+
+class FailingStream(io.RawIOBase):
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        raise ValueError("The processing failed.")
+
+
+def make_backend(blob):
+    backend = ClientBackend.__new__(ClientBackend)
+    backend.bucket = FakeBucket(blob)
+    backend._clients = {"storage": SimpleNamespace(bucket=lambda name: backend.bucket)}
+    backend._lock = threading.Lock()
+    backend._exceptions = SimpleNamespace(GoogleAPIError=OSError)
+    return backend
+
+
+def test_file_range_reader_seeks_within_its_range(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"0123456789")
+    with FileRangeReader(str(path), 3, 4) as part:
+        assert part.read() == b"3456"
+        assert part.tell() == 4
+        assert part.seek(1) == 1
+        assert part.read(2) == b"45"
+        assert part.seek(0, io.SEEK_END) == 4
+        assert part.read() == b""
+
+
+def test_upload_stream_uploads_a_file_range_with_its_size(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"0123456789")
+    blob = FakeBlob()
+    with FileRangeReader(str(path), 2, 5) as part:
+        make_backend(blob).upload_stream(part, "bucket", "part", 5)
+    assert blob.data == b"23456"
+
+
+def test_upload_stream_copies_streams_of_unknown_size():
+    blob = FakeBlob()
+    stream = io.BufferedReader(io.BytesIO(b"generated"))
+    make_backend(blob).upload_stream(stream, "bucket", "object")
+    assert blob.data == b"generated"
+
+
+def test_upload_stream_deletes_the_object_if_the_stream_fails():
+    blob = FakeBlob()
+    backend = make_backend(blob)
+    with pytest.raises(ValueError):
+        backend.upload_stream(FailingStream(), "bucket", "object")
+    assert blob.data is None
+    assert backend.bucket.deleted == ["object"]
+
+
+def test_local_upload_stream_deletes_the_object_if_the_stream_fails(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    backend.create_bucket(None, "bucket")
+    with pytest.raises(ValueError):
+        backend.upload_stream(FailingStream(), "bucket", "object")
+    assert not backend.object_exists("bucket", "object")
+
+
+def test_cli_upload_stream_stops_gsutil_if_the_stream_fails(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", FAKE_SDK + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_SDK_ROOT", str(tmp_path))
+    LocalBackend(str(tmp_path)).create_bucket(None, "bucket")
+    def blocks():
+        yield b"a,b\n" * 500000
+        raise ValueError("The processing failed.")
+
+    stream = io.BufferedReader(GeneratorReader(blocks()))
+    with pytest.raises(ValueError):
+        CliBackend().upload_stream(stream, "bucket", "object")
+    assert not LocalBackend(str(tmp_path)).object_exists("bucket", "object")
@@ -0,0 +1,28 @@
+import sys
+import json
+
+from bq_upload import bootstrap
+
+
+def run(monkeypatch, *argv):
+    monkeypatch.setattr(bootstrap.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(sys, "argv", ["bq-upload"] + list(argv))
+    bootstrap.main()
+
+
+def test_cached_pandas_processed_file_is_loaded_as_utf8(tmp_path, monkeypatch):
+    monkeypatch.setenv("BQ_UPLOAD_DATA_DIR", str(tmp_path / "userdata"))
+    (tmp_path / "userdata").mkdir()
+    (tmp_path / "local" / "bkt").mkdir(parents=True)
+    path = tmp_path / "latin1.csv"
+    path.write_text("id,name,when\n" + "".join("{0},caf\xe9{0},2020-01-{1:02d}\n".format(i, i % 28 + 1)
+                                               for i in range(50)), encoding="latin-1")
+
+    for _ in range(2):
+        run(monkeypatch, str(path), "bkt", "ds", "tbl", "-b", "local", "-lb", str(tmp_path / "local"),
+            "-nm", "True", "-gd", "True", "-e", "latin-1")
+
+    # The second run reuses the upload pandas wrote as UTF-8.
+    with open(str(tmp_path / "local" / "bigquery" / "ds" / "loads.jsonl")) as f:
+        encodings = [json.loads(line)['load_options']['encoding'] for line in f]
+    assert encodings == ["UTF-8", "UTF-8"]
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from argparse import Namespace
+
+from bq_upload import journal
+from bq_upload.journal import RunJournal, get_journal_path, get_run_key, prune_journal, read_entries
+from bq_upload.userdata import lock_user_data
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_args():
+    return Namespace(path="data.csv", bucket="bucket", dataset="dataset", table="table")
+
+
+def write_entries(entries):
+    with open(get_journal_path(), 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+def test_prune_drops_runs_older_than_the_max_age(tmp_path, monkeypatch):
+    monkeypatch.setenv("BQ_UPLOAD_DATA_DIR", str(tmp_path))
+    now = time.time()
+    write_entries([
+        {"run": "old", "event": "run", "key": {}, "files": ["a.csv"], "time": now - 100},
+        {"run": "old", "event": "file", "file": "a.csv", "state": "loaded", "time": now - 90},
+        {"run": "new", "event": "run", "key": {}, "files": ["b.csv"], "time": now - 10},
+    ])
+
+    assert prune_journal(max_age=50) == 1
+    assert [entry['run'] for entry in read_entries()] == ["new"]
+
+
+def test_prune_keeps_a_run_with_recent_entries(tmp_path, monkeypatch):
+    monkeypatch.setenv("BQ_UPLOAD_DATA_DIR", str(tmp_path))
+    now = time.time()
+    write_entries([
+        {"run": "resumed", "event": "run", "key": {}, "files": ["a.csv"], "time": now - 100},
+        {"run": "resumed", "event": "resume", "files": ["a.csv"], "time": now - 10},
+    ])
+
+    assert prune_journal(max_age=50) == 0
+    assert len(read_entries()) == 2
+
+
+def test_start_keeps_only_the_most_recent_runs(tmp_path, monkeypatch):
+    monkeypatch.setenv("BQ_UPLOAD_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(journal, "JOURNAL_MAX_RUNS", 3)
+    runs = []
+    for _ in range(5):
+        runs.append(RunJournal.start(make_args(), ["data.csv"]))
+        runs[-1].record("data.csv", journal.UPLOADED)
+
+    # Each start prunes down to the limit before adding its own run.
+    kept = {entry['run'] for entry in read_entries()}
+    assert kept == {run.run_id for run in runs[-4:]}
+    assert RunJournal.find_last(get_run_key(make_args())).run_id == runs[-1].run_id
+
+
+def test_appends_from_other_processes_wait_for_pruning(tmp_path, monkeypatch):
+    monkeypatch.setenv("BQ_UPLOAD_DATA_DIR", str(tmp_path))
+    code = ("import sys; sys.path.insert(0, {0!r}); from bq_upload.journal import append_entry; "
+            "append_entry({{'run': 'other', 'event': 'resume', 'files': []}})").format(ROOT)
+
+    with lock_user_data("journal"):
+        process = subprocess.Popen([sys.executable, "-c", code])
+        time.sleep(1)
+        # The other run can't append while the journal is locked for pruning.
+        assert process.poll() is None
+        assert read_entries() == []
+    assert process.wait(10) == 0
+    assert [entry['run'] for entry in read_entries()] == ["other"]
@@ -0,0 +1,34 @@
+import io
+import logging
+
+from bq_upload import line_index
+from bq_upload.backends import LocalBackend
+from bq_upload.line_index import LineIndex, log_error_rows
+
+
+def test_line_index_is_built_once_and_reused_for_later_errors(tmp_path, monkeypatch, caplog):
+    backend = LocalBackend(str(tmp_path))
+    backend.create_bucket(None, "bucket")
+    data = b"".join(b"row %d\n" % i for i in range(1000))
+    backend.upload_stream(io.BytesIO(data), "bucket", "data.csv")
+
+    builds = []
+    build = LineIndex.build.__func__
+
+    def counting_build(cls, reader, block_size=64):
+        builds.append(reader)
+        return build(cls, reader, block_size)
+    monkeypatch.setattr(LineIndex, "build", classmethod(counting_build))
+
+    uploads = [{"uri": "gs://bucket/data.csv", "object_name": "data.csv", "local_path": None,
+                "line_index": None}]
+    load_output = ("Error while reading data, error message: bad value starting at location {0}\n"
+                   "Error while reading data, error message: bad value starting at location {1}\n"
+                   .format(data.index(b"row 10\n"), data.index(b"row 900\n")))
+    with caplog.at_level(logging.INFO, logger=line_index.__name__):
+        log_error_rows(load_output, uploads, backend, "bucket")
+
+    assert len(builds) == 1
+    assert uploads[0]["line_index"] is not None
+    assert "row 10" in caplog.text and "is on line 11" in caplog.text
+    assert "row 900" in caplog.text and "is on line 901" in caplog.text
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from bq_upload.backends import BackendError, CliBackend, LocalBackend
+from bq_upload.metadata_cache import CachingBackend
+
+FAKE_SDK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fake_sdk")
+
+
+def test_buckets_which_fail_to_be_created_are_not_remembered(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", FAKE_SDK + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_SDK_ROOT", str(tmp_path / "sdk"))
+    monkeypatch.setenv("BQ_UPLOAD_DATA_DIR", str(tmp_path))
+    # gsutil ls lists nothing at all only if something has gone wrong.
+    LocalBackend(str(tmp_path / "sdk")).create_bucket(None, "other")
+    backend = CachingBackend(CliBackend(), 3600, "project")
+
+    monkeypatch.setenv("FAKE_SDK_FAIL", "gsutil mb")
+    with pytest.raises(BackendError):
+        backend.create_bucket("project", "bucket")
+    assert not backend.bucket_exists("project", "bucket")
+
+    monkeypatch.delenv("FAKE_SDK_FAIL")
+    backend.create_bucket("project", "bucket")
+    assert backend.bucket_exists("project", "bucket")
@@ -0,0 +1,38 @@
+import pytest
+
+from bq_upload.passthrough import MissingColumnsError, rewrite_timestamp_columns
+from bq_upload.schema import PANDAS_NA_VALUES
+
+
+def test_only_timestamp_columns_are_rewritten(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text('id,when,note\n1,01/02/2023 10:00,"a, ""b"""\n2,NA,c\n')
+    output_path = tmp_path / "out.csv"
+
+    rows = rewrite_timestamp_columns(str(path), str(output_path), {"when": "%d/%m/%Y %H:%M"},
+                                     "utf-8", ",", 0, "utf-8")
+
+    assert rows == 2
+    assert output_path.read_text() == 'id,when,note\n1,2023-02-01 10:00:00,"a, ""b"""\n2,,c\n'
+
+
+def test_missing_timestamp_columns_are_an_error(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text("id,when\n1,2023-01-01\n")
+    output_path = tmp_path / "out.csv"
+
+    with pytest.raises(MissingColumnsError, match="whem"):
+        rewrite_timestamp_columns(str(path), str(output_path), {"whem": "%Y-%m-%d"}, "utf-8", ",", 0, "utf-8")
+    assert not output_path.exists()
+
+
+def test_timestamps_are_missing_for_the_same_values_as_schema_inference(tmp_path):
+    path = tmp_path / "data.csv"
+    values = sorted(PANDAS_NA_VALUES)
+    path.write_text("id,when\n" + "".join("{0},{1}\n".format(i, value) for i, value in enumerate(values)))
+    output_path = tmp_path / "out.csv"
+
+    rewrite_timestamp_columns(str(path), str(output_path), {"when": "%Y-%m-%d"}, "utf-8", ",", 0, "utf-8")
+
+    lines = output_path.read_text().splitlines()[1:]
+    assert lines == ["{},".format(i) for i in range(len(values))]
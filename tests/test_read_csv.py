@@ -0,0 +1,17 @@
+from argparse import Namespace
+
+from bq_upload.bootstrap import read_csv_to_df
+
+
+def make_args():
+    return Namespace(delimiter=",", encoding="utf-8", timestamp_columns="No", timestamp_strptime=None)
+
+
+def test_guessed_columns_which_are_not_dates_keep_their_text(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text("id,flag,when\n1,true,2020-01-02\n2,false,2020-01-03\n")
+
+    df = read_csv_to_df(str(path), make_args(), 0, None, ["flag", "when"])
+
+    assert list(df['flag']) == ["true", "false"]
+    assert str(df['when'].dtype) == "datetime64[ns]"
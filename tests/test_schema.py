@@ -0,0 +1,31 @@
+import zipfile
+from argparse import Namespace
+
+from bq_upload.schema import infer_schema, iterate_sampled_runs
+
+
+def make_args():
+    return Namespace(pandas_processing=False, encoding="utf-8", delimiter=",")
+
+
+def test_infer_schema_reads_the_csv_inside_a_zip(tmp_path):
+    path = tmp_path / "data.zip"
+    with zipfile.ZipFile(str(path), "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("data.csv", "id,price,name\n1,2.5,a\n2,,b\n")
+
+    assert infer_schema(str(path), make_args(), 0) == "id:integer,price:float,name:string"
+
+
+def test_sampled_runs_are_the_same_every_time_and_stop_at_the_sample_size(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text("id,name\n" + "".join("{0},name {0}\n".format(i) for i in range(10000)))
+    data_start = len("id,name\n")
+
+    first = list(iterate_sampled_runs(str(path), "utf-8", ",", data_start, 500, 2))
+    second = list(iterate_sampled_runs(str(path), "utf-8", ",", data_start, 500, 2))
+
+    assert first == second
+    assert 500 <= len(first) < 600
+    # Rows come from across the file, not just the top of it.
+    assert int(first[-1][0]) > 5000
+    assert all(row == [row[0], "name " + row[0]] for row in first)
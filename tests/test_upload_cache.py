@@ -0,0 +1,31 @@
+import io
+from argparse import Namespace
+
+from bq_upload.backends import LocalBackend
+from bq_upload.upload_cache import UploadCache
+
+
+def make_args():
+    return Namespace(bucket="bucket", line_skip=1, pandas_processing=False, delimiter=",",
+                     encoding="utf-8", compress=False)
+
+
+def upload(backend, data):
+    backend.upload_stream(io.BytesIO(data), "bucket", "data.csv")
+
+
+def test_lookup_ignores_objects_overwritten_since_the_upload(tmp_path, monkeypatch):
+    monkeypatch.setenv("BQ_UPLOAD_DATA_DIR", str(tmp_path / "userdata"))
+    backend = LocalBackend(str(tmp_path / "local"))
+    backend.create_bucket(None, "bucket")
+    path = tmp_path / "data.csv"
+    path.write_text("a,b\n1,2\n")
+
+    upload(backend, path.read_bytes())
+    UploadCache(str(path), make_args()).record([{"file_upload_name": "data.csv"}],
+                                               backend.get_object_generation)
+    assert UploadCache(str(path), make_args()).lookup(backend.get_object_generation)
+
+    # Another file with the same name is uploaded to the same bucket.
+    upload(backend, b"a,b\n3,4\n")
+    assert UploadCache(str(path), make_args()).lookup(backend.get_object_generation) is None